@@ -6,9 +6,10 @@ Maneja generación de asientos contables y movimientos
 import logging
 from typing import Dict
 import db_config
+from metrics import medir_etapa, operacion_bd
 from logging_config import (
     log_section, log_step, log_info, log_success, log_error, 
-    log_warning, log_database, EMOJI
+    log_warning, log_database, log_detalle, EMOJI
 )
 
 logger = logging.getLogger(__name__)
@@ -21,6 +22,7 @@ class AccountingManager:
         self.cursor = cursor
         log_info(logger, "AccountingManager inicializado")
     
+    @medir_etapa('asiento')
     def generar_asiento_contable(self, factura_data: Dict, cod_proveedor: str, nro_comprobante: str, fecha_emision: str, ejercicio: str):
         """Genera el asiento contable de la factura"""
         log_section(logger, "GENERACIÓN DE ASIENTO CONTABLE")
@@ -107,7 +109,7 @@ class AccountingManager:
                 
                 for impuesto in factura_data['cabecera']['impuestos']:
                     if impuesto['monto'] > 0:
-                        log_info(logger, f"{EMOJI['warning']} Percepción {impuesto['tipo']}: ${impuesto['monto']:,.2f} (NO contabilizada)")
+                        log_detalle(logger, "Percepción %s: $%.2f (NO contabilizada)", impuesto['tipo'], impuesto['monto'])
                         # TODO: Descomentar cuando se defina la lógica
                         # self._insertar_movimiento(nro_asiento, CUENTA_PERCEPCION, nro_comprobante, fecha_emision, f"Percepción {impuesto['tipo']}", impuesto['monto'], 'DEBE', ejercicio)
                         # total_debe += impuesto['monto']
@@ -134,6 +136,7 @@ class AccountingManager:
             log_error(logger, f"Error generando asiento contable: {e}")
             raise
     
+    @operacion_bd
     def _insertar_movimiento(self, nro_asiento, cuenta, comprobante, fecha, descripcion, importe, posicion, ejercicio):
         """Helper para insertar movimiento contable"""
         log_database(logger, "INSERT", "ISMST_MOVIMIENTOS", f"AS_NRO={nro_asiento}, Cuenta={cuenta}, {posicion}")
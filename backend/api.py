@@ -3,25 +3,48 @@ API REST para el Sistema de Facturas IA
 Expone endpoints para la interfaz web
 """
 
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, Response, stream_with_context, g
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 import os
+import hmac
 import json
+import queue
+import threading
+import contextvars
+import time
 from datetime import datetime
+from functools import wraps
 from app import FacturasIASystem
+import db_config
+from progress import escuchar, emitir, contexto_etiquetado
+from result_index import ResultIndex
+from result_archive import ResultArchive
+from upload_store import guardar_por_contenido, sha256_de_nombre
+from pdf_splitter import dividir_pdf
+from metrics import REGISTRO, HTTP_SEGUNDOS, HTTP_REQUESTS
+import tracing
+import gemini_usage
+import profiling
 import logging
+from logging_config import setup_logging, log_warning
+
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)
 
 # Configuración
-UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), '..', 'data', 'uploads')
-PROCESSED_FOLDER = os.path.join(os.path.dirname(__file__), '..', 'data', 'processed')
+UPLOAD_FOLDER = os.path.join(db_config.DATA_DIR, 'uploads')
+PROCESSED_FOLDER = os.path.join(db_config.DATA_DIR, 'processed')
 ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg'}
 
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(PROCESSED_FOLDER, exist_ok=True)
+RESULT_INDEX_PATH = os.path.join(db_config.DATA_DIR, 'resultados.sqlite3')
+
+# Archivo de resultados + índice del historial (el mantenimiento corre en segundo plano, ver iniciar_servicios)
+indice_resultados = None
+archivo_resultados = None
+_lock_servicios = threading.Lock()
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max
@@ -29,10 +52,208 @@ app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max
 # Sistema
 sistema = None
 
+
+def _traza_entrante():
+    """(trace_id, parent_id) de un header traceparent (W3C) o X-Trace-Id, si vienen bien formados"""
+    partes = request.headers.get('traceparent', '').split('-')
+    if len(partes) == 4 and len(partes[1]) == 32 and len(partes[2]) == 16:
+        return partes[1], partes[2]
+    trace_id = request.headers.get('X-Trace-Id', '')
+    if len(trace_id) == 32 and all(c in '0123456789abcdef' for c in trace_id):
+        return trace_id, None
+    return None, None
+
+
+def iniciar_servicios():
+    """
+    Logging, carpetas de datos e índice de resultados (idempotente).
+    No corre al importar el módulo: los workers del pool de renderizado (spawn) vuelven a
+    ejecutar el script principal como __mp_main__ y no deben abrir ni migrar el índice.
+    """
+    global indice_resultados, archivo_resultados
+    if archivo_resultados is not None:
+        return
+    with _lock_servicios:
+        if archivo_resultados is not None:
+            return
+        setup_logging()
+        os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+        os.makedirs(PROCESSED_FOLDER, exist_ok=True)
+        indice_resultados = ResultIndex(RESULT_INDEX_PATH)
+        archivo_resultados = ResultArchive(PROCESSED_FOLDER, indice_resultados)
+        archivo_resultados.iniciar_mantenimiento()  # Índice al día (y compactación/retención si están habilitadas)
+
+
+@app.before_request
+def iniciar_medicion():
+    g.inicio_request = time.perf_counter()
+    iniciar_servicios()  # Sin servidor propio (WSGI), la primera request inicializa
+    if request.path.startswith('/api/'):
+        trace_id, parent_id = _traza_entrante()
+        ruta = request.url_rule.rule if request.url_rule else request.path
+        g.span_request = tracing.abrir(f"{request.method} {ruta}", trace_id, parent_id)
+
+
+@app.after_request
+def registrar_medicion(response):
+    """Latencia y estado por ruta (la regla, no la URL: /api/result/<filename> es una sola serie)"""
+    inicio = g.pop('inicio_request', None)
+    if inicio is not None:
+        ruta = request.url_rule.rule if request.url_rule else 'sin_ruta'
+        # En los streams SSE mide hasta que empieza la respuesta, no la duración del stream
+        HTTP_SEGUNDOS.observar(time.perf_counter() - inicio, ruta=ruta, metodo=request.method)
+        HTTP_REQUESTS.inc(ruta=ruta, metodo=request.method, estado=response.status_code)
+    
+    span_request = g.get('span_request')
+    if span_request is not None:
+        span_request.set(estado=response.status_code)
+        response.headers['X-Trace-Id'] = span_request.trace_id
+    return response
+
+
+@app.teardown_request
+def cerrar_traza(error=None):
+    tracing.cerrar(g.pop('span_request', None), error)
+
+
+def _token_admin_valido(token):
+    """El perfilado sólo se habilita con PROFILING_TOKEN configurado y el mismo token en el request"""
+    return bool(db_config.PROFILING_TOKEN and token) and hmac.compare_digest(token, db_config.PROFILING_TOKEN)
+
+
+def perfilable(vista):
+    """
+    Con el header X-Profile (o ?profile=) igual a PROFILING_TOKEN, el request corre bajo el
+    perfilador (X-Profile-Mode / ?profile_mode=: cprofile | muestreo) y responde X-Profile-Id
+    """
+    @wraps(vista)
+    def envuelta(*args, **kwargs):
+        token = request.headers.get('X-Profile') or request.args.get('profile')
+        if not token:
+            return vista(*args, **kwargs)
+        if not _token_admin_valido(token):
+            log_warning(logger, "Pedido de perfilado con token inválido en %s", request.path)
+            return vista(*args, **kwargs)
+        
+        modo = request.headers.get('X-Profile-Mode') or request.args.get('profile_mode', 'cprofile')
+        with profiling.perfilar(request.endpoint, tracing.trace_id_actual(), modo) as perfil:
+            respuesta = app.make_response(vista(*args, **kwargs))
+        respuesta.headers['X-Profile-Id'] = perfil['id']
+        return respuesta
+    return envuelta
+
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+def guardar_resultado(result, factura_filename=None):
+    """Guarda el resultado del procesamiento en el archivo y devuelve su nombre"""
+    return archivo_resultados.guardar(result, sha256_de_nombre(factura_filename))
+
+
+def resultado_previo(factura_filename):
+    """(nombre, resultado) del último procesamiento exitoso de los mismos bytes, o None"""
+    sha256 = sha256_de_nombre(factura_filename)
+    if sha256 is None:
+        return None
+    
+    result_filename = indice_resultados.buscar_exitoso_por_hash(sha256)
+    if result_filename is None:
+        return None
+    
+    result = archivo_resultados.leer(result_filename)
+    if result is None:
+        return None
+    return result_filename, result
+
+
+def opciones_duplicados(forzar=False):
+    """Argumentos de process_invoice_file para la detección de re-escaneos"""
+    if forzar or db_config.DUPLICADOS_PERCEPTUALES not in ('marcar', 'detener'):
+        return {}
+    return {
+        'buscar_similar': lambda huella: indice_resultados.buscar_similar(huella, db_config.DUPLICADO_DISTANCIA_MAX),
+        'detener_si_similar': db_config.DUPLICADOS_PERCEPTUALES == 'detener'
+    }
+
+
+def procesar_facturas(factura_filenames, forzar=False):
+    """
+    Procesa facturas subidas y guarda los resultados. Los PDFs con varias facturas se separan
+    y todas pasan juntas por el pipeline (render -> modelo -> BD).
+    Devuelve un resultado por archivo ({'success', 'partes', 'resultados'} si traía varias)
+    """
+    global sistema
+    
+    # (archivo de origen, factura a procesar, documento si es una parte)
+    trabajos = []
+    separados = set()
+    for i, factura_filename in enumerate(factura_filenames):
+        factura_path = os.path.join(app.config['UPLOAD_FOLDER'], factura_filename)
+        partes = dividir_pdf(factura_path, app.config['UPLOAD_FOLDER']) if db_config.SEPARAR_FACTURAS else []
+        if not partes:
+            trabajos.append((i, factura_filename, None))
+            continue
+        
+        separados.add(i)
+        emitir('separacion', f"El PDF contiene {len(partes)} facturas", "info",
+               paginas=[parte['paginas'] for parte in partes])
+        for numero, parte in enumerate(partes, 1):
+            documento = {'origen': factura_filename, 'parte': numero, 'paginas': parte['paginas']}
+            trabajos.append((i, parte['filename'], documento))
+    
+    # Las partes ya procesadas con éxito no vuelven al modelo
+    resultados = [None] * len(trabajos)
+    pendientes = []
+    for j, (_, filename, documento) in enumerate(trabajos):
+        previo = None if forzar else resultado_previo(filename)
+        if previo:
+            resultados[j] = {**previo[1], 'duplicado_de': previo[0]}
+            if documento:
+                resultados[j]['documento'] = documento
+        else:
+            pendientes.append(j)
+    
+    if pendientes:
+        if sistema is None:
+            sistema = FacturasIASystem()
+        
+        paths = [os.path.join(app.config['UPLOAD_FOLDER'], trabajos[j][1]) for j in pendientes]
+        # Los eventos de progreso de cada parte llegan al mismo stream, marcados con su número
+        contextos = [
+            contexto_etiquetado(parte=trabajos[j][2]['parte']) if trabajos[j][2] else contextvars.copy_context()
+            for j in pendientes
+        ]
+        
+        if len(paths) == 1:
+            salidas = [contextos[0].run(sistema.process_invoice_file, paths[0], **opciones_duplicados(forzar))]
+        else:
+            salidas = sistema.process_invoice_batch(paths, contextos=contextos, **opciones_duplicados(forzar))
+        
+        for j, result in zip(pendientes, salidas):
+            _, filename, documento = trabajos[j]
+            if documento:
+                result['documento'] = documento
+            if tracing.trace_id_actual():
+                result['trace_id'] = tracing.trace_id_actual()
+            guardar_resultado(result, filename)
+            resultados[j] = result
+    
+    por_archivo = []
+    for i in range(len(factura_filenames)):
+        propios = [resultados[j] for j, trabajo in enumerate(trabajos) if trabajo[0] == i]
+        if i in separados:
+            por_archivo.append({
+                'success': all(r['success'] for r in propios),
+                'partes': len(propios),
+                'resultados': propios
+            })
+        else:
+            por_archivo.append(propios[0])
+    return por_archivo
+
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Verifica que el servicio esté funcionando"""
@@ -56,18 +277,28 @@ def upload_file():
     if not allowed_file(factura_file.filename):
         return jsonify({'error': 'Tipo de archivo no permitido'}), 400
     
-    # Guardar archivo
-    factura_filename = secure_filename(factura_file.filename)
-    factura_path = os.path.join(app.config['UPLOAD_FOLDER'], factura_filename)
-    factura_file.save(factura_path)
+    # Guardar archivo por contenido (<sha256>.<ext>): re-subidas no se pisan ni se reprocesan
+    original = secure_filename(factura_file.filename)
+    extension = factura_file.filename.rsplit('.', 1)[1].lower()
+    factura_filename, sha256, nuevo = guardar_por_contenido(factura_file.stream, app.config['UPLOAD_FOLDER'], extension)
     
-    return jsonify({
+    respuesta = {
         'message': 'Archivo subido correctamente',
-        'factura': factura_filename
-    })
+        'factura': factura_filename,
+        'original': original,
+        'sha256': sha256
+    }
+    
+    previo = None if nuevo else resultado_previo(factura_filename)
+    if previo:
+        logging.info(f"Archivo ya procesado ({original}): se devuelve el resultado {previo[0]}")
+        respuesta['resultado_previo'] = {'filename': previo[0], 'resultado': previo[1]}
+    
+    return jsonify(respuesta)
 
 
 @app.route('/api/process', methods=['POST'])
+@perfilable
 def process_invoice():
     """Procesa una factura completa"""
     data = request.json
@@ -81,20 +312,13 @@ def process_invoice():
         return jsonify({'error': 'Archivo de factura no encontrado'}), 404
     
     try:
-        global sistema
-        if sistema is None:
-            sistema = FacturasIASystem()
+        # Mismos bytes ya procesados con éxito: no se vuelve a llamar al modelo ni a la BD
+        previo = None if data.get('forzar') else resultado_previo(data['factura_filename'])
+        if previo:
+            return jsonify({**previo[1], 'duplicado_de': previo[0]})
         
         # Ya no pasamos oc_path, el sistema busca en BD
-        result = sistema.process_invoice_file(factura_path)
-        
-        # Guardar resultado
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        result_filename = f"result_{timestamp}.json"
-        result_path = os.path.join(PROCESSED_FOLDER, result_filename)
-        
-        with open(result_path, 'w', encoding='utf-8') as f:
-            json.dump(result, f, indent=2, ensure_ascii=False)
+        result = procesar_facturas([data['factura_filename']], data.get('forzar'))[0]
         
         return jsonify(result)
         
@@ -103,7 +327,101 @@ def process_invoice():
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/process_stream', methods=['GET'])
+def process_invoice_stream():
+    """
+    Procesa una factura completa emitiendo el progreso como Server-Sent Events.
+    Cada evento: {etapa, mensaje, nivel, t, ...}. El último es 'fin' (con el resultado) o 'error'.
+    """
+    factura_filename = request.args.get('factura_filename')
+    
+    if not factura_filename:
+        return jsonify({'error': 'Falta nombre de archivo'}), 400
+    
+    factura_path = os.path.join(app.config['UPLOAD_FOLDER'], factura_filename)
+    
+    if not os.path.exists(factura_path):
+        return jsonify({'error': 'Archivo de factura no encontrado'}), 404
+    
+    eventos = queue.Queue()
+    
+    forzar = bool(request.args.get('forzar'))
+    previo = None if forzar else resultado_previo(factura_filename)
+    if previo:
+        eventos.put({
+            'etapa': 'fin', 'nivel': 'success', 't': 0,
+            'mensaje': f"Factura ya procesada (resultado {previo[0]})",
+            'resultado': {**previo[1], 'duplicado_de': previo[0]}
+        })
+    
+    def procesar():
+        try:
+            with escuchar(eventos.put):
+                result = procesar_facturas([factura_filename], forzar)[0]
+            
+            eventos.put({'etapa': 'fin', 'nivel': 'success' if result['success'] else 'error', 'resultado': result})
+            
+        except Exception as e:
+            logging.error(f"Error procesando factura: {e}")
+            eventos.put({'etapa': 'error', 'nivel': 'error', 'mensaje': str(e)})
+    
+    if not previo:
+        # Con una copia del contexto el procesamiento sigue en la traza del request
+        threading.Thread(target=contextvars.copy_context().run, args=(procesar,), daemon=True).start()
+    
+    def stream():
+        while True:
+            try:
+                evento = eventos.get(timeout=15)
+            except queue.Empty:
+                yield ": keepalive\n\n"  # Evita que proxies corten la conexión
+                continue
+            
+            yield f"data: {json.dumps(evento, ensure_ascii=False, default=str)}\n\n"
+            if evento['etapa'] in ('fin', 'error'):
+                break
+    
+    return Response(
+        stream_with_context(stream()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@app.route('/api/process_batch', methods=['POST'])
+def process_batch():
+    """
+    Procesa varias facturas ya subidas en el pipeline (render, modelo y BD se solapan)
+    Body: {"factura_filenames": [...], "forzar": false}
+    """
+    data = request.json
+    
+    if not data or not data.get('factura_filenames'):
+        return jsonify({'error': 'Faltan nombres de archivo'}), 400
+    
+    faltantes = [
+        f for f in data['factura_filenames']
+        if not os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], f))
+    ]
+    if faltantes:
+        return jsonify({'error': 'Archivos de factura no encontrados', 'faltantes': faltantes}), 404
+    
+    try:
+        resultados = procesar_facturas(data['factura_filenames'], data.get('forzar'))
+        
+        return jsonify({
+            'success': all(r['success'] for r in resultados),
+            'resultados': resultados,
+            'pipeline': sistema.ultimo_pipeline if sistema else None
+        })
+        
+    except Exception as e:
+        logging.error(f"Error procesando lote: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
 @app.route('/api/extract', methods=['POST'])
+@perfilable
 def extract_only():
     """Solo extrae datos de la factura (sin guardar en DB)"""
     data = request.json
@@ -121,14 +439,16 @@ def extract_only():
         if sistema is None:
             sistema = FacturasIASystem()
         
-        invoice_data = sistema.gemini.extract_invoice_data(factura_path)
+        with gemini_usage.recolectar() as llamadas:
+            invoice_data = sistema.gemini.extract_invoice_data(factura_path)
         
         if not invoice_data:
             return jsonify({'error': 'Error extrayendo datos'}), 500
         
         return jsonify({
             'success': True,
-            'data': invoice_data
+            'data': invoice_data,
+            'consumo_gemini': gemini_usage.resumen(llamadas)
         })
         
     except Exception as e:
@@ -137,6 +457,7 @@ def extract_only():
 
 
 @app.route('/api/reconcile', methods=['POST'])
+@perfilable
 def reconcile_only():
     """Solo concilia factura con OC de BD (sin guardar)"""
     data = request.json
@@ -155,29 +476,32 @@ def reconcile_only():
         if sistema is None:
             sistema = FacturasIASystem()
         
-        # 1. Extraer datos para obtener Nro OC si no se pasó
-        if not nro_oc:
-            invoice_data = sistema.gemini.extract_invoice_data(factura_path)
-            if invoice_data:
-                nro_oc = invoice_data['cabecera']['orden_compra_vinculada']['numero']
-        
-        if not nro_oc:
-            return jsonify({'error': 'No se encontró número de OC en la factura'}), 400
+        with gemini_usage.recolectar() as llamadas:
+            # 1. Extraer datos para obtener Nro OC si no se pasó
+            if not nro_oc:
+                invoice_data = sistema.gemini.extract_invoice_data(factura_path)
+                if invoice_data:
+                    nro_oc = invoice_data['cabecera']['orden_compra_vinculada']['numero']
             
-        # 2. Buscar items en BD
-        items_oc = sistema.db.obtener_items_oc(nro_oc)
-        if not items_oc:
-            return jsonify({'error': f'OC {nro_oc} no encontrada en BD'}), 404
-            
-        # 3. Conciliar
-        reconciliation = sistema.gemini.reconcile_documents(factura_path, items_oc)
+            if not nro_oc:
+                return jsonify({'error': 'No se encontró número de OC en la factura'}), 400
+                
+            # 2. Buscar items en BD (cursor compartido con el pipeline: con su lock)
+            with sistema.db.lock:
+                items_oc = sistema.db.obtener_items_oc(nro_oc)
+            if not items_oc:
+                return jsonify({'error': f'OC {nro_oc} no encontrada en BD'}), 404
+                
+            # 3. Conciliar
+            reconciliation = sistema.gemini.reconcile_documents(factura_path, items_oc)
         
         if not reconciliation:
             return jsonify({'error': 'Error en conciliación'}), 500
         
         return jsonify({
             'success': True,
-            'data': reconciliation
+            'data': reconciliation,
+            'consumo_gemini': gemini_usage.resumen(llamadas)
         })
         
     except Exception as e:
@@ -227,14 +551,17 @@ def process_oc_auto():
         # 2. PRIORIDAD 1: Buscar por CUIT (más confiable)
         if cuit_proveedor:
             logging.info(f"🔍 Buscando por CUIT: {cuit_proveedor}")
-            cod_prov = sistema.db.buscar_proveedor_por_cuit(cuit_proveedor)
+            # El cursor es compartido con el pipeline de facturas: se usa con su lock
+            with sistema.db.lock:
+                cod_prov = sistema.db.buscar_proveedor_por_cuit(cuit_proveedor)
+                row = None
+                if cod_prov:
+                    # Obtener datos completos del proveedor
+                    query = "SELECT COD, NOMBRE, NOMBRE_CORTO, CUIT, CUIL, ESTADO, DOCUM_COMPLETA FROM ISMST_PERSONAS WHERE COD = ?"
+                    sistema.db.cursor.execute(query, cod_prov)
+                    row = sistema.db.cursor.fetchone()
             
             if cod_prov:
-                # Obtener datos completos del proveedor
-                query = "SELECT COD, NOMBRE, NOMBRE_CORTO, CUIT, CUIL, ESTADO, DOCUM_COMPLETA FROM ISMST_PERSONAS WHERE COD = ?"
-                sistema.db.cursor.execute(query, cod_prov)
-                row = sistema.db.cursor.fetchone()
-                
                 if row:
                     proveedores_encontrados.append({
                         'codigo': row.COD,
@@ -254,7 +581,8 @@ def process_oc_auto():
         # 3. FALLBACK: Si no se encontró por CUIT, buscar por nombre
         if not proveedores_encontrados and nombre_proveedor:
             logging.info(f"🔍 Buscando por nombre: {nombre_proveedor}")
-            proveedores_encontrados = sistema.db.buscar_proveedor_por_nombre(nombre_proveedor)
+            with sistema.db.lock:
+                proveedores_encontrados = sistema.db.buscar_proveedor_por_nombre(nombre_proveedor)
             match_type = 'NOMBRE_SIMILAR'
             
             if proveedores_encontrados:
@@ -283,7 +611,8 @@ def process_oc_auto():
         
         for prov in proveedores_encontrados:
             # Usar el nuevo método optimizado
-            ocs = sistema.db.obtener_ocs_activas_proveedor(prov['codigo'])
+            with sistema.db.lock:
+                ocs = sistema.db.obtener_ocs_activas_proveedor(prov['codigo'])
             
             resultado['proveedores'].append({
                 **prov,
@@ -309,39 +638,100 @@ def process_oc_auto():
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/model_tiers', methods=['GET'])
+def model_tiers_report():
+    """Reporte de tiering de modelos: latencia por tier y tasa de escalamiento"""
+    if sistema is None:
+        return jsonify({'extracciones': 0, 'tiers': {}})
+    
+    return jsonify(sistema.gemini.tier_stats.reporte())
+
+
+@app.route('/api/db_stats', methods=['GET'])
+def db_stats_report():
+    """
+    Estadísticas por consulta SQL y consultas lentas recientes
+    Query params: orden (segundos_total | segundos_max | ejecuciones | lentas | errores | filas), limite
+    """
+    if sistema is None:
+        return jsonify({'consultas': [], 'lentas_recientes': []})
+    
+    return jsonify(sistema.db.estadisticas_consultas(
+        request.args.get('orden', 'segundos_total'),
+        request.args.get('limite', 50, type=int)
+    ))
+
+
+@app.route('/api/gemini_usage', methods=['GET'])
+def gemini_usage_report():
+    """
+    Consumo de Gemini (tokens, imágenes, bytes, latencia, reintentos) de los resultados guardados
+    Query params: agrupar (lista separada por comas de dia, proveedor, modelo, proposito; por defecto
+    dia,proveedor,modelo), desde, hasta (YYYY-MM-DD), proveedor (nombre o CUIT)
+    """
+    try:
+        agrupar = request.args.get('agrupar', 'dia,proveedor,modelo')
+        return jsonify(indice_resultados.consumo_gemini(
+            [clave.strip() for clave in agrupar.split(',') if clave.strip()],
+            desde=request.args.get('desde'),
+            hasta=request.args.get('hasta'),
+            proveedor=request.args.get('proveedor')
+        ))
+        
+    except Exception as e:
+        logging.error(f"Error obteniendo consumo de Gemini: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/profiles', methods=['GET'])
+def profiles_list():
+    """Perfiles guardados por el perfilado a pedido (requiere el token en X-Profile o ?profile=)"""
+    if not db_config.PROFILING_TOKEN:
+        return jsonify({'error': 'Perfilado deshabilitado (PROFILING_TOKEN)'}), 404
+    if not _token_admin_valido(request.headers.get('X-Profile') or request.args.get('profile')):
+        return jsonify({'error': 'Token de perfilado inválido'}), 403
+    
+    return jsonify({'perfiles': profiling.listar()})
+
+
+@app.route('/api/profiles/<nombre>', methods=['GET'])
+def profile_file(nombre):
+    """Descarga un archivo de perfil (.prof, .folded, .txt)"""
+    if not db_config.PROFILING_TOKEN:
+        return jsonify({'error': 'Perfilado deshabilitado (PROFILING_TOKEN)'}), 404
+    if not _token_admin_valido(request.headers.get('X-Profile') or request.args.get('profile')):
+        return jsonify({'error': 'Token de perfilado inválido'}), 403
+    
+    return send_from_directory(os.path.abspath(db_config.PROFILING_DIR), secure_filename(nombre), as_attachment=True)
+
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics_report():
+    """Métricas (latencias p50/p95/p99, contadores y errores) en formato de texto de Prometheus"""
+    return Response(REGISTRO.exportar(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
 @app.route('/api/history', methods=['GET'])
 def get_history():
-    """Obtiene historial de facturas procesadas"""
+    """
+    Obtiene historial de facturas procesadas (paginado, desde el índice).
+    Query params: page, page_size, desde, hasta (YYYY-MM-DD), proveedor (nombre o CUIT), estado (ok|error),
+    cursor ('siguiente' de la página anterior)
+    """
     try:
-        results = []
-        for filename in os.listdir(PROCESSED_FOLDER):
-            if filename.endswith('.json'):
-                filepath = os.path.join(PROCESSED_FOLDER, filename)
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    
-                    # Navegación segura para evitar errores con None
-                    extraction = data.get('extraction')
-                    preview = {}
-                    if extraction and isinstance(extraction, dict):
-                        cabecera = extraction.get('cabecera')
-                        if cabecera and isinstance(cabecera, dict):
-                            factura = cabecera.get('factura')
-                            if factura and isinstance(factura, dict):
-                                preview = factura
-                    
-                    results.append({
-                        'filename': filename,
-                        'timestamp': filename.replace('result_', '').replace('.json', ''),
-                        'success': data.get('success', False),
-                        'preview': preview,
-                        'has_errors': len(data.get('errors', [])) > 0,
-                        'error_message': data.get('errors', [None])[0] if data.get('errors') else None
-                    })
-        
-        results.sort(key=lambda x: x['timestamp'], reverse=True)
-        return jsonify(results)
-        
+        pagina = indice_resultados.listar(
+            page=request.args.get('page', 1, type=int),
+            page_size=request.args.get('page_size', 50, type=int),
+            desde=request.args.get('desde'),
+            hasta=request.args.get('hasta'),
+            proveedor=request.args.get('proveedor'),
+            estado=request.args.get('estado'),
+            cursor=request.args.get('cursor')
+        )
+        return jsonify(pagina)
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logging.error(f"Error obteniendo historial: {e}")
         return jsonify({'error': str(e)}), 500
@@ -351,13 +741,10 @@ def get_history():
 def get_result(filename):
     """Obtiene un resultado específico"""
     try:
-        filepath = os.path.join(PROCESSED_FOLDER, filename)
-        if not os.path.exists(filepath):
+        data = archivo_resultados.leer(filename)
+        if data is None:
             return jsonify({'error': 'Resultado no encontrado'}), 404
         
-        with open(filepath, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
         return jsonify(data)
         
     except Exception as e:
@@ -379,4 +766,5 @@ def serve_static(path):
 
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    iniciar_servicios()
+    app.run(host='0.0.0.0', port=db_config.API_PUERTO, debug=True)
@@ -4,26 +4,38 @@ Orquestador principal - Versión modularizada
 """
 
 import os
+import time
 import logging
-from typing import Optional, Dict
+import contextvars
+from typing import Callable, Optional, Dict, List, Tuple
+import fitz  # PyMuPDF
 from dotenv import load_dotenv
 
 # Módulos propios
 from gemini_processor import GeminiProcessor
 from database_integrator import DatabaseIntegrator
 from accounting import AccountingManager
+from progress import emitir
+from perceptual_hash import huella_perceptual
+from pipeline import Pipeline, Etapa, Terminado
+from prefetch import Prefetcher, Prefetch
+from model_tiering import es_pdf_digital
+from cuit import normalizar_cuit
+from metrics import etapa, ETAPA_SEGUNDOS, ETAPA_ERRORES, FACTURAS
+import tracing
+import gemini_usage
 import db_config
 from logging_config import (
     setup_logging, log_section, log_step, log_info, log_success, 
-    log_error, log_warning, log_database, EMOJI
+    log_error, log_warning, log_database, log_detalle, EMOJI
 )
 
 # Configuración
 load_dotenv()
 API_KEY = os.getenv("GEMINI_API_KEY")
 
-# Configurar logging mejorado
-logger = setup_logging()
+# El logging lo configura el punto de entrada (api.iniciar_servicios, main, benchmark)
+logger = logging.getLogger(__name__)
 
 
 class FacturasIASystem:
@@ -42,15 +54,25 @@ class FacturasIASystem:
             log_step(logger, 3, "Inicializando módulo de Contabilidad")
             self.accounting = AccountingManager(self.db.cursor)
             
+            # Estado del proveedor y OCs consultados mientras Gemini extrae (conexiones propias)
+            self.prefetch = Prefetcher(self.db) if db_config.PREFETCH_PROVEEDOR else None
+            
+            self.ultimo_pipeline = None  # Métricas por etapa del último process_invoice_batch
+            
             log_success(logger, "Sistema inicializado correctamente")
             
         except Exception as e:
             log_error(logger, f"Error en inicialización: {e}")
             raise
     
-    def process_invoice_file(self, file_path: str) -> Dict:
+    def process_invoice_file(self, file_path: str,
+                             buscar_similar: Optional[Callable[[str], Optional[Tuple[str, int, Tuple]]]] = None,
+                             detener_si_similar: bool = False) -> Dict:
         """
         Procesa una factura completa:
+        0. Huella perceptual de la primera página (si buscar_similar encuentra una factura ya
+           procesada parecida y la extracción da el mismo CUIT y comprobante, es un re-escaneo: se
+           marca; con detener_si_similar no se inserta en la BD)
         1. Extrae datos con Gemini
         2. Busca OC en BD (automáticamente por proveedor)
         3. Inserta en base de datos
@@ -59,36 +81,217 @@ class FacturasIASystem:
         log_section(logger, "PROCESAMIENTO COMPLETO DE FACTURA")
         log_info(logger, f"Archivo: {os.path.basename(file_path)}")
         
-        result = {
+        trabajo = None
+        with tracing.span('procesar_factura', archivo=os.path.basename(file_path)) as actual:
+            try:
+                trabajo = self._etapa_render(file_path, buscar_similar, detener_si_similar)
+                if not trabajo['fin']:
+                    self._etapa_extraccion(trabajo)
+                if not trabajo['fin']:
+                    self._etapa_bd(trabajo)
+                result = trabajo['result']
+                
+            except Exception as e:
+                log_error(logger, f"Error en procesamiento: {e}")
+                result = trabajo['result'] if trabajo else self._resultado_vacio()
+                result['errors'].append(str(e))
+            
+            if actual is not None:
+                actual.set(success=result['success'], errores=len(result['errors']))
+            return self._contar(result)
+    
+    def process_invoice_batch(self, file_paths: List[str],
+                              buscar_similar: Optional[Callable[[str], Optional[Tuple[str, int, Tuple]]]] = None,
+                              detener_si_similar: bool = False,
+                              contextos: Optional[List[contextvars.Context]] = None) -> List[Dict]:
+        """
+        Procesa varias facturas en un pipeline: render -> modelo -> BD, con colas acotadas
+        entre etapas. La factura N+1 se renderiza mientras la N espera a Gemini y la N-1
+        se escribe en la BD. La etapa de BD es de a una (el cursor es compartido).
+        Devuelve los resultados en el mismo orden; las métricas quedan en self.ultimo_pipeline.
+        """
+        log_section(logger, f"PROCESAMIENTO EN PIPELINE: {len(file_paths)} FACTURA(S)")
+        
+        def render(file_path):
+            trabajo = self._etapa_render(file_path, buscar_similar, detener_si_similar)
+            return Terminado(trabajo) if trabajo['fin'] else trabajo
+        
+        def seguro(etapa):
+            # Un error conserva lo que la factura ya tenía (ej. la extracción si falla la BD)
+            def ejecutar(trabajo):
+                try:
+                    etapa(trabajo)
+                except Exception as e:
+                    log_error(logger, f"Error en procesamiento: {e}")
+                    trabajo['result']['errors'].append(str(e))
+                    trabajo['fin'] = True
+                return Terminado(trabajo) if trabajo['fin'] else trabajo
+            return ejecutar
+        
+        # Una traza por lote; cada factura es un span hijo que se cierra al salir del pipeline
+        lote = tracing.abrir('procesar_lote', facturas=len(file_paths))
+        contextos = contextos or [contextvars.copy_context() for _ in file_paths]
+        spans = [
+            contexto.run(tracing.abrir, 'procesar_factura', lote.trace_id if lote else None,
+                         lote.span_id if lote else None, archivo=os.path.basename(file_path))
+            for contexto, file_path in zip(contextos, file_paths)
+        ]
+        
+        def al_terminar(indice, salida):
+            error = salida if isinstance(salida, Exception) else None
+            if spans[indice] is not None and error is None:
+                result = salida['result']
+                spans[indice].set(success=result['success'], errores=len(result['errors']))
+            tracing.cerrar(spans[indice], error)
+        
+        pipeline = Pipeline([
+            Etapa('render', render, db_config.PIPELINE_RENDER),
+            Etapa('modelo', seguro(self._etapa_extraccion), db_config.PIPELINE_MODELO),
+            Etapa('bd', seguro(self._etapa_bd), 1),
+        ], capacidad=db_config.PIPELINE_COLA)
+        
+        salidas = pipeline.procesar(file_paths, contextos, al_terminar)
+        self.ultimo_pipeline = pipeline.metricas()
+        if lote is not None:
+            lote.set(duracion_pipeline=self.ultimo_pipeline['total'].get('duracion'))
+        tracing.cerrar(lote)
+        log_info(logger, f"Pipeline terminado: {self.ultimo_pipeline['total']}")
+        
+        resultados = []
+        for file_path, salida in zip(file_paths, salidas):
+            if isinstance(salida, Exception):
+                log_error(logger, f"Error en procesamiento de {os.path.basename(file_path)}: {salida}")
+                result = self._resultado_vacio()
+                result['errors'].append(str(salida))
+                resultados.append(self._contar(result))
+            else:
+                resultados.append(self._contar(salida['result']))
+        return resultados
+    
+    @staticmethod
+    def _contar(result: Dict) -> Dict:
+        FACTURAS.inc(resultado='ok' if result['success'] else 'error')
+        return result
+    
+    @staticmethod
+    def _resultado_vacio() -> Dict:
+        return {
             'success': False,
             'extraction': None,
             'reconciliation': None,
             'database': None,
             'errors': []
         }
+    
+    def _etapa_render(self, file_path: str, buscar_similar=None, detener_si_similar: bool = False) -> Dict:
+        """Páginas renderizadas, huella perceptual y chequeo de re-escaneo (CPU)"""
+        result = self._resultado_vacio()
+        trabajo = {'file_path': file_path, 'result': result, 'imagenes': None, 'digital': None, 'fin': False,
+                   'prefetch': None, 'similar': None, 'detener_si_similar': detener_si_similar}
+        
+        # ===== PASO 1: Extracción =====
+        log_section(logger, "PASO 1: EXTRACCIÓN DE DATOS")
+        emitir('inicio', f"Procesando {os.path.basename(file_path)}")
         
+        # El PDF se abre una vez para el CUIT anticipado, el render y la capa de texto (tier)
+        doc = None
+        if file_path.lower().endswith('.pdf'):
+            try:
+                doc = fitz.open(file_path)
+            except Exception as e:
+                log_warning(logger, f"No se pudo abrir el PDF: {e}")
         try:
-            # ===== PASO 1: Extracción =====
-            log_section(logger, "PASO 1: EXTRACCIÓN DE DATOS")
-            
-            invoice_data = self.gemini.extract_invoice_data(file_path)
-            if not invoice_data:
-                result['errors'].append("Error en extracción de datos")
-                return result
-            
-            result['extraction'] = invoice_data
-            
-            # ===== PASO 2: Búsqueda Automática de OC =====
-            # NOTA: Ignoramos el número de OC que Gemini extrae porque a veces lee mal
-            # Siempre buscamos OCs activas del proveedor
-            log_section(logger, "PASO 2: BÚSQUEDA AUTOMÁTICA DE OC")
-            log_info(logger, "🔍 Buscando OCs abiertas del proveedor en la base de datos...")
-            
-            cuit_prov = invoice_data['cabecera']['proveedor']['cuit']
-            nombre_prov = invoice_data['cabecera']['proveedor']['nombre']
-            cod_prov = None
-            
-            # Buscar proveedor
+            if self.prefetch:
+                trabajo['prefetch'] = self.prefetch.iniciar(file_path, doc)
+            imagenes = self.gemini.cargar_imagenes(file_path, doc)
+            trabajo['digital'] = es_pdf_digital(doc)
+        finally:
+            if doc is not None:
+                doc.close()
+        trabajo['imagenes'] = imagenes
+        if imagenes:
+            with etapa('duplicado'):
+                result['huella'] = huella_perceptual(imagenes[0])
+                similar = buscar_similar(result['huella']) if buscar_similar else None
+            if similar:
+                # Facturas distintas con el diseño de un mismo proveedor dan huellas cercanas:
+                # se confirma con el comprobante extraído (ver _confirmar_duplicado)
+                log_info(logger, f"Huella parecida a {similar[0]} (distancia {similar[1]}): se compara el comprobante")
+                trabajo['similar'] = similar
+        return trabajo
+    
+    @staticmethod
+    def _comprobante(cuit, punto_emision, numero) -> Optional[Tuple[str, int, int]]:
+        """(cuit, punto, número) comparables ('0003' == '3'); None si falta alguno"""
+        cuit = normalizar_cuit(cuit)
+        punto, numero = (''.join(c for c in str(v or '') if c.isdigit()) for v in (punto_emision, numero))
+        if not cuit or not punto or not numero:
+            return None
+        return cuit, int(punto), int(numero)
+    
+    def _confirmar_duplicado(self, trabajo: Dict, invoice_data: Dict):
+        """Marca el re-escaneo sólo si la factura parecida es el mismo comprobante del mismo proveedor"""
+        referencia, distancia, comprobante_previo = trabajo['similar']
+        cabecera = invoice_data.get('cabecera') or {}
+        factura = cabecera.get('factura') or {}
+        actual = self._comprobante((cabecera.get('proveedor') or {}).get('cuit'),
+                                   factura.get('punto_emision'), factura.get('numero_comprobante'))
+        if actual is None or actual != self._comprobante(*comprobante_previo):
+            log_info(logger, f"Misma plantilla que {referencia} pero otro comprobante: no es un duplicado")
+            return
+        
+        result = trabajo['result']
+        mensaje = f"Duplicado (re-escaneo) de {referencia} (distancia {distancia}, mismo comprobante)"
+        log_warning(logger, mensaje)
+        emitir('duplicado', mensaje, "warning", resultado=referencia, distancia=distancia)
+        result['posible_duplicado'] = {'resultado': referencia, 'distancia': distancia}
+        if trabajo['detener_si_similar']:
+            result['errors'].append(f"{mensaje}. Procesar con 'forzar' si es otra factura")
+            trabajo['fin'] = True
+    
+    def _etapa_extraccion(self, trabajo: Dict) -> Dict:
+        """Extracción con Gemini (espera de red); las llamadas al modelo quedan en result['consumo_gemini']"""
+        result = trabajo['result']
+        with gemini_usage.recolectar() as llamadas:
+            invoice_data = self.gemini.extract_invoice_data(trabajo['file_path'], trabajo['imagenes'], trabajo['digital'])
+        result['consumo_gemini'] = gemini_usage.resumen(llamadas)
+        trabajo['imagenes'] = None  # Libera las páginas antes de esperar turno en la BD
+        
+        if not invoice_data:
+            result['errors'].append("Error en extracción de datos")
+            emitir('extraccion', "Error en extracción de datos", "error")
+            trabajo['fin'] = True
+            return trabajo
+        
+        result['extraction'] = invoice_data
+        if trabajo['similar']:
+            self._confirmar_duplicado(trabajo, invoice_data)
+        return trabajo
+    
+    def _etapa_bd(self, trabajo: Dict) -> Dict:
+        """Pasos 2 y 3 en la BD"""
+        # La BD (cursor compartido) se usa de a una factura cuando se procesan en paralelo
+        with self.db.lock, tracing.span('bd'):
+            self._integrar_en_bd(trabajo['result']['extraction'], trabajo['result'], trabajo['prefetch'])
+        return trabajo
+    
+    def _integrar_en_bd(self, invoice_data: Dict, result: Dict, prefetch: Optional[Prefetch] = None) -> Dict:
+        """
+        Pasos 2 y 3: búsqueda de proveedor/OCs e inserción (con self.db.lock tomado).
+        prefetch: consultas anticipadas; se usan si el proveedor extraído es el mismo
+        """
+        # ===== PASO 2: Búsqueda Automática de OC =====
+        # NOTA: Ignoramos el número de OC que Gemini extrae porque a veces lee mal
+        # Siempre buscamos OCs activas del proveedor
+        log_section(logger, "PASO 2: BÚSQUEDA AUTOMÁTICA DE OC")
+        log_info(logger, "🔍 Buscando OCs abiertas del proveedor en la base de datos...")
+        
+        cuit_prov = invoice_data['cabecera']['proveedor']['cuit']
+        nombre_prov = invoice_data['cabecera']['proveedor']['nombre']
+        cod_prov = None
+        
+        # Buscar proveedor
+        with etapa('proveedor'):
             if cuit_prov:
                 cod_prov = self.db.buscar_proveedor_por_cuit(cuit_prov)
             
@@ -96,46 +299,52 @@ class FacturasIASystem:
                 matches = self.db.buscar_proveedor_por_nombre(nombre_prov)
                 if matches:
                     cod_prov = matches[0]['codigo']
-            
-            if cod_prov:
+        
+        if cod_prov:
+            emitir('proveedor', f"Proveedor identificado: {cod_prov}", "success", codigo=cod_prov)
+            ocs_activas = prefetch.ocs(cod_prov) if prefetch else None
+            if ocs_activas is None:
                 ocs_activas = self.db.obtener_ocs_activas_proveedor(cod_prov)
-                if ocs_activas:
-                    log_success(logger, f"✅ Se encontraron {len(ocs_activas)} OCs activas para este proveedor")
-                    log_info(logger, "OCs encontradas:")
-                    for oc in ocs_activas:
-                        log_info(logger, f"  • OC {oc['nro_orden']} - Estado: {oc['estado']}")
-                    log_warning(logger, "⚠️ Match automático de items pendiente de implementar")
-                else:
-                    log_warning(logger, "El proveedor no tiene OCs pendientes de facturar")
             else:
-                log_warning(logger, "No se pudo identificar al proveedor para buscar OCs")
-            
-            # ===== PASO 3: Integración a BD =====
-            log_section(logger, "PASO 3: INTEGRACIÓN A BASE DE DATOS")
-            
-            success, message = self._procesar_factura_en_bd(
-                invoice_data,
-                result.get('reconciliation')
-            )
-            
-            result['database'] = {
-                'success': success,
-                'message': message
-            }
-            result['success'] = success
-            
-            if not success:
-                result['errors'].append(message)
-            
-            return result
-            
-        except Exception as e:
-            log_error(logger, f"Error en procesamiento: {e}")
-            result['errors'].append(str(e))
-            return result
+                log_info(logger, "OCs del proveedor ya consultadas durante la extracción")
+            emitir('ocs', f"{len(ocs_activas)} OC(s) activa(s) del proveedor", ocs=len(ocs_activas))
+            if ocs_activas:
+                log_success(logger, f"✅ Se encontraron {len(ocs_activas)} OCs activas para este proveedor")
+                log_info(logger, "OCs encontradas:")
+                for oc in ocs_activas:
+                    log_detalle(logger, "OC %s - Estado: %s", oc['nro_orden'], oc['estado'])
+                log_warning(logger, "⚠️ Match automático de items pendiente de implementar")
+            else:
+                log_warning(logger, "El proveedor no tiene OCs pendientes de facturar")
+        else:
+            log_warning(logger, "No se pudo identificar al proveedor para buscar OCs")
+            emitir('proveedor', "No se pudo identificar al proveedor para buscar OCs", "warning")
+        
+        # ===== PASO 3: Integración a BD =====
+        log_section(logger, "PASO 3: INTEGRACIÓN A BASE DE DATOS")
+        emitir('bd', "Iniciando transacción en base de datos")
+        
+        success, message = self._procesar_factura_en_bd(
+            invoice_data,
+            result.get('reconciliation'),
+            prefetch
+        )
+        
+        result['database'] = {
+            'success': success,
+            'message': message
+        }
+        result['success'] = success
+        
+        if not success:
+            result['errors'].append(message)
+        
+        return result
     
-    def _procesar_factura_en_bd(self, factura_data: Dict, conciliacion_data: Optional[Dict] = None) -> tuple:
+    def _procesar_factura_en_bd(self, factura_data: Dict, conciliacion_data: Optional[Dict] = None,
+                                prefetch: Optional[Prefetch] = None) -> tuple:
         """Procesa e inserta factura en la base de datos"""
+        etapa_actual = 'validacion'  # Para contar en qué etapa terminó un ROLLBACK
         try:
             log_step(logger, 1, "Iniciando transacción")
             log_database(logger, "BEGIN", "TRANSACTION", "")
@@ -171,7 +380,8 @@ class FacturasIASystem:
                 else:
                     raise Exception(f"Proveedor no encontrado - CUIT: {cuit}, Nombre: {nombre_proveedor}")
             
-            activo, msg = self.db.verificar_proveedor_activo(cod_proveedor)
+            estado = prefetch.estado(cod_proveedor) if prefetch else None
+            activo, msg = estado or self.db.verificar_proveedor_activo(cod_proveedor)
             if not activo:
                 raise Exception(f"Proveedor inválido: {msg}")
             
@@ -202,6 +412,7 @@ class FacturasIASystem:
             
             # Insertar cabecera
             log_step(logger, 4, "Insertando cabecera de factura")
+            etapa_actual, inicio_etapa = 'insercion', time.perf_counter()
             cab = factura_data['cabecera']['factura']
             log_database(logger, "INSERT", "ISMST_DOCUMENTOS_CAB", f"NRO_ARCHIVO={nro_archivo}")
             
@@ -241,11 +452,12 @@ class FacturasIASystem:
                 nro_archivo
             ))
             log_success(logger, "Cabecera insertada")
+            emitir('insercion', f"Cabecera insertada (archivo {nro_archivo})", "success")
             
             # Insertar items
             log_step(logger, 5, f"Insertando {len(factura_data['items'])} items")
             for i, item in enumerate(factura_data['items'], 1):
-                log_database(logger, "INSERT", "ISMST_DOCUMENTOS_ITEM", f"Item {item['linea']}")
+                log_detalle(logger, "DB INSERT: ISMST_DOCUMENTOS_ITEM Item %s", item['linea'])
                 
                 self.db.cursor.execute("""
                     INSERT INTO ISMST_DOCUMENTOS_ITEM (
@@ -265,14 +477,16 @@ class FacturasIASystem:
                     item['cantidad'],
                     item['precio_unitario']
                 ))
-                log_success(logger, f"Item {i}/{len(factura_data['items'])} insertado: {item['descripcion'][:50]}")
+                log_detalle(logger, "Item %d/%d insertado: %.50s", i, len(factura_data['items']), item['descripcion'])
+            
+            emitir('insercion', f"{len(factura_data['items'])} item(s) insertados", "success")
             
             # Insertar impuestos
             if factura_data['cabecera']['impuestos']:
                 log_step(logger, 6, f"Insertando {len(factura_data['cabecera']['impuestos'])} impuesto(s)")
                 for impuesto in factura_data['cabecera']['impuestos']:
                     if impuesto['monto'] > 0:
-                        log_database(logger, "INSERT", "ismsv_impuestos_documento", f"{impuesto['tipo']}")
+                        log_detalle(logger, "DB INSERT: ismsv_impuestos_documento %s", impuesto['tipo'])
                         
                         self.db.cursor.execute("""
                             INSERT INTO ismsv_impuestos_documento (
@@ -292,10 +506,14 @@ class FacturasIASystem:
                         log_success(logger, f"Impuesto insertado: {impuesto['tipo']} ${impuesto['monto']:,.2f}")
             
             # Commit de la factura ANTES del asiento contable
+            ETAPA_SEGUNDOS.observar(time.perf_counter() - inicio_etapa, etapa='insercion')
             log_step(logger, 7, "Confirmando transacción de factura")
             log_database(logger, "COMMIT", "TRANSACTION", "")
+            etapa_actual, inicio_etapa = 'commit', time.perf_counter()
             self.db.cursor.execute("COMMIT TRANSACTION")
+            ETAPA_SEGUNDOS.observar(time.perf_counter() - inicio_etapa, etapa='commit')
             log_success(logger, f"✅ Factura guardada exitosamente - Archivo: {nro_archivo}")
+            emitir('commit', f"Factura guardada - Archivo: {nro_archivo}", "success", nro_archivo=nro_archivo)
             
             # Log útil para verificar en la BD
             log_info(logger, f"📋 Para verificar en la BD, ejecuta:")
@@ -326,6 +544,7 @@ class FacturasIASystem:
             return True, f"Factura procesada exitosamente. Archivo: {nro_archivo}"
             
         except Exception as e:
+            ETAPA_ERRORES.inc(etapa=etapa_actual)
             log_error(logger, f"Error en procesamiento, haciendo ROLLBACK")
             log_database(logger, "ROLLBACK", "TRANSACTION", "")
             try:
@@ -333,6 +552,7 @@ class FacturasIASystem:
             except:
                 pass  # Ya se hizo rollback
             log_error(logger, f"❌ Error: {e}")
+            emitir('bd', f"ROLLBACK: {e}", "error")
             return False, str(e)
     
     def _normalizar_fecha(self, fecha_str: str):
@@ -360,6 +580,8 @@ class FacturasIASystem:
     def close(self):
         """Cierra conexiones"""
         log_info(logger, "Cerrando sistema...")
+        if self.prefetch:
+            self.prefetch.close()
         self.db.close()
         log_success(logger, "Sistema cerrado correctamente")
 
@@ -368,6 +590,8 @@ def main():
     """Ejemplo de uso del sistema"""
     import sys
     
+    setup_logging()
+    
     if len(sys.argv) < 2:
         print("Uso: python app.py <ruta_factura>")
         return
@@ -0,0 +1,519 @@
+"""
+Benchmark del procesamiento de facturas (sin red ni SQL Server)
+Corre process_invoice_file y sus etapas (pdf_to_images, huella, extracción, resolución de
+proveedor, chequeo de duplicados, inserción en BD) sobre un corpus de PDFs/imágenes, con Gemini
+en replay (gemini_backend) y una copia de la réplica SQLite del ERP (db_backend). Por etapa
+reporta throughput, percentiles de latencia, memoria asignada (tracemalloc) y pico de RSS.
+El resultado se guarda como JSON en BENCHMARK_DIR y se compara contra una base guardada.
+
+Uso: python benchmark.py [--corpus DIR] [--repeticiones N] [--etapas a,b] [--guardar-base]
+     python benchmark.py --comparar RESULTADO.json [--base BASE.json]
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import sqlite3
+import logging
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import subprocess
+from copy import deepcopy
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+from PIL import Image
+import db_config
+from app import FacturasIASystem
+from perceptual_hash import huella_perceptual
+from logging_config import setup_logging
+
+logger = logging.getLogger(__name__)
+
+ETAPAS = ('pdf_to_images', 'huella', 'extraccion', 'proveedor', 'proveedor_nombre',
+          'duplicado_bd', 'insercion_bd', 'process_invoice_file')
+EXTENSIONES = ('.pdf', '.png', '.jpg', '.jpeg')
+
+# Tablas en las que escriben las etapas de inserción: se deshace cada factura para poder repetirla
+TABLAS_INSERCION = ('ISMST_DOCUMENTOS_CAB', 'ISMST_DOCUMENTOS_ITEM', 'ismsv_impuestos_documento',
+                    'ISMST_ASIENTOS', 'ISMST_MOVIMIENTOS')
+
+# Métricas comparadas con la base: True si más es mejor. Debajo del mínimo absoluto no hay regresión (ruido)
+COMPARADAS = {'p50_ms': False, 'p95_ms': False, 'por_segundo': True, 'memoria_pico_kb': False, 'rss_pico_mb': False}
+MINIMO_ABSOLUTO = {'p50_ms': 0.5, 'p95_ms': 0.5, 'por_segundo': 0, 'memoria_pico_kb': 64, 'rss_pico_mb': 5}
+
+
+def _percentil(ordenadas: List[float], p: float) -> Optional[float]:
+    """Percentil por rango más cercano (como en metrics)"""
+    if not ordenadas:
+        return None
+    return ordenadas[max(0, math.ceil(p * len(ordenadas)) - 1)]
+
+
+def _reiniciar_rss_pico() -> bool:
+    """Linux: vuelve el pico de RSS (VmHWM) al RSS actual, para medirlo por etapa"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _rss_pico_windows() -> Optional[float]:
+    import ctypes
+    from ctypes import wintypes
+
+    class Contadores(ctypes.Structure):
+        _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD)] + [
+            (campo, ctypes.c_size_t) for campo in (
+                'PeakWorkingSetSize', 'WorkingSetSize', 'QuotaPeakPagedPoolUsage', 'QuotaPagedPoolUsage',
+                'QuotaPeakNonPagedPoolUsage', 'QuotaNonPagedPoolUsage', 'PagefileUsage', 'PeakPagefileUsage')
+        ]
+
+    kernel32, psapi = ctypes.windll.kernel32, ctypes.windll.psapi
+    kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+    psapi.GetProcessMemoryInfo.argtypes = [wintypes.HANDLE, ctypes.c_void_p, wintypes.DWORD]
+    contadores = Contadores()
+    contadores.cb = ctypes.sizeof(contadores)
+    if not psapi.GetProcessMemoryInfo(kernel32.GetCurrentProcess(), ctypes.byref(contadores), contadores.cb):
+        return None
+    return round(contadores.PeakWorkingSetSize / 1048576, 1)
+
+
+def _rss_pico_mb() -> Optional[float]:
+    """Pico de RSS en MB: desde el último reinicio en Linux; del proceso entero en Windows/macOS"""
+    try:
+        with open('/proc/self/status') as f:
+            for linea in f:
+                if linea.startswith('VmHWM:'):
+                    return round(int(linea.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    if sys.platform == 'win32':
+        return _rss_pico_windows()
+    try:
+        import resource
+    except ImportError:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(pico / (1048576 if sys.platform == 'darwin' else 1024), 1)
+
+
+class Medicion:
+    """Observaciones de una etapa: duraciones, errores y memoria por llamada"""
+
+    def __init__(self, nombre: str):
+        self.nombre = nombre
+        self.segundos = []
+        self.errores = 0
+        self.omitidos = 0  # Archivos sin los datos que la etapa necesita (ej. sin extracción)
+        self.pico_kb = []
+        self.retenida_kb = []
+        self.rss_pico_mb = None
+
+    def resumen(self) -> Dict:
+        ordenadas = sorted(self.segundos)
+        total = sum(ordenadas)
+        ms = lambda valor: round(valor * 1000, 3) if valor is not None else None
+        picos = sorted(self.pico_kb)
+        return {
+            'llamadas': len(ordenadas),
+            'errores': self.errores,
+            'omitidos': self.omitidos,
+            'segundos_total': round(total, 4),
+            'por_segundo': round(len(ordenadas) / total, 3) if total else None,
+            'media_ms': ms(total / len(ordenadas)) if ordenadas else None,
+            'p50_ms': ms(_percentil(ordenadas, 0.50)),
+            'p95_ms': ms(_percentil(ordenadas, 0.95)),
+            'p99_ms': ms(_percentil(ordenadas, 0.99)),
+            'max_ms': ms(ordenadas[-1]) if ordenadas else None,
+            'memoria_pico_kb': round(_percentil(picos, 0.50), 1) if picos else None,
+            'memoria_pico_kb_max': round(picos[-1], 1) if picos else None,
+            'memoria_retenida_kb': round(sum(self.retenida_kb) / len(self.retenida_kb), 1) if self.retenida_kb else None,
+            'rss_pico_mb': self.rss_pico_mb,
+        }
+
+
+class Documento:
+    """Un archivo del corpus y lo que las etapas posteriores necesitan de las anteriores"""
+
+    def __init__(self, ruta: str):
+        self.ruta = ruta
+        self.nombre = os.path.basename(ruta)
+        self.paginas = []  # Rutas (PNG) o imágenes de las páginas renderizadas
+        self.extraccion = None
+        self.cod_proveedor = None
+
+    def imagenes(self) -> List[Image.Image]:
+        """Páginas abiertas de nuevo (sin decodificar), como las recibe cada etapa en el sistema"""
+        return [Image.open(p) if isinstance(p, str) else p for p in self.paginas]
+
+
+class Benchmark:
+    """Mide las etapas sobre el corpus con el sistema armado contra los reemplazos offline"""
+
+    def __init__(self, sistema: FacturasIASystem, erp: str, temporal: str, repeticiones: int, memoria: bool):
+        self.sistema = sistema
+        self.erp = erp
+        self.render_dir = db_config.RENDER_CACHE_DIR
+        self.paginas_dir = os.path.join(temporal, 'paginas')
+        self.repeticiones = max(1, repeticiones)
+        self.memoria = memoria
+        self.rss_por_etapa = _reiniciar_rss_pico()
+
+    # ----- Preparación -----
+
+    def preparar(self, documentos: List[Documento]):
+        """Renderiza y extrae cada documento una vez (fuera de la medición)"""
+        os.makedirs(self.paginas_dir, exist_ok=True)
+        for i, doc in enumerate(documentos):
+            imagenes = self.sistema.gemini.cargar_imagenes(doc.ruta)
+            doc.paginas = [self._conservar(img, f"{i:05d}_{j:03d}") for j, img in enumerate(imagenes)]
+            if imagenes:
+                doc.extraccion = self.sistema.gemini.extract_invoice_data(doc.ruta, doc.imagenes())
+            if doc.extraccion:
+                doc.cod_proveedor = self._resolver_proveedor(doc)
+        sin_extraccion = [d.nombre for d in documentos if not d.extraccion]
+        if sin_extraccion:
+            logger.warning("Sin extracción (¿falta la grabación?): %s", ', '.join(sin_extraccion))
+
+    def _conservar(self, imagen: Image.Image, nombre: str):
+        """Copia la página fuera del caché de render (que se vacía antes de cada render medido)"""
+        origen = getattr(imagen, 'filename', '')
+        if not origen:
+            return imagen  # Renderizada en memoria (RENDER_PROCESOS < 0)
+        destino = os.path.join(self.paginas_dir, f"{nombre}{os.path.splitext(origen)[1]}")
+        shutil.copyfile(origen, destino)
+        return destino
+
+    def _vaciar_render(self):
+        """Cada render se mide en frío (sin las páginas del caché de PNGs)"""
+        shutil.rmtree(self.render_dir, ignore_errors=True)
+
+    def _marca(self) -> Dict[str, int]:
+        with sqlite3.connect(self.erp) as conn:
+            return {t: conn.execute(f"SELECT IFNULL(MAX(rowid), 0) FROM {t}").fetchone()[0] for t in TABLAS_INSERCION}
+
+    def _deshacer(self, marca: Dict[str, int]):
+        """Borra lo insertado después de la marca (la próxima repetición no es un duplicado)"""
+        conn = sqlite3.connect(self.erp, timeout=30, isolation_level=None)
+        try:
+            for tabla, rowid in marca.items():
+                conn.execute(f"DELETE FROM {tabla} WHERE rowid > ?", (rowid,))
+        finally:
+            conn.close()
+
+    # ----- Etapas: cada una devuelve True si la llamada salió bien -----
+
+    def _resolver_proveedor(self, doc: Documento) -> Optional[str]:
+        """Como _integrar_en_bd: por CUIT (mapa en memoria) y, si no aparece, por nombre"""
+        proveedor = doc.extraccion['cabecera']['proveedor']
+        cod = self.sistema.db.buscar_proveedor_por_cuit(proveedor['cuit']) if proveedor.get('cuit') else None
+        if not cod and proveedor.get('nombre'):
+            coincidencias = self.sistema.db.buscar_proveedor_por_nombre(proveedor['nombre'])
+            cod = coincidencias[0]['codigo'] if coincidencias else None
+        return cod
+
+    def _pdf_to_images(self, doc: Documento) -> bool:
+        return bool(self.sistema.gemini.cargar_imagenes(doc.ruta))
+
+    def _huella(self, doc: Documento) -> bool:
+        return bool(huella_perceptual(doc.imagenes()[0]))
+
+    def _extraccion(self, doc: Documento) -> bool:
+        return self.sistema.gemini.extract_invoice_data(doc.ruta, doc.imagenes()) is not None
+
+    def _proveedor(self, doc: Documento) -> bool:
+        return self._resolver_proveedor(doc) is not None
+
+    def _proveedor_nombre(self, doc: Documento) -> bool:
+        return bool(self.sistema.db.buscar_proveedor_por_nombre(doc.extraccion['cabecera']['proveedor']['nombre']))
+
+    def _duplicado_bd(self, doc: Documento) -> bool:
+        cab = doc.extraccion['cabecera']['factura']
+        tipo = self.sistema.accounting._mapear_tipo_comprobante(cab['tipo_comprobante'])
+        return self.sistema.db.verificar_factura_existente(
+            doc.cod_proveedor, tipo, cab['punto_emision'], cab['numero_comprobante']) is None
+
+    def _insercion_bd(self, doc: Documento) -> bool:
+        with self.sistema.db.lock:
+            exito, _ = self.sistema._procesar_factura_en_bd(deepcopy(doc.extraccion))
+        return exito
+
+    def _process_invoice_file(self, doc: Documento) -> bool:
+        return self.sistema.process_invoice_file(doc.ruta)['success']
+
+    def _etapa(self, nombre: str):
+        """(función, requiere: 'paginas' | 'extraccion' | 'proveedor' | None, escribe en la BD, renderiza)"""
+        return {
+            'pdf_to_images': (self._pdf_to_images, None, False, True),
+            'huella': (self._huella, 'paginas', False, False),
+            'extraccion': (self._extraccion, 'paginas', False, False),
+            'proveedor': (self._proveedor, 'extraccion', False, False),
+            'proveedor_nombre': (self._proveedor_nombre, 'extraccion', False, False),
+            'duplicado_bd': (self._duplicado_bd, 'proveedor', False, False),
+            'insercion_bd': (self._insercion_bd, 'extraccion', True, False),
+            'process_invoice_file': (self._process_invoice_file, None, True, True),
+        }[nombre]
+
+    # ----- Medición -----
+
+    def _llamar(self, funcion: Callable[[Documento], bool], doc: Documento, escribe: bool, renderiza: bool,
+                medicion: Optional[Medicion], con_memoria: bool = False):
+        if renderiza:
+            self._vaciar_render()
+        marca = self._marca() if escribe else None
+        if con_memoria:
+            tracemalloc.reset_peak()
+            antes = tracemalloc.get_traced_memory()[0]
+        inicio = time.perf_counter()
+        try:
+            ok = funcion(doc)
+        except Exception as e:
+            logger.warning("%s falló: %s", doc.nombre, e)
+            ok = False
+        segundos = time.perf_counter() - inicio
+        if con_memoria:
+            actual, pico = tracemalloc.get_traced_memory()
+        if marca is not None:
+            self._deshacer(marca)
+
+        if medicion is None:
+            return
+        if con_memoria:
+            medicion.pico_kb.append((pico - antes) / 1024)
+            medicion.retenida_kb.append((actual - antes) / 1024)
+            return
+        medicion.segundos.append(segundos)
+        medicion.errores += 0 if ok else 1
+
+    def medir(self, nombre: str, documentos: List[Documento]) -> Medicion:
+        funcion, requiere, escribe, renderiza = self._etapa(nombre)
+        medicion = Medicion(nombre)
+        aptos = []
+        for doc in documentos:
+            falta = (requiere == 'paginas' and not doc.paginas) or \
+                    (requiere == 'extraccion' and not doc.extraccion) or \
+                    (requiere == 'proveedor' and not doc.cod_proveedor)
+            if falta:
+                medicion.omitidos += 1
+            else:
+                aptos.append(doc)
+        if not aptos:
+            return medicion
+
+        # Calentamiento (imports perezosos, pool de render, cachés): no se cuenta
+        self._llamar(funcion, aptos[0], escribe, renderiza, None)
+
+        _reiniciar_rss_pico()
+        for _ in range(self.repeticiones):
+            for doc in aptos:
+                self._llamar(funcion, doc, escribe, renderiza, medicion)
+        medicion.rss_pico_mb = _rss_pico_mb()
+
+        # Memoria en una pasada aparte: tracemalloc hace más lento todo lo que mide
+        if self.memoria:
+            tracemalloc.start()
+            try:
+                for doc in aptos:
+                    self._llamar(funcion, doc, escribe, renderiza, medicion, con_memoria=True)
+            finally:
+                tracemalloc.stop()
+        return medicion
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def corpus(carpeta: str, limite: int = 0) -> List[str]:
+    """PDFs e imágenes de la carpeta, en orden (los mismos archivos en cada corrida)"""
+    archivos = sorted(
+        os.path.join(carpeta, nombre) for nombre in os.listdir(carpeta)
+        if nombre.lower().endswith(EXTENSIONES)
+    )
+    return archivos[:limite] if limite else archivos
+
+
+def correr(archivos: List[str], erp: str, etapas: List[str], repeticiones: int = 3, latencia: str = 'cero',
+           memoria: bool = True, etiqueta: str = '') -> Dict:
+    """Arma el sistema contra los reemplazos offline (en una carpeta temporal) y mide las etapas"""
+    if not os.path.exists(erp):
+        raise FileNotFoundError(f"No existe la réplica del ERP {erp}: generarla con 'python erp_sintetico.py'")
+
+    temporal = tempfile.mkdtemp(prefix='benchmark_')
+    copia = os.path.join(temporal, 'erp.sqlite3')
+    with sqlite3.connect(erp) as origen, sqlite3.connect(copia) as destino:
+        origen.backup(destino)
+
+    # Gemini en replay y la copia de la réplica: la corrida no usa red ni modifica la réplica
+    db_config.GEMINI_BACKEND = 'replay'
+    db_config.GEMINI_REPLAY_LATENCIA = latencia
+    db_config.GEMINI_REPLAY_ERRORES = ''
+    db_config.DB_BACKEND = 'sqlite'
+    db_config.DB_SQLITE_PATH = copia
+    db_config.RENDER_CACHE_DIR = os.path.join(temporal, 'render')
+    db_config.DB_PLANES_DIR = os.path.join(temporal, 'query_plans')
+    db_config.TRACING = 'off'
+
+    sistema = FacturasIASystem()
+    try:
+        bench = Benchmark(sistema, copia, temporal, repeticiones, memoria)
+        documentos = [Documento(ruta) for ruta in archivos]
+        inicio = time.perf_counter()
+        bench.preparar(documentos)
+        resultados = {}
+        for nombre in etapas:
+            print(f"Midiendo {nombre}...", flush=True)
+            resultados[nombre] = bench.medir(nombre, documentos).resumen()
+        duracion = time.perf_counter() - inicio
+    finally:
+        sistema.close()
+        shutil.rmtree(temporal, ignore_errors=True)
+
+    creado = datetime.now()
+    return {
+        'id': f"{creado.strftime('%Y%m%d_%H%M%S')}{'_' + etiqueta if etiqueta else ''}",
+        'etiqueta': etiqueta,
+        'creado': creado.isoformat(timespec='seconds'),
+        'entorno': {
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'sistema': platform.platform(),
+            'cpus': os.cpu_count(),
+            'rss_por_etapa': bench.rss_por_etapa,  # False: rss_pico_mb es el pico del proceso hasta esa etapa
+        },
+        'config': {
+            'repeticiones': repeticiones,
+            'latencia_replay': latencia,
+            'render_procesos': db_config.RENDER_PROCESOS,
+            'prefetch': db_config.PREFETCH_PROVEEDOR,
+            'tiering': db_config.GEMINI_TIERING,
+            'erp': os.path.abspath(erp),
+        },
+        'corpus': {
+            'archivos': len(documentos),
+            'paginas': sum(len(d.paginas) for d in documentos),
+            'con_extraccion': sum(1 for d in documentos if d.extraccion),
+            'con_proveedor': sum(1 for d in documentos if d.cod_proveedor),
+        },
+        'segundos': round(duracion, 2),
+        'etapas': resultados,
+    }
+
+
+def comparar(actual: Dict, base: Dict, tolerancia: float = 0.10) -> List[Dict]:
+    """Cambio relativo de cada métrica de cada etapa; 'regresion' si empeora más que la tolerancia"""
+    filas = []
+    for etapa, metricas in actual['etapas'].items():
+        anterior = base.get('etapas', {}).get(etapa)
+        if not anterior:
+            continue
+        for metrica, mas_es_mejor in COMPARADAS.items():
+            a, b = metricas.get(metrica), anterior.get(metrica)
+            if a is None or not b:
+                continue
+            cambio = (a - b) / b
+            peor = -cambio if mas_es_mejor else cambio
+            filas.append({
+                'etapa': etapa, 'metrica': metrica, 'base': b, 'actual': a, 'cambio': round(cambio, 4),
+                'regresion': peor > tolerancia and abs(a - b) >= MINIMO_ABSOLUTO[metrica],
+            })
+    return filas
+
+
+def guardar(resultado: Dict, carpeta: str) -> str:
+    os.makedirs(carpeta, exist_ok=True)
+    ruta = os.path.join(carpeta, f"{resultado['id']}.json")
+    with open(ruta, 'w', encoding='utf-8') as f:
+        json.dump(resultado, f, ensure_ascii=False, indent=2)
+    return ruta
+
+
+def _imprimir(resultado: Dict, comparacion: Optional[List[Dict]], tolerancia: float):
+    fmt = lambda v: '-' if v is None else f"{v:,.1f}"
+    print(f"\n{resultado['corpus']['archivos']} archivo(s), {resultado['config']['repeticiones']} repetición(es)")
+    print(f"{'etapa':22} {'llamadas':>8} {'err':>4} {'/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+          f"{'mem KB':>9} {'RSS MB':>8}")
+    for nombre, e in resultado['etapas'].items():
+        print(f"{nombre:22} {e['llamadas']:>8} {e['errores']:>4} {fmt(e['por_segundo']):>9} {fmt(e['p50_ms']):>9} "
+              f"{fmt(e['p95_ms']):>9} {fmt(e['p99_ms']):>9} {fmt(e['memoria_pico_kb']):>9} {fmt(e['rss_pico_mb']):>8}")
+
+    if comparacion is None:
+        return
+    cambios = [fila for fila in comparacion if abs(fila['cambio']) > tolerancia]
+    print(f"\nContra la base: {len(comparacion)} métricas, {len(cambios)} fuera de la tolerancia ({tolerancia:.0%})")
+    for fila in cambios:
+        marca = "  REGRESIÓN" if fila['regresion'] else ""
+        print(f"  {fila['etapa']:22} {fila['metrica']:16} {fmt(fila['base']):>10} -> {fmt(fila['actual']):>10} "
+              f"({fila['cambio']:+.1%}){marca}")
+
+
+def main():
+    data = os.path.join(os.path.dirname(__file__), '..', 'data')
+    parser = argparse.ArgumentParser(description="Benchmark del procesamiento de facturas con Gemini y ERP offline")
+    parser.add_argument('--corpus', default=os.path.join(data, 'uploads'), help="Carpeta con PDFs/imágenes")
+    parser.add_argument('--limite', type=int, default=0, help="Primeros N archivos del corpus (0 = todos)")
+    parser.add_argument('--repeticiones', type=int, default=3)
+    parser.add_argument('--etapas', default=','.join(ETAPAS), help=f"Separadas por coma: {', '.join(ETAPAS)}")
+    parser.add_argument('--erp', default=db_config.DB_SQLITE_PATH, help="Réplica del ERP (se usa una copia)")
+    parser.add_argument('--latencia', default='cero', help="Latencia del replay (GEMINI_REPLAY_LATENCIA)")
+    parser.add_argument('--sin-memoria', action='store_true', help="Sin la pasada de tracemalloc")
+    parser.add_argument('--etiqueta', default='')
+    parser.add_argument('--salida', default=db_config.BENCHMARK_DIR)
+    parser.add_argument('--base', help="Resultado contra el que comparar (por defecto <salida>/base.json)")
+    parser.add_argument('--guardar-base', action='store_true', help="Guarda este resultado como base")
+    parser.add_argument('--tolerancia', type=float, default=0.10, help="Empeoramiento relativo aceptado")
+    parser.add_argument('--comparar', metavar='RESULTADO', help="Compara un resultado guardado (no corre nada)")
+    parser.add_argument('--log', default='ERROR', help="Nivel de log durante la corrida")
+    args = parser.parse_args()
+
+    db_config.LOG_NIVEL = args.log.upper()
+    setup_logging()
+
+    base_ruta = args.base or os.path.join(args.salida, 'base.json')
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            resultado = json.load(f)
+    else:
+        etapas = [e.strip() for e in args.etapas.split(',') if e.strip()]
+        desconocidas = [e for e in etapas if e not in ETAPAS]
+        if desconocidas:
+            parser.error(f"Etapas desconocidas: {', '.join(desconocidas)}")
+        archivos = corpus(args.corpus, args.limite)
+        if not archivos:
+            parser.error(f"No hay PDFs ni imágenes en {args.corpus}")
+        try:
+            resultado = correr(archivos, args.erp, etapas, args.repeticiones, args.latencia,
+                               not args.sin_memoria, args.etiqueta)
+        except FileNotFoundError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        print(f"Resultado: {guardar(resultado, args.salida)}")
+
+    comparacion = None
+    if os.path.exists(base_ruta) and not args.guardar_base:
+        with open(base_ruta, encoding='utf-8') as f:
+            comparacion = comparar(resultado, json.load(f), args.tolerancia)
+    _imprimir(resultado, comparacion, args.tolerancia)
+
+    if args.guardar_base:
+        os.makedirs(os.path.dirname(os.path.abspath(base_ruta)), exist_ok=True)
+        with open(base_ruta, 'w', encoding='utf-8') as f:
+            json.dump(resultado, f, ensure_ascii=False, indent=2)
+        print(f"Base guardada: {base_ruta}")
+    elif comparacion and any(fila['regresion'] for fila in comparacion):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Validación local de CUIT
+Dígito verificador (módulo 11) y corrección de errores de un dígito contra proveedores conocidos
+"""
+
+from typing import Iterable, List, Optional
+
+PESOS = (5, 4, 3, 2, 7, 6, 5, 4, 3, 2)
+PREFIJOS_VALIDOS = ('20', '23', '27', '30', '33')
+
+
+def normalizar_cuit(cuit) -> str:
+    """Quita guiones y espacios: '30-54340071-3' -> '30543400713'"""
+    if cuit is None:
+        return ''
+    return str(cuit).replace('-', '').replace(' ', '').replace('.', '').strip()
+
+
+def digito_verificador(base: str) -> Optional[int]:
+    """Calcula el dígito verificador de los primeros 10 dígitos (None si da 10: no existe)"""
+    suma = sum(int(d) * p for d, p in zip(base, PESOS))
+    resto = 11 - suma % 11
+    if resto == 11:
+        return 0
+    if resto == 10:
+        return None
+    return resto
+
+
+def es_cuit_valido(cuit) -> bool:
+    """11 dígitos, prefijo conocido y dígito verificador correcto"""
+    cuit = normalizar_cuit(cuit)
+    if len(cuit) != 11 or not cuit.isdigit() or cuit[:2] not in PREFIJOS_VALIDOS:
+        return False
+    return digito_verificador(cuit[:10]) == int(cuit[10])
+
+
+def _variantes_un_digito(cuit: str) -> set:
+    """Todas las lecturas a un error: un dígito cambiado o dos adyacentes invertidos"""
+    variantes = set()
+    for i in range(11):
+        for d in '0123456789':
+            if d != cuit[i]:
+                variantes.add(cuit[:i] + d + cuit[i + 1:])
+    for i in range(10):
+        if cuit[i] != cuit[i + 1]:
+            variantes.add(cuit[:i] + cuit[i + 1] + cuit[i] + cuit[i + 2:])
+    return variantes
+
+
+def candidatos_un_digito(cuit) -> List[str]:
+    """CUITs válidos a un error de lectura del CUIT dado"""
+    cuit = normalizar_cuit(cuit)
+    if len(cuit) != 11 or not cuit.isdigit():
+        return []
+    return sorted(c for c in _variantes_un_digito(cuit) if es_cuit_valido(c))
+
+
+def corregir_cuit(cuit, conocidos: Iterable[str]) -> Optional[str]:
+    """
+    Devuelve el CUIT si es conocido o válido; si no, el único proveedor conocido
+    a un error de lectura. None si no hay corrección segura.
+    """
+    cuit = normalizar_cuit(cuit)
+    conocidos = conocidos if isinstance(conocidos, (set, frozenset, dict)) else set(conocidos)
+
+    # Los CUITs cargados en la BD mandan (hay registros históricos con verificador inválido)
+    if cuit in conocidos or es_cuit_valido(cuit):
+        return cuit
+    if len(cuit) != 11 or not cuit.isdigit():
+        return None
+
+    coincidencias = [c for c in _variantes_un_digito(cuit) if c in conocidos]
+    if len(coincidencias) == 1:
+        return coincidencias[0]
+    return None
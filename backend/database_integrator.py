@@ -1,15 +1,21 @@
 """
 Integrador con Base de Datos SQL Server
 Maneja todas las operaciones de BD con logging detallado
+(con DB_BACKEND=sqlite, contra la réplica local del ERP de db_backend)
 """
 
 import logging
-import pyodbc
+import time
+import threading
 from typing import Optional, Dict, List, Tuple
 import db_config
+import db_backend
+from cuit import normalizar_cuit
+from metrics import operacion_bd, BD_SEGUNDOS, BD_ERRORES
+from db_cursor import CursorInstrumentado, ESTADISTICAS
 from logging_config import (
     log_info, log_success, log_error, log_warning, 
-    log_database, log_found, log_not_found, EMOJI
+    log_database, log_found, log_not_found, log_detalle, EMOJI
 )
 
 logger = logging.getLogger(__name__)
@@ -20,19 +26,76 @@ class DatabaseIntegrator:
     
     def __init__(self):
         log_info(logger, f"{EMOJI['database']} Conectando a base de datos...")
-        log_info(logger, f"Servidor: {db_config.CONNECTION_STRING.split(';')[0]}")
+        log_info(logger, f"Servidor: {db_backend.descripcion()}")
         
         try:
-            self.conn = pyodbc.connect(db_config.CONNECTION_STRING)
-            self.cursor = self.conn.cursor()
+            self.conn = db_backend.conectar()
+            self.cursor = CursorInstrumentado(self.conn.cursor())
             log_success(logger, "Conexión a BD establecida")
         except Exception as e:
             log_error(logger, f"Error conectando a BD: {e}")
             raise
+        
+        # El cursor es compartido: quien procese facturas en paralelo serializa el uso de la BD con este lock
+        self.lock = threading.RLock()
+        
+        # Mapa en memoria CUIT/CUIL normalizado -> COD de proveedores activos
+        self._cuits_proveedores = None
+        self._cuits_cargados_en = 0.0
+    
+    def cuits_proveedores(self) -> Dict[str, str]:
+        """Proveedores activos indexados por CUIT/CUIL (se recarga cada PROVEEDORES_CACHE_TTL_MIN)"""
+        vigente = time.time() - self._cuits_cargados_en < db_config.PROVEEDORES_CACHE_TTL_MIN * 60
+        if self._cuits_proveedores is not None and vigente:
+            return self._cuits_proveedores
+        
+        log_database(logger, "SELECT", "ISMST_PERSONAS", "CUIT/CUIL de proveedores activos (mapa en memoria)")
+        query = """
+            SELECT COD, CUIT, CUIL
+            FROM ISMST_PERSONAS 
+            WHERE RTRIM(LTRIM(ESTADO)) = 'ACTIVO'
+              AND (
+                  RTRIM(LTRIM(TIPO_PERSONA)) IN ('P', 'C', 'RI') 
+                  OR TIPO_PERSONA IS NULL 
+                  OR RTRIM(LTRIM(TIPO_PERSONA)) = ''
+              )
+        """
+        try:
+            with self.lock, BD_SEGUNDOS.medir(operacion='cuits_proveedores'):
+                self.cursor.execute(query)
+                filas = self.cursor.fetchall()
+            
+            mapa = {}
+            for row in filas:
+                cod = row.COD.strip()
+                for valor in (row.CUIT, row.CUIL):
+                    cuit = normalizar_cuit(valor)
+                    if len(cuit) == 11:
+                        mapa.setdefault(cuit, cod)
+            
+            self._cuits_proveedores = mapa
+            self._cuits_cargados_en = time.time()
+            log_success(logger, f"Mapa de proveedores cargado: {len(mapa)} CUIT(s)")
+            return mapa
+            
+        except Exception as e:
+            BD_ERRORES.inc(operacion='cuits_proveedores')
+            log_error(logger, f"Error cargando mapa de proveedores: {e}")
+            return self._cuits_proveedores or {}
     
+    @operacion_bd
     def buscar_proveedor_por_cuit(self, cuit: str) -> Optional[str]:
         """Busca código de proveedor por CUIT (PRIORIDAD 1 - MÁS CONFIABLE)"""
         log_info(logger, f"{EMOJI['search']} Buscando proveedor por CUIT: {cuit}")
+        
+        # Primero en memoria: evita el scan con LIKE/TRIM sobre ISMST_PERSONAS
+        mapa = self.cuits_proveedores()
+        cod = mapa.get(normalizar_cuit(cuit))
+        if cod:
+            log_found(logger, "Proveedor", f"COD={cod} (mapa en memoria)")
+            return cod
+        
+        # Si no está (ej. proveedor dado de alta después de cargar el mapa), se consulta la BD
         # Usamos LIKE y TRIM para evitar problemas con espacios en blanco en la BD (char/nchar)
         # Y relajamos TIPO_PERSONA para incluir 'RI' o vacíos, y arreglamos ESTADO con TRIM
         query = """
@@ -50,17 +113,24 @@ class DatabaseIntegrator:
         try:
             # Probamos exacto y con patrón LIKE por si acaso
             patron = f"{cuit}%"
-            self.cursor.execute(query, cuit, cuit, patron, patron)
-            result = self.cursor.fetchone()
+            with self.lock:
+                self.cursor.execute(query, cuit, cuit, patron, patron)
+                result = self.cursor.fetchone()
+                
+                if result:
+                    cod = result[0].strip()
+                    if self._cuits_proveedores is not None and len(normalizar_cuit(cuit)) == 11:
+                        self._cuits_proveedores[normalizar_cuit(cuit)] = cod  # La próxima vez, desde el mapa
             
             if result:
-                log_found(logger, "Proveedor", f"COD={result[0].strip()}")
-                return result[0].strip()
+                log_found(logger, "Proveedor", f"COD={cod}")
+                return cod
             else:
                 log_not_found(logger, "Proveedor", f"CUIT={cuit}")
                 return None
                 
         except Exception as e:
+            BD_ERRORES.inc(operacion='buscar_proveedor_por_cuit')
             log_error(logger, f"Error en búsqueda por CUIT: {e}")
             return None
     
@@ -75,6 +145,7 @@ class DatabaseIntegrator:
         # Convertir a mayúsculas y limpiar espacios
         return s.upper().strip()
 
+    @operacion_bd
     def buscar_proveedor_por_nombre(self, nombre: str) -> List[Dict]:
         """Busca proveedores por similitud de nombre (FALLBACK INTELIGENTE)"""
         nombre_limpio = self._normalizar_texto(nombre)
@@ -164,7 +235,7 @@ class DatabaseIntegrator:
                     'score': row.SCORE
                 }
                 results.append(prov)
-                log_info(logger, f"  {EMOJI['bullet']} {prov['nombre']} (Score: {prov['score']}, COD: {prov['codigo']})")
+                log_detalle(logger, "%s (Score: %s, COD: %s)", prov['nombre'], prov['score'], prov['codigo'])
             
             if results:
                 log_success(logger, f"Encontrados {len(results)} proveedor(es) similar(es)")
@@ -180,9 +251,11 @@ class DatabaseIntegrator:
             return results
             
         except Exception as e:
+            BD_ERRORES.inc(operacion='buscar_proveedor_por_nombre')
             log_error(logger, f"Error en búsqueda por nombre: {e}")
             return []
 
+    @operacion_bd
     def _buscar_por_palabra_clave(self, palabra: str) -> List[Dict]:
         """Búsqueda simple por una sola palabra clave"""
         query = """
@@ -208,11 +281,14 @@ class DatabaseIntegrator:
                     'score': 40
                 }
                 results.append(prov)
-                log_info(logger, f"  {EMOJI['bullet']} {prov['nombre']} (Score: 40, COD: {prov['codigo']})")
+                log_detalle(logger, "%s (Score: 40, COD: %s)", prov['nombre'], prov['codigo'])
             return results
-        except Exception:
+        except Exception as e:
+            BD_ERRORES.inc(operacion='buscar_por_palabra_clave')
+            log_error(logger, f"Error en búsqueda por palabra clave: {e}")
             return []
     
+    @operacion_bd
     def obtener_ocs_activas_proveedor(self, cod_proveedor: str) -> List[Dict]:
         """Obtiene OCs activas del proveedor con filtrado inteligente"""
         log_info(logger, f"{EMOJI['search']} Buscando OCs activas del proveedor: {cod_proveedor}")
@@ -266,7 +342,8 @@ class DatabaseIntegrator:
                 ocs.append(oc)
                 
                 status = "⭐ RECOMENDADO" if oc['recomendado'] else ""
-                log_info(logger, f"  {EMOJI['bullet']} OC {oc['nro_orden']} - ${oc['monto_total']:,.2f} - Pendiente: ${oc['pendiente_total']:,.2f} ({oc['items_pendientes']} items) {status}")
+                log_detalle(logger, "OC %s - $%.2f - Pendiente: $%.2f (%s items) %s",
+                            oc['nro_orden'], oc['monto_total'], oc['pendiente_total'], oc['items_pendientes'], status)
             
             if ocs:
                 log_success(logger, f"Encontradas {len(ocs)} OC(s) activa(s)")
@@ -276,9 +353,11 @@ class DatabaseIntegrator:
             return ocs
             
         except Exception as e:
+            BD_ERRORES.inc(operacion='obtener_ocs_activas_proveedor')
             log_error(logger, f"Error obteniendo OCs activas: {e}")
             return []
     
+    @operacion_bd
     def verificar_proveedor_activo(self, cod_proveedor: str) -> Tuple[bool, str]:
         """Verifica que el proveedor esté activo y con documentación completa"""
         log_info(logger, f"{EMOJI['search']} Verificando estado del proveedor: {cod_proveedor}")
@@ -311,9 +390,11 @@ class DatabaseIntegrator:
             return True, "OK"
             
         except Exception as e:
+            BD_ERRORES.inc(operacion='verificar_proveedor_activo')
             log_error(logger, f"Error verificando proveedor: {e}")
             return False, str(e)
     
+    @operacion_bd
     def obtener_items_oc(self, nro_oc: str) -> List[Dict]:
         """Obtiene los items de la OC desde la base de datos"""
         log_info(logger, f"{EMOJI['search']} Obteniendo items de OC: {nro_oc}")
@@ -351,7 +432,7 @@ class DatabaseIntegrator:
                 }
                 items.append(item)
                 
-                log_info(logger, f"  {EMOJI['bullet']} Item {item['nro_item']}: {item['descripcion'][:50]} - Pendiente: {item['pendiente']}")
+                log_detalle(logger, "Item %s: %.50s - Pendiente: %s", item['nro_item'], item['descripcion'], item['pendiente'])
             
             if items:
                 log_success(logger, f"Encontrados {len(items)} item(s) en OC {nro_oc}")
@@ -361,9 +442,11 @@ class DatabaseIntegrator:
             return items
             
         except Exception as e:
+            BD_ERRORES.inc(operacion='obtener_items_oc')
             log_error(logger, f"Error obteniendo items de OC: {e}")
             return []
     
+    @operacion_bd
     def verificar_oc_existe(self, nro_oc: str) -> Tuple[bool, str, Optional[str]]:
         """Verifica OC y retorna (existe, mensaje, cod_proveedor)"""
         log_info(logger, f"{EMOJI['search']} Verificando OC: {nro_oc}")
@@ -401,9 +484,11 @@ class DatabaseIntegrator:
             return True, "OK", cod_prov
             
         except Exception as e:
+            BD_ERRORES.inc(operacion='verificar_oc_existe')
             log_error(logger, f"Error verificando OC: {e}")
             return False, str(e), None
 
+    @operacion_bd
     def verificar_factura_existente(self, cod_proveedor: str, tipo: str, punto_emision: str, numero: str) -> Optional[str]:
         """Verifica si la factura ya existe en la BD. Retorna NRO_ARCHIVO si existe."""
         log_info(logger, f"{EMOJI['search']} Verificando duplicados: {tipo} {punto_emision}-{numero} (Prov: {cod_proveedor})")
@@ -449,9 +534,11 @@ class DatabaseIntegrator:
                 log_success(logger, "✅ Factura no existe, se puede procesar")
             return None
         except Exception as e:
+            BD_ERRORES.inc(operacion='verificar_factura_existente')
             log_error(logger, f"Error verificando duplicados: {e}")
             return None
     
+    @operacion_bd
     def obtener_ejercicio(self, fecha_doc: str) -> Optional[str]:
         """Obtiene el ejercicio contable para una fecha"""
         log_info(logger, f"{EMOJI['search']} Buscando ejercicio contable para fecha: {fecha_doc}")
@@ -472,9 +559,14 @@ class DatabaseIntegrator:
                 return None
                 
         except Exception as e:
+            BD_ERRORES.inc(operacion='obtener_ejercicio')
             log_error(logger, f"Error obteniendo ejercicio: {e}")
             return None
     
+    def estadisticas_consultas(self, orden: str = 'segundos_total', limite: int = 50) -> Dict:
+        """Latencia (p50/p95/p99), filas y errores por consulta, y las consultas lentas recientes"""
+        return ESTADISTICAS.reporte(orden, limite)
+    
     def close(self):
         """Cierra la conexión a la base de datos"""
         log_info(logger, "Cerrando conexión a BD...")
@@ -0,0 +1,346 @@
+"""
+Backends de base de datos del ERP
+'sqlserver' conecta por ODBC a la base de producción (ISMS_MOLINO); 'sqlite' usa una réplica
+local del esquema (las tablas que lee y escribe el sistema) para pruebas y benchmarks sin
+SQL Server. El cursor SQLite acepta el mismo uso que el de pyodbc (parámetros sueltos, filas con
+atributos) y traduce al vuelo lo que el sistema usa de T-SQL (TOP, ISNULL, GETDATE, DATEADD).
+Los datos de la réplica se generan con erp_sintetico.py.
+"""
+
+import os
+import re
+import sqlite3
+import logging
+from datetime import date, datetime
+from decimal import Decimal
+from functools import lru_cache
+import db_config
+from logging_config import log_info, log_warning, EMOJI
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ('sqlserver', 'sqlite')
+
+# Tablas del ERP que usa el sistema (tipos SQLite; en SQL Server son char/varchar/decimal/datetime).
+# Los textos se guardan sin el padding de los char: SQL Server ignora los espacios finales al
+# comparar con '=' e IN, SQLite no.
+TABLAS = """
+    CREATE TABLE IF NOT EXISTS ISMST_PERSONAS (
+        COD                 TEXT PRIMARY KEY,
+        NOMBRE              TEXT NOT NULL,
+        NOMBRE_CORTO        TEXT,
+        CUIT                TEXT,
+        CUIL                TEXT,
+        TIPO_PERSONA        TEXT,               -- P | C | RI | NULL | ''
+        ESTADO              TEXT,               -- ACTIVO | BAJA
+        DOCUM_COMPLETA      TEXT                -- SI | NO
+    );
+
+    CREATE TABLE IF NOT EXISTS ISMST_ORDEN_COMPRA_CAB (
+        NRO_ORDEN_COMPRA    TEXT PRIMARY KEY,
+        FECHA               TEXT,
+        COD_PROVEEDOR       TEXT,
+        ESTADO              TEXT,               -- ABIERTA | PARCIAL | CERRADA
+        MONTO_TOTAL         REAL,
+        OBSERVACION         TEXT,
+        TIPO                TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS ISMST_ORDEN_COMPRA_ITEM (
+        NRO_ORDEN           TEXT NOT NULL,
+        NRO_ITEM            INTEGER NOT NULL,
+        COD_PRODUCTO        TEXT,
+        DESCRIPCION         TEXT,
+        CANTIDAD            REAL,
+        PRECIO_UNIT         REAL,
+        PENDIENTE_FACTURAR  REAL,
+        ALICUOTA_IVA        REAL,
+        ESTADO              TEXT,
+        PRIMARY KEY (NRO_ORDEN, NRO_ITEM)
+    );
+
+    CREATE TABLE IF NOT EXISTS ISMST_DOCUMENTOS_CAB (
+        COMPANIA            TEXT NOT NULL,
+        TIPO                TEXT NOT NULL,
+        NUMERO              TEXT NOT NULL,
+        EMISOR              TEXT NOT NULL,
+        RECEPTOR            TEXT NOT NULL,
+        PUNTO_EMISION       TEXT NOT NULL,
+        FECHA               TEXT,
+        FECHA_PAGO_COBRO    TEXT,
+        MONEDA              TEXT,
+        TIPO_CAMBIO         REAL,
+        MONTO_TOTAL_FINAL   REAL,
+        NRO_ARCHIVO         TEXT,
+        ANULADO             TEXT,
+        PRIMARY KEY (COMPANIA, TIPO, NUMERO, EMISOR, RECEPTOR, PUNTO_EMISION)
+    );
+
+    CREATE TABLE IF NOT EXISTS ISMST_DOCUMENTOS_ITEM (
+        COMPANIA            TEXT NOT NULL,
+        TIPO                TEXT NOT NULL,
+        NUMERO              TEXT NOT NULL,
+        EMISOR              TEXT NOT NULL,
+        RECEPTOR            TEXT NOT NULL,
+        PUNTO_EMISION       TEXT NOT NULL,
+        ITEM                INTEGER NOT NULL,
+        DESCRIPCION         TEXT,
+        CANTIDAD            REAL,
+        PRECIO              REAL,
+        PRIMARY KEY (COMPANIA, TIPO, NUMERO, EMISOR, RECEPTOR, PUNTO_EMISION, ITEM)
+    );
+
+    -- En el ERP es una vista actualizable; acá, una tabla
+    CREATE TABLE IF NOT EXISTS ismsv_impuestos_documento (
+        compania            TEXT NOT NULL,
+        tipo_doc            TEXT NOT NULL,
+        numero_doc          TEXT NOT NULL,
+        emisor              TEXT NOT NULL,
+        receptor            TEXT NOT NULL,
+        item                INTEGER,
+        cod_impuesto        TEXT,
+        valor               REAL,
+        punto_emision       TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS ISMST_EJERCICIOS (
+        EJER_COD            TEXT PRIMARY KEY,
+        EJER_FECHAINICIO    TEXT,
+        EJER_FECHAFIN       TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS ISMST_ASIENTOS (
+        AS_NRO              INTEGER PRIMARY KEY,
+        AS_FECHAREG         TEXT,
+        AS_DESCRIPCION      TEXT,
+        AS_TIPOCOMP         TEXT,
+        AS_CLIENTE          TEXT,
+        AS_PROVEEDOR        TEXT,
+        AS_MODO             TEXT,
+        AS_CIERRE           TEXT,
+        AS_INTEGRABLE       TEXT,
+        AS_EMPRESA          TEXT,
+        AS_REVERSIBLE       TEXT,
+        AS_REVFECHA         TEXT,
+        AS_CONCEPTO         TEXT,
+        AS_EJERCICIO        TEXT,
+        AS_FECHAMOV         TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS ISMST_MOVIMIENTOS (
+        MO_ASNRO            INTEGER NOT NULL,
+        MO_CUENTA           TEXT,
+        MO_COMPROBANTE      TEXT,
+        MO_FECHA            TEXT,
+        MO_DESCRIPCION      TEXT,
+        MO_IMPORTE          REAL,
+        MO_POSICION         TEXT,               -- DEBE | HABER
+        MO_CC               TEXT,
+        MO_FECHAEFECTIVA    TEXT,
+        MO_MNG              REAL,
+        MO_EMPRESA          TEXT,
+        MO_EJERCICIO        TEXT
+    );
+
+    CREATE VIEW IF NOT EXISTS ISMSV_DOCUMENTOS_CAB AS SELECT * FROM ISMST_DOCUMENTOS_CAB;
+"""
+
+# Aparte de las tablas: la carga masiva (erp_sintetico) los crea después de insertar
+INDICES = """
+    CREATE INDEX IF NOT EXISTS idx_personas_cuit ON ISMST_PERSONAS (CUIT);
+    CREATE INDEX IF NOT EXISTS idx_oc_proveedor ON ISMST_ORDEN_COMPRA_CAB (COD_PROVEEDOR, FECHA);
+    CREATE INDEX IF NOT EXISTS idx_documentos_emisor ON ISMST_DOCUMENTOS_CAB (EMISOR, TIPO);
+    CREATE INDEX IF NOT EXISTS idx_impuestos_documento ON ismsv_impuestos_documento (emisor, tipo_doc, numero_doc);
+    CREATE INDEX IF NOT EXISTS idx_movimientos_asiento ON ISMST_MOVIMIENTOS (MO_ASNRO);
+"""
+
+TABLAS_ERP = (
+    'ISMST_PERSONAS', 'ISMST_ORDEN_COMPRA_CAB', 'ISMST_ORDEN_COMPRA_ITEM', 'ISMST_DOCUMENTOS_CAB',
+    'ISMST_DOCUMENTOS_ITEM', 'ismsv_impuestos_documento', 'ISMST_EJERCICIOS', 'ISMST_ASIENTOS',
+    'ISMST_MOVIMIENTOS',
+)
+
+# Traducción T-SQL -> SQLite de las construcciones que usan las consultas del sistema
+PATRON_TOP = re.compile(r'^(\s*SELECT)\s+TOP\s+(\d+)\b', re.IGNORECASE)
+PATRON_ISNULL = re.compile(r'\bISNULL\s*\(', re.IGNORECASE)
+PATRON_LEN = re.compile(r'\bLEN\s*\(', re.IGNORECASE)
+PATRON_DATEADD = re.compile(r'\bDATEADD\s*\(\s*(\w+)\s*,\s*(-?\d+)\s*,\s*GETDATE\s*\(\s*\)\s*\)', re.IGNORECASE)
+PATRON_GETDATE = re.compile(r'\bGETDATE\s*\(\s*\)', re.IGNORECASE)
+UNIDADES_DATEADD = {
+    'year': 'years', 'yy': 'years', 'month': 'months', 'mm': 'months', 'day': 'days', 'dd': 'days',
+    'hour': 'hours', 'hh': 'hours', 'minute': 'minutes', 'mi': 'minutes', 'second': 'seconds', 'ss': 'seconds',
+}
+AHORA = "datetime('now', 'localtime')"
+
+
+def _dateadd(m) -> str:
+    unidad = UNIDADES_DATEADD.get(m.group(1).lower())
+    if unidad is None:
+        raise ValueError(f"DATEADD con unidad no soportada en SQLite: {m.group(1)}")
+    return f"datetime('now', 'localtime', '{int(m.group(2)):+d} {unidad}')"
+
+
+@lru_cache(maxsize=512)
+def traducir(sql: str) -> str:
+    """T-SQL del sistema -> SQLite (las sentencias son constantes: se traducen una vez)"""
+    limite = None
+    m = PATRON_TOP.match(sql)
+    if m:
+        limite = int(m.group(2))
+        sql = m.group(1) + sql[m.end():]
+    sql = PATRON_DATEADD.sub(_dateadd, sql)
+    sql = PATRON_GETDATE.sub(AHORA, sql)
+    sql = PATRON_ISNULL.sub('IFNULL(', sql)
+    sql = PATRON_LEN.sub('LENGTH(', sql)
+    if limite is not None:
+        # En línea aparte: la consulta puede terminar en un comentario '--'
+        sql = f"{sql.rstrip().rstrip(';')}\nLIMIT {limite}"
+    return sql
+
+
+def _valor(valor):
+    """Parámetro pyodbc -> SQLite (las fechas como texto, igual que las guarda el generador)"""
+    if isinstance(valor, datetime):
+        return valor.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(valor, date):
+        return valor.strftime('%Y-%m-%d 00:00:00')
+    if isinstance(valor, Decimal):
+        return float(valor)
+    return valor
+
+
+class Fila(tuple):
+    """Fila con acceso por posición y por nombre de columna (row.COD), como pyodbc.Row"""
+    __slots__ = ()
+    columnas = {}
+
+    def __getattr__(self, nombre):
+        try:
+            return self[self.columnas[nombre]]
+        except KeyError:
+            raise AttributeError(nombre) from None
+
+
+@lru_cache(maxsize=256)
+def _clase_fila(nombres: tuple) -> type:
+    """Una subclase de Fila por forma de resultado (el mapa nombre -> posición se arma una vez)"""
+    columnas = {}
+    for i, nombre in enumerate(nombres):
+        columnas.setdefault(nombre, i)
+        columnas.setdefault(nombre.upper(), i)
+    return type('Fila', (Fila,), {'__slots__': (), 'columnas': columnas})
+
+
+class CursorSQLite:
+    """Cursor con la interfaz de pyodbc que usan DatabaseIntegrator y CursorInstrumentado"""
+
+    def __init__(self, conexion: 'ConexionSQLite'):
+        self.connection = conexion
+        self._cursor = conexion.raw.cursor()
+        self._clase = None
+
+    def execute(self, sql: str, *params):
+        if len(params) == 1 and isinstance(params[0], (list, tuple)):
+            params = params[0]
+        self._cursor.execute(traducir(sql), [_valor(p) for p in params])
+        descripcion = self._cursor.description
+        self._clase = _clase_fila(tuple(d[0] for d in descripcion)) if descripcion else None
+        return self
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def rowcount(self) -> int:
+        return self._cursor.rowcount
+
+    def fetchone(self):
+        fila = self._cursor.fetchone()
+        return self._clase(fila) if fila is not None else None
+
+    def fetchall(self):
+        return [self._clase(fila) for fila in self._cursor.fetchall()]
+
+    def fetchmany(self, size: int = None):
+        filas = self._cursor.fetchmany(size) if size is not None else self._cursor.fetchmany()
+        return [self._clase(fila) for fila in filas]
+
+    def __iter__(self):
+        for fila in self._cursor:
+            yield self._clase(fila)
+
+    def plan_estimado(self, sql: str, params) -> str:
+        """EXPLAIN QUERY PLAN de la sentencia (lo usa CursorInstrumentado con las consultas lentas)"""
+        filas = self.connection.raw.execute(
+            f"EXPLAIN QUERY PLAN {traducir(sql)}", [_valor(p) for p in params]
+        ).fetchall()
+        return "\n".join(f"{id_}\t{padre}\t{detalle}" for id_, padre, _, detalle in filas) + "\n"
+
+    def close(self):
+        self._cursor.close()
+
+
+class ConexionSQLite:
+    """
+    Conexión a la réplica local. Sin transacción implícita: como en el sistema cada factura se
+    inserta entre BEGIN TRANSACTION y COMMIT/ROLLBACK TRANSACTION explícitos.
+    """
+
+    def __init__(self, ruta: str):
+        nueva = not os.path.exists(ruta)
+        os.makedirs(os.path.dirname(os.path.abspath(ruta)), exist_ok=True)
+        # check_same_thread=False: el cursor se comparte entre threads, serializado por DatabaseIntegrator.lock
+        self.raw = sqlite3.connect(ruta, timeout=30, isolation_level=None, check_same_thread=False)
+        self.raw.execute("PRAGMA journal_mode=WAL")
+        crear_esquema(self.raw)
+        if nueva:
+            log_warning(logger, f"Base local vacía creada en {ruta}: cargar datos con 'python erp_sintetico.py'")
+
+    def cursor(self) -> CursorSQLite:
+        return CursorSQLite(self)
+
+    def commit(self):
+        if self.raw.in_transaction:
+            self.raw.execute("COMMIT")
+
+    def rollback(self):
+        if self.raw.in_transaction:
+            self.raw.execute("ROLLBACK")
+
+    def close(self):
+        self.raw.close()
+
+
+def crear_esquema(conn: sqlite3.Connection, indices: bool = True):
+    """Crea las tablas del ERP que falten (y sus índices, salvo indices=False)"""
+    conn.executescript(TABLAS)
+    if indices:
+        conn.executescript(INDICES)
+
+
+def descripcion() -> str:
+    """Destino de la conexión para el log, sin credenciales"""
+    if db_config.DB_BACKEND == 'sqlite':
+        return f"SQLite local {db_config.DB_SQLITE_PATH}"
+    claves = {}
+    for parte in db_config.CONNECTION_STRING.split(';'):
+        clave, _, valor = parte.partition('=')
+        claves[clave.strip().lower()] = valor.strip()
+    servidor = claves.get('server') or claves.get('data source') or claves.get('address') or '?'
+    base = claves.get('database') or claves.get('initial catalog')
+    return f"SQL Server {servidor}" + (f", base {base}" if base else "")
+
+
+def conectar():
+    """Conexión al backend configurado (DB_BACKEND), con la interfaz de pyodbc"""
+    if db_config.DB_BACKEND not in BACKENDS:
+        raise ValueError(f"DB_BACKEND desconocido: {db_config.DB_BACKEND} (opciones: {', '.join(BACKENDS)})")
+
+    if db_config.DB_BACKEND == 'sqlite':
+        log_info(logger, f"{EMOJI['database']} Usando la réplica local del ERP (sin SQL Server)")
+        return ConexionSQLite(db_config.DB_SQLITE_PATH)
+
+    # Import local: con el backend sqlite no hace falta el driver ODBC
+    import pyodbc
+    return pyodbc.connect(db_config.CONNECTION_STRING)
@@ -19,6 +19,14 @@ CONNECTION_STRING = (
     f"TrustServerCertificate=yes;"
 )
 
+# Backend: 'sqlserver' (ERP por ODBC) o 'sqlite' (réplica local del esquema, ver erp_sintetico.py)
+DB_BACKEND = os.getenv('DB_BACKEND', 'sqlserver').lower()
+DB_SQLITE_PATH = os.getenv('DB_SQLITE_PATH', os.path.join(os.path.dirname(__file__), '..', 'data', 'erp_local.sqlite3'))
+
+# Carpeta de datos de la API (uploads/, processed/, resultados.sqlite3) y puerto
+DATA_DIR = os.getenv('DATA_DIR', os.path.join(os.path.dirname(__file__), '..', 'data'))
+API_PUERTO = int(os.getenv('API_PUERTO', '5000'))
+
 # Configuración de Negocio
 COMPANIA = os.getenv('COMPANIA', 'MOLINO')
 RECEPTOR = os.getenv('RECEPTOR', 'EMPRESA')
@@ -38,3 +46,100 @@ CUITS_PROPIOS = [
 CUENTA_PROVEEDORES = os.getenv('CUENTA_PROVEEDORES', '210101') # Pasivo
 CUENTA_IVA_CREDITO = os.getenv('CUENTA_IVA_CREDITO', '110501') # Activo
 CUENTA_GASTO_DEFECTO = os.getenv('CUENTA_GASTO_DEFECTO', '520101') # Gasto
+
+# Configuración de Gemini (llamadas resilientes)
+GEMINI_REINTENTOS = int(os.getenv('GEMINI_REINTENTOS', '3'))  # Intentos totales por llamada
+GEMINI_BACKOFF_BASE = float(os.getenv('GEMINI_BACKOFF_BASE', '1.0'))  # Segundos
+GEMINI_BACKOFF_MAX = float(os.getenv('GEMINI_BACKOFF_MAX', '20'))  # Segundos
+GEMINI_TIMEOUT_INTENTO = float(os.getenv('GEMINI_TIMEOUT_INTENTO', '90'))  # Segundos por intento
+GEMINI_DEADLINE = float(os.getenv('GEMINI_DEADLINE', '180'))  # Segundos totales por llamada
+GEMINI_HEDGING = os.getenv('GEMINI_HEDGING', 'false').lower() == 'true'
+GEMINI_HEDGING_MIN_MUESTRAS = int(os.getenv('GEMINI_HEDGING_MIN_MUESTRAS', '20'))  # Latencias antes de calcular p95
+
+# Context caching del prompt de extracción
+GEMINI_CONTEXT_CACHE = os.getenv('GEMINI_CONTEXT_CACHE', 'true').lower() == 'true'
+GEMINI_CACHE_TTL_MIN = int(os.getenv('GEMINI_CACHE_TTL_MIN', '60'))
+GEMINI_FEW_SHOT_DIR = os.getenv(
+    'GEMINI_FEW_SHOT_DIR',
+    os.path.join(os.path.dirname(__file__), '..', 'data', 'few_shot')
+)  # Ejemplos por proveedor: {"proveedor", "notas", "extraccion"}
+
+# Escalonamiento de modelos (tiering)
+GEMINI_TIERING = os.getenv('GEMINI_TIERING', 'true').lower() == 'true'
+GEMINI_MODELO_RAPIDO = os.getenv('GEMINI_MODELO_RAPIDO', 'gemini-2.5-flash-lite')  # PDFs digitales
+GEMINI_MODELO_FUERTE = os.getenv('GEMINI_MODELO_FUERTE', 'gemini-2.5-flash')  # Escaneos y escalamientos
+
+# Mapa en memoria de CUITs de proveedores (validación local)
+PROVEEDORES_CACHE_TTL_MIN = int(os.getenv('PROVEEDORES_CACHE_TTL_MIN', '30'))
+
+# Archivo de resultados procesados
+RESULT_RETENTION_DAYS = int(os.getenv('RESULT_RETENTION_DAYS', '0'))  # 0 = conservar siempre
+RESULT_COMPACTAR_LEGADOS = os.getenv('RESULT_COMPACTAR_LEGADOS', 'false').lower() == 'true'  # .json -> .json.gz
+RESULT_MANTENIMIENTO_HORAS = float(os.getenv('RESULT_MANTENIMIENTO_HORAS', '24'))
+
+# Detección de re-escaneos (huella perceptual de la primera página)
+# Facturas distintas con el mismo diseño del proveedor también dan huellas cercanas: una huella
+# parecida sólo cuenta si la extracción da el mismo CUIT, punto de venta y número
+# 'marcar': avisa y sigue | 'detener': no se inserta en la BD sin forzar | 'off' (hasta calibrar la distancia)
+DUPLICADOS_PERCEPTUALES = os.getenv('DUPLICADOS_PERCEPTUALES', 'off').lower()
+DUPLICADO_DISTANCIA_MAX = int(os.getenv('DUPLICADO_DISTANCIA_MAX', '10'))  # Bits distintos (de 256)
+
+# PDFs con varias facturas
+SEPARAR_FACTURAS = os.getenv('SEPARAR_FACTURAS', 'true').lower() == 'true'  # Las partes van por el pipeline
+
+# Renderizado de PDFs (pool de procesos)
+RENDER_PROCESOS = int(os.getenv('RENDER_PROCESOS', '0'))  # 0 = uno por CPU; -1 = sin pool (en el thread)
+RENDER_CACHE_DIR = os.getenv(
+    'RENDER_CACHE_DIR',
+    os.path.join(os.path.dirname(__file__), '..', 'data', 'render')
+)  # PNGs de páginas renderizadas (se entregan como archivos)
+RENDER_CACHE_HORAS = float(os.getenv('RENDER_CACHE_HORAS', '6'))
+
+# Pipeline de lotes (render -> modelo -> BD); la etapa de BD es siempre de a una factura
+PIPELINE_RENDER = int(os.getenv('PIPELINE_RENDER', '2'))  # Facturas renderizándose a la vez
+PIPELINE_MODELO = int(os.getenv('PIPELINE_MODELO', '4'))  # Llamadas a Gemini simultáneas
+PIPELINE_COLA = int(os.getenv('PIPELINE_COLA', '4'))  # Facturas en espera entre etapas
+
+# Consulta anticipada de proveedor/OCs cuando el CUIT se lee del QR o de la capa de texto
+PREFETCH_PROVEEDOR = os.getenv('PREFETCH_PROVEEDOR', 'true').lower() == 'true'
+PREFETCH_CONEXIONES = int(os.getenv('PREFETCH_CONEXIONES', '2'))  # Conexiones propias a la BD
+
+# Trazas (spans por request: etapas, llamadas a Gemini, sentencias SQL)
+TRACING = os.getenv('TRACING', 'off').lower()  # jsonl | otlp | off
+TRACING_DIR = os.getenv('TRACING_DIR', os.path.join(os.path.dirname(__file__), '..', 'data', 'traces'))
+TRACING_RETENCION_DIAS = int(os.getenv('TRACING_RETENCION_DIAS', '7'))
+TRACING_ARCHIVO_MB = float(os.getenv('TRACING_ARCHIVO_MB', '50'))  # Tamaño al que se rota el JSONL del día
+TRACING_MAX_MB = float(os.getenv('TRACING_MAX_MB', '500'))  # Tope de la carpeta (se borran los más viejos)
+TRACING_OTLP_URL = os.getenv('TRACING_OTLP_URL', 'http://localhost:4318/v1/traces')
+
+# Estadísticas de consultas SQL y log de consultas lentas
+DB_LENTA_MS = float(os.getenv('DB_LENTA_MS', '500'))  # Umbral de consulta lenta (execute + fetch)
+DB_CAPTURAR_PLANES = os.getenv('DB_CAPTURAR_PLANES', 'true').lower() == 'true'  # Plan estimado de las SELECT lentas
+DB_PLANES_DIR = os.getenv('DB_PLANES_DIR', os.path.join(os.path.dirname(__file__), '..', 'data', 'query_plans'))
+
+# Perfilado a pedido (header X-Profile o ?profile= con este token); vacío = deshabilitado
+PROFILING_TOKEN = os.getenv('PROFILING_TOKEN', '')
+PROFILING_DIR = os.getenv('PROFILING_DIR', os.path.join(os.path.dirname(__file__), '..', 'data', 'profiles'))
+PROFILING_MAX = int(os.getenv('PROFILING_MAX', '50'))  # Perfiles que se conservan
+PROFILING_INTERVALO_MS = float(os.getenv('PROFILING_INTERVALO_MS', '5'))  # Modo muestreo
+
+# Logging (stdout): texto con colores o JSON, escrito desde un thread aparte
+LOG_NIVEL = os.getenv('LOG_NIVEL', 'INFO').upper()
+LOG_FORMATO = os.getenv('LOG_FORMATO', 'texto').lower()  # texto | json
+LOG_ASINCRONO = os.getenv('LOG_ASINCRONO', 'true').lower() == 'true'
+LOG_COLA = int(os.getenv('LOG_COLA', '10000'))  # Registros en espera; con la cola llena se descartan
+LOG_MUESTREO = os.getenv('LOG_MUESTREO', '')  # ej. 'detalle=0.1,database_integrator.detalle=0.05'
+
+# Backend del modelo: 'vivo' (Gemini), 'grabar' (Gemini + graba cada respuesta) o 'replay' (offline)
+GEMINI_BACKEND = os.getenv('GEMINI_BACKEND', 'vivo').lower()
+GEMINI_GRABACIONES_DIR = os.getenv(
+    'GEMINI_GRABACIONES_DIR',
+    os.path.join(os.path.dirname(__file__), '..', 'data', 'gemini_grabaciones')
+)
+GEMINI_REPLAY_LATENCIA = os.getenv('GEMINI_REPLAY_LATENCIA', 'grabada')  # grabada | cero | fija:S | uniforme:A,B | normal:M,D | lognormal:MEDIANA,SIGMA
+GEMINI_REPLAY_ESCALA = float(os.getenv('GEMINI_REPLAY_ESCALA', '1'))  # Multiplica la latencia simulada
+GEMINI_REPLAY_ERRORES = os.getenv('GEMINI_REPLAY_ERRORES', '')  # ej. '503=0.05,429=0.02,timeout=0.01'
+GEMINI_REPLAY_SEMILLA = int(os.getenv('GEMINI_REPLAY_SEMILLA')) if os.getenv('GEMINI_REPLAY_SEMILLA') else None
+
+# Resultados de benchmark.py (JSON por corrida y la base para comparar)
+BENCHMARK_DIR = os.getenv('BENCHMARK_DIR', os.path.join(os.path.dirname(__file__), '..', 'data', 'benchmarks'))
@@ -0,0 +1,287 @@
+"""
+Cursor de BD instrumentado
+Envuelve el cursor pyodbc: cada sentencia suma a las estadísticas por consulta (latencia,
+filas, errores), queda como span de la traza en curso y, si supera DB_LENTA_MS, se registra
+en el log de consultas lentas con sus parámetros enmascarados y el plan estimado
+(SHOWPLAN_XML de SQL Server o EXPLAIN QUERY PLAN de la réplica SQLite)
+"""
+
+import os
+import re
+import time
+import hashlib
+import logging
+import threading
+from collections import deque
+from datetime import date, datetime
+from decimal import Decimal
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+import db_config
+import db_backend
+import tracing
+from metrics import REGISTRO
+from logging_config import log_warning
+
+logger = logging.getLogger(__name__)
+
+PATRON_ESPACIOS = re.compile(r'\s+')
+SQL_MAX = 500  # Caracteres del SQL que se guardan en el span y en el reporte
+LENTAS_MAX = 100  # Consultas lentas recientes que se conservan en memoria
+
+SENTENCIA_SEGUNDOS = REGISTRO.histograma(
+    'bd_sentencia_segundos', 'Duración de cada sentencia SQL (execute + fetch) por consulta', ('operacion', 'consulta'))
+
+
+def normalizar_sql(sql: str) -> str:
+    """SQL en una línea (sin la indentación de los strings multilínea)"""
+    return PATRON_ESPACIOS.sub(' ', sql).strip()
+
+
+def huella_sql(sql_normalizado: str) -> str:
+    """Identificador corto y estable de una consulta (las sentencias usan parámetros '?')"""
+    return hashlib.sha1(sql_normalizado.encode('utf-8')).hexdigest()[:10]
+
+
+@lru_cache(maxsize=512)
+def _analizar(sql: str) -> Tuple[str, str, str]:
+    """(SQL normalizado, huella, operación); las sentencias son constantes, se analizan una vez"""
+    normalizado = normalizar_sql(sql)
+    return normalizado, huella_sql(normalizado), normalizado.split(' ', 1)[0].upper()
+
+
+def enmascarar(valor):
+    """Parámetro apto para el log: tipo y largo de los textos, sin su contenido"""
+    if valor is None or isinstance(valor, bool):
+        return valor
+    if isinstance(valor, (int, float, Decimal)):
+        return f"<{type(valor).__name__}>"
+    if isinstance(valor, (datetime, date)):
+        return f"<{type(valor).__name__}>"
+    if isinstance(valor, (bytes, bytearray)):
+        return f"<bytes:{len(valor)}>"
+    return f"<str:{len(str(valor))}>"
+
+
+def _parametros(params: tuple) -> tuple:
+    """pyodbc acepta execute(sql, a, b) y execute(sql, (a, b))"""
+    if len(params) == 1 and isinstance(params[0], (list, tuple)):
+        return tuple(params[0])
+    return params
+
+
+class EstadisticasConsultas:
+    """Acumulado por consulta (thread-safe; compartido por todas las conexiones del proceso)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._consultas = {}
+        self._lentas = deque(maxlen=LENTAS_MAX)
+        self._planes = set()  # Consultas con el plan ya capturado
+
+    def registrar(self, consulta: str, sql: str, operacion: str, segundos: float,
+                  filas: Optional[int], error: bool) -> bool:
+        """Suma una ejecución; True si es la primera vez que esta consulta resulta lenta"""
+        SENTENCIA_SEGUNDOS.observar(segundos, operacion=operacion, consulta=consulta)
+        lenta = segundos * 1000 >= db_config.DB_LENTA_MS
+        with self._lock:
+            c = self._consultas.get(consulta)
+            if c is None:
+                c = self._consultas[consulta] = {
+                    'consulta': consulta, 'operacion': operacion, 'sql': sql[:SQL_MAX],
+                    'ejecuciones': 0, 'errores': 0, 'lentas': 0, 'filas': 0,
+                    'segundos_total': 0.0, 'segundos_max': 0.0
+                }
+            c['ejecuciones'] += 1
+            c['errores'] += int(error)
+            c['filas'] += filas or 0
+            c['segundos_total'] += segundos
+            c['segundos_max'] = max(c['segundos_max'], segundos)
+            if not lenta:
+                return False
+            c['lentas'] += 1
+            primera = consulta not in self._planes
+            self._planes.add(consulta)
+            return primera
+
+    def registrar_lenta(self, entrada: Dict):
+        with self._lock:
+            self._lentas.append(entrada)
+
+    def reporte(self, orden: str = 'segundos_total', limite: int = 50) -> Dict:
+        """Consultas ordenadas por tiempo total (o 'segundos_max', 'ejecuciones', 'lentas'), con p50/p95/p99"""
+        with self._lock:
+            consultas = [dict(c) for c in self._consultas.values()]
+            lentas = list(self._lentas)
+        if orden not in ('segundos_total', 'segundos_max', 'ejecuciones', 'lentas', 'errores', 'filas'):
+            orden = 'segundos_total'
+        consultas.sort(key=lambda c: c[orden], reverse=True)
+
+        for c in consultas[:limite]:
+            c.update(SENTENCIA_SEGUNDOS.resumen(operacion=c['operacion'], consulta=c['consulta']))
+            c['segundos_total'] = round(c['segundos_total'], 6)
+            c['segundos_max'] = round(c['segundos_max'], 6)
+            del c['cantidad'], c['suma']
+        return {
+            'umbral_lenta_ms': db_config.DB_LENTA_MS,
+            'consultas': consultas[:limite],
+            'lentas_recientes': lentas[::-1],
+        }
+
+
+ESTADISTICAS = EstadisticasConsultas()
+
+
+class _Sentencia:
+    __slots__ = ('original', 'sql', 'consulta', 'operacion', 'params', 'inicio', 'span', 'filas')
+
+    def __init__(self, sql: str, params: tuple, span):
+        self.original = sql  # Para el plan: en una línea, un comentario '--' se come el resto
+        self.sql, self.consulta, self.operacion = _analizar(sql)
+        self.params = params
+        self.span = span
+        self.filas = 0
+        self.inicio = time.perf_counter()
+
+
+class CursorInstrumentado:
+    """
+    Mismo uso que el cursor pyodbc (execute, fetchone, fetchall...). Una SELECT se da por
+    terminada al leer sus filas, así su duración incluye el fetch.
+    fetchone la cierra: en este sistema se usa para consultas de una sola fila.
+    """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._pendiente = None  # Última consulta, hasta leer sus filas
+
+    def execute(self, sql: str, *params):
+        self._cerrar_pendiente()
+        params = _parametros(params)
+        actual = _Sentencia(sql, params, None)
+        actual.span = tracing.hijo('sql', operacion=actual.operacion, sql=actual.sql[:SQL_MAX],
+                                   consulta=actual.consulta, parametros=len(params))
+        try:
+            self._cursor.execute(sql, *params)
+        except Exception as e:
+            self._finalizar(actual, e)
+            raise
+
+        if self._cursor.description is None:
+            # INSERT/UPDATE/BEGIN/COMMIT: no hay filas que leer
+            actual.filas = self._cursor.rowcount if self._cursor.rowcount >= 0 else None
+            self._finalizar(actual)
+        else:
+            self._pendiente = actual
+        return self
+
+    def fetchone(self):
+        fila = self._cursor.fetchone()
+        if fila is not None and self._pendiente:
+            self._pendiente.filas += 1
+        self._cerrar_pendiente()
+        return fila
+
+    def fetchall(self):
+        filas = self._cursor.fetchall()
+        if self._pendiente:
+            self._pendiente.filas += len(filas)
+        self._cerrar_pendiente()
+        return filas
+
+    def fetchmany(self, size: int = None):
+        filas = self._cursor.fetchmany(size) if size is not None else self._cursor.fetchmany()
+        if self._pendiente:
+            self._pendiente.filas += len(filas)
+        if not filas:
+            self._cerrar_pendiente()
+        return filas
+
+    def __iter__(self):
+        for fila in self._cursor:
+            if self._pendiente:
+                self._pendiente.filas += 1
+            yield fila
+        self._cerrar_pendiente()
+
+    def close(self):
+        self._cerrar_pendiente()
+        self._cursor.close()
+
+    def _cerrar_pendiente(self):
+        if self._pendiente is not None:
+            pendiente, self._pendiente = self._pendiente, None
+            self._finalizar(pendiente)
+
+    def _finalizar(self, s: _Sentencia, error: Optional[Exception] = None):
+        segundos = time.perf_counter() - s.inicio
+        operacion, consulta = s.operacion, s.consulta
+
+        if s.span is not None:
+            s.span.set(filas=s.filas)
+            s.span.terminar(error)
+
+        capturar_plan = ESTADISTICAS.registrar(consulta, s.sql, operacion, segundos, s.filas, error is not None)
+        if segundos * 1000 < db_config.DB_LENTA_MS:
+            return
+
+        entrada = {
+            'momento': datetime.now().isoformat(timespec='seconds'),
+            'consulta': consulta,
+            'ms': round(segundos * 1000, 1),
+            'filas': s.filas,
+            'sql': s.sql[:SQL_MAX],
+            'parametros': [enmascarar(p) for p in s.params],
+            'trace_id': tracing.trace_id_actual(),
+        }
+        log_warning(logger, f"Consulta lenta ({entrada['ms']:.0f} ms, {s.filas} fila(s)) [{consulta}]: "
+                            f"{entrada['sql'][:200]} params={entrada['parametros']}")
+
+        # El plan estimado sólo para SELECT (no se ejecuta) y una vez por consulta
+        if capturar_plan and db_config.DB_CAPTURAR_PLANES and operacion == 'SELECT':
+            entrada['plan'] = self._capturar_plan(s, consulta)
+        ESTADISTICAS.registrar_lenta(entrada)
+
+    def _capturar_plan(self, s: _Sentencia, consulta: str) -> Optional[str]:
+        """
+        Guarda el plan estimado en DB_PLANES_DIR: <consulta>.sqlplan (SHOWPLAN_XML, se abre con SSMS)
+        o, con la réplica SQLite, <consulta>.txt (EXPLAIN QUERY PLAN)
+        """
+        try:
+            if hasattr(self._cursor, 'plan_estimado'):
+                plan, extension = self._cursor.plan_estimado(s.original, s.params), 'txt'
+            else:
+                plan, extension = self._showplan(s), 'sqlplan'
+            if not plan:
+                return None
+
+            os.makedirs(db_config.DB_PLANES_DIR, exist_ok=True)
+            ruta = os.path.join(db_config.DB_PLANES_DIR, f"{consulta}.{extension}")
+            with open(ruta, 'w', encoding='utf-8') as f:
+                f.write(plan)
+            return os.path.basename(ruta)
+        except Exception as e:
+            log_warning(logger, f"No se pudo capturar el plan de [{consulta}]: {e}")
+            return None
+
+    def _showplan(self, s: _Sentencia) -> Optional[str]:
+        """
+        Plan XML de SQL Server (la sentencia no se ejecuta) en una conexión propia y descartable:
+        SHOWPLAN_XML es una opción de sesión y en la conexión de trabajo, en medio de una
+        transacción, dejaría las sentencias siguientes compiladas pero sin ejecutar si falla el OFF
+        """
+        conexion = db_backend.conectar()
+        try:
+            cursor = conexion.cursor()
+            cursor.execute("SET SHOWPLAN_XML ON")
+            cursor.execute(s.original, *s.params)
+            fila = cursor.fetchone()
+            return fila[0] if fila else None
+        finally:
+            try:
+                conexion.close()
+            except Exception:
+                pass
+
+    def __getattr__(self, nombre):
+        return getattr(self._cursor, nombre)
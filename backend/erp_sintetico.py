@@ -0,0 +1,290 @@
+"""
+Datos sintéticos para la réplica local del ERP (DB_BACKEND=sqlite)
+Genera proveedores, OCs con items, comprobantes con items e impuestos, ejercicios y asientos con
+sus movimientos, en volúmenes de producción (millones de filas), para medir cambios en las
+consultas sin SQL Server. Con --desde-resultados agrega como proveedores activos los CUITs de
+las facturas ya procesadas: así el replay de Gemini (gemini_backend) las resuelve contra la réplica.
+
+Uso: python erp_sintetico.py [--proveedores N] [--ocs N] [--facturas N] [--desde-resultados] [--reemplazar]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import logging
+import argparse
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Set, Tuple
+import db_config
+import db_backend
+from cuit import normalizar_cuit, digito_verificador
+from result_index import ResultIndex
+from logging_config import log_info, log_success, EMOJI
+
+logger = logging.getLogger(__name__)
+
+LOTE = 10000  # Filas por executemany
+
+RUBROS = ('DISTRIBUIDORA', 'TRANSPORTES', 'INDUSTRIAS', 'SERVICIOS', 'AGROPECUARIA', 'COMERCIAL',
+          'METALURGICA', 'QUIMICA', 'LOGISTICA', 'CEREALES', 'ENVASES', 'ELECTRICIDAD')
+NOMBRES = ('DEL SUR', 'PAMPA', 'LITORAL', 'SAN MARTIN', 'CENTRO', 'NORTE', 'ANDINA', 'RIO', 'LA ESPERANZA',
+           'SANTA ROSA', 'DEL PLATA', 'GENERAL', 'PATAGONIA', 'CUYO', 'MERIDIANO', 'LOS ALAMOS')
+SOCIEDADES = ('S.A.', 'S.R.L.', 'S.A.S.', 'S.H.', '')
+PRODUCTOS = ('BOLSA POLIPROPILENO 50KG', 'FLETE CORTA DISTANCIA', 'REPUESTO ELEVADOR', 'TRIGO PAN',
+             'ACEITE HIDRAULICO', 'SERVICIO DE MANTENIMIENTO', 'HILO COSEDORA', 'PALLET MADERA',
+             'ETIQUETA AUTOADHESIVA', 'ANALISIS DE LABORATORIO', 'CORREA TRANSPORTADORA', 'GAS NATURAL')
+
+# (valor, peso) de las columnas con distribución
+TIPOS_PERSONA = (('P', 80), ('C', 8), ('RI', 7), (None, 3), ('', 2))
+ESTADOS_OC = (('CERRADA', 60), ('ABIERTA', 20), ('PARCIAL', 20))
+TIPOS_DOCUMENTO = (('FACTT', 90), ('NCTA', 4), ('NCTB', 2), ('NDTA', 2), ('NDTB', 1), ('NCTC', 1))
+ALICUOTAS_IVA = ((21.0, 75), (10.5, 20), (27.0, 5))
+
+
+def _elegir(rng: random.Random, opciones) -> object:
+    valores, pesos = zip(*opciones)
+    return rng.choices(valores, pesos)[0]
+
+
+def _cuit(rng: random.Random, excluidos: Set[str]) -> str:
+    """CUIT con dígito verificador válido (prefijo de empresa) que no esté en excluidos"""
+    while True:
+        base = rng.choice(('30', '33')) + f"{rng.randrange(10 ** 8):08d}"
+        verificador = digito_verificador(base)
+        if verificador is not None and base + str(verificador) not in excluidos:
+            return base + str(verificador)
+
+
+def _nombre(rng: random.Random) -> Tuple[str, str]:
+    rubro, nombre = rng.choice(RUBROS), rng.choice(NOMBRES)
+    sociedad = rng.choice(SOCIEDADES)
+    completo = f"{rubro} {nombre} {sociedad}".strip()
+    return completo, f"{rubro[:6]} {nombre}"[:20]
+
+
+def _fecha(rng: random.Random, hoy: datetime, dias: int) -> datetime:
+    """Fecha de los últimos 'dias' días, más densa cerca de hoy (el volumen crece con el tiempo)"""
+    return hoy - timedelta(days=int(dias * (1 - rng.random() ** 0.5)))
+
+
+def _texto(fecha: datetime) -> str:
+    return fecha.strftime('%Y-%m-%d 00:00:00')
+
+
+class Cargador:
+    """Acumula filas por tabla y las inserta de a LOTE"""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self._pendientes = {}
+
+    def agregar(self, tabla: str, fila: tuple):
+        pendientes = self._pendientes.setdefault(tabla, [])
+        pendientes.append(fila)
+        if len(pendientes) >= LOTE:
+            self._insertar(tabla, pendientes)
+
+    def _insertar(self, tabla: str, filas: List[tuple]):
+        marcadores = ', '.join('?' for _ in filas[0])
+        # OR IGNORE: una clave repetida al azar (mismo emisor, tipo, punto y número) se descarta
+        self.conn.executemany(f"INSERT OR IGNORE INTO {tabla} VALUES ({marcadores})", filas)
+        filas.clear()
+
+    def vaciar(self):
+        for tabla, filas in self._pendientes.items():
+            if filas:
+                self._insertar(tabla, filas)
+
+
+def proveedores_de_resultados(carpeta_data: str) -> List[Tuple[str, str]]:
+    """(cuit, nombre) de los proveedores de las facturas procesadas con éxito"""
+    ruta = os.path.join(carpeta_data, 'resultados.sqlite3')
+    if not os.path.exists(ruta):
+        return []
+    proveedores = []
+    for cuit, nombre in ResultIndex(ruta).proveedores_exitosos():
+        cuit = normalizar_cuit(cuit)
+        if len(cuit) == 11 and cuit.isdigit():
+            proveedores.append((cuit, (nombre or f"PROVEEDOR {cuit}").upper()))
+    return proveedores
+
+
+def _personas(rng: random.Random, cantidad: int, reales: List[Tuple[str, str]], excluidos: Set[str]) -> Iterator[tuple]:
+    for i in range(1, cantidad + 1):
+        nombre, corto = _nombre(rng)
+        activo = rng.random() < 0.9
+        yield (
+            f"{i:06d}", nombre, corto, _cuit(rng, excluidos), None,
+            _elegir(rng, TIPOS_PERSONA),
+            'ACTIVO' if activo else 'BAJA',
+            'SI' if rng.random() < 0.95 else 'NO',
+        )
+    # Los de facturas reales van activos y con documentación completa
+    for j, (cuit, nombre) in enumerate(reales, cantidad + 1):
+        yield (f"{j:06d}", nombre, nombre[:20], cuit, None, 'P', 'ACTIVO', 'SI')
+
+
+def _ocs(cargador: Cargador, rng: random.Random, cantidad: int, proveedores: int, items_max: int,
+         hoy: datetime, dias: int):
+    for i in range(1, cantidad + 1):
+        nro = f"{i:08d}"
+        estado = _elegir(rng, ESTADOS_OC)
+        total = 0.0
+        for item in range(1, rng.randint(1, items_max) + 1):
+            cantidad_item = float(rng.randint(1, 500))
+            precio = round(rng.uniform(100, 250000), 2)
+            pendiente = {'CERRADA': 0.0, 'ABIERTA': cantidad_item}.get(estado, float(rng.randint(0, int(cantidad_item))))
+            total += cantidad_item * precio
+            cargador.agregar('ISMST_ORDEN_COMPRA_ITEM', (
+                nro, item, f"PR{rng.randrange(10 ** 5):05d}", rng.choice(PRODUCTOS), cantidad_item, precio,
+                pendiente, _elegir(rng, ALICUOTAS_IVA), 'ANULADO' if rng.random() < 0.01 else 'ACTIVO',
+            ))
+        cargador.agregar('ISMST_ORDEN_COMPRA_CAB', (
+            nro, _texto(_fecha(rng, hoy, dias)), f"{rng.randint(1, proveedores):06d}", estado,
+            round(total, 2), '' if rng.random() < 0.7 else 'ENTREGA EN PLANTA', rng.choice(('N', 'S')),
+        ))
+
+
+def _documentos(cargador: Cargador, rng: random.Random, cantidad: int, proveedores: int, items_max: int,
+                asientos: float, hoy: datetime, dias: int) -> int:
+    """Comprobantes de proveedores con items, impuestos y (una fracción) su asiento; devuelve los asientos"""
+    compania, receptor = db_config.COMPANIA, db_config.RECEPTOR
+    nro_asiento = 0
+    for nro_archivo in range(1, cantidad + 1):
+        emisor = f"{rng.randint(1, proveedores):06d}"
+        tipo = _elegir(rng, TIPOS_DOCUMENTO)
+        punto = f"{rng.randint(1, 30):04d}"
+        numero = f"{rng.randrange(1, 10 ** 8):08d}"
+        clave = (compania, tipo, numero, emisor, receptor, punto)
+        fecha = _fecha(rng, hoy, dias)
+
+        neto = 0.0
+        for item in range(1, rng.randint(1, items_max) + 1):
+            cantidad_item = float(rng.randint(1, 200))
+            precio = round(rng.uniform(50, 150000), 2)
+            neto += cantidad_item * precio
+            cargador.agregar('ISMST_DOCUMENTOS_ITEM', clave + (item, rng.choice(PRODUCTOS), cantidad_item, precio))
+        neto = round(neto, 2)
+        iva = round(neto * _elegir(rng, ALICUOTAS_IVA) / 100, 2)
+        percepcion = round(neto * 0.03, 2) if rng.random() < 0.2 else 0.0
+        total = round(neto + iva + percepcion, 2)
+
+        cargador.agregar('ismsv_impuestos_documento', (compania, tipo, numero, emisor, receptor, 0, 'IVA', iva, punto))
+        if percepcion:
+            cargador.agregar('ismsv_impuestos_documento', (compania, tipo, numero, emisor, receptor, 0, 'PERC_IIBB', percepcion, punto))
+
+        dolares = rng.random() < 0.05
+        cargador.agregar('ISMST_DOCUMENTOS_CAB', clave + (
+            _texto(fecha), _texto(fecha + timedelta(days=30)), 'USD' if dolares else 'ARS',
+            round(rng.uniform(800, 1200), 2) if dolares else 1.0, total, str(nro_archivo),
+            'SI' if rng.random() < 0.02 else 'NO',
+        ))
+
+        if rng.random() < asientos:
+            nro_asiento += 1
+            ejercicio = str(fecha.year)
+            comprobante = f"{punto}-{numero}"
+            cargador.agregar('ISMST_ASIENTOS', (
+                nro_asiento, _texto(fecha), f"Factura {comprobante} - Prov: {emisor}", tipo, '0', emisor,
+                'Automático', '', 'Verdadero', compania, 'Falso', _texto(fecha), 'Proveedores', ejercicio, _texto(fecha),
+            ))
+            movimientos = [(db_config.CUENTA_PROVEEDORES, total, 'HABER', 'Proveedores'),
+                           (db_config.CUENTA_IVA_CREDITO, iva, 'DEBE', 'IVA Crédito Fiscal'),
+                           (db_config.CUENTA_GASTO_DEFECTO, round(neto + percepcion, 2), 'DEBE', 'Gasto/Compra')]
+            for cuenta, importe, posicion, descripcion in movimientos:
+                cargador.agregar('ISMST_MOVIMIENTOS', (
+                    nro_asiento, cuenta, comprobante, _texto(fecha), descripcion, importe, posicion, '',
+                    _texto(fecha), 0, compania, ejercicio,
+                ))
+    return nro_asiento
+
+
+def generar(ruta: str, proveedores: int = 2000, ocs: int = 20000, facturas: int = 100000,
+            items_max: int = 5, asientos: float = 1.0, anios: int = 3, semilla: int = 1,
+            carpeta_data: str = None, reemplazar: bool = False) -> Dict:
+    """
+    Carga la réplica en 'ruta' y devuelve las filas por tabla.
+    Falla si ya tiene datos, salvo reemplazar=True (borra el archivo antes).
+    """
+    if reemplazar:
+        for sufijo in ('', '-wal', '-shm'):
+            if os.path.exists(ruta + sufijo):
+                os.remove(ruta + sufijo)
+    os.makedirs(os.path.dirname(os.path.abspath(ruta)), exist_ok=True)
+
+    conn = sqlite3.connect(ruta, isolation_level=None)
+    try:
+        db_backend.crear_esquema(conn, indices=False)
+        if conn.execute("SELECT COUNT(*) FROM ISMST_PERSONAS").fetchone()[0]:
+            raise ValueError(f"{ruta} ya tiene datos (usar --reemplazar)")
+
+        # Carga masiva: sin journal ni fsync; los índices se crean al final
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        rng = random.Random(semilla)
+        hoy = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        dias = max(1, anios) * 365
+        inicio = time.perf_counter()
+
+        reales = proveedores_de_resultados(carpeta_data) if carpeta_data else []
+        excluidos = {normalizar_cuit(c) for c in db_config.CUITS_PROPIOS} | {cuit for cuit, _ in reales}
+        log_info(logger, f"{EMOJI['database']} Generando réplica del ERP en {ruta} "
+                         f"({proveedores} proveedores + {len(reales)} de resultados, {ocs} OCs, {facturas} comprobantes)")
+
+        conn.execute("BEGIN")
+        cargador = Cargador(conn)
+        for fila in _personas(rng, proveedores, reales, excluidos):
+            cargador.agregar('ISMST_PERSONAS', fila)
+        for anio in range(hoy.year - max(1, anios), hoy.year + 2):
+            cargador.agregar('ISMST_EJERCICIOS', (str(anio), f"{anio}-01-01 00:00:00", f"{anio}-12-31 00:00:00"))
+
+        # Las OCs y comprobantes también cubren a los proveedores de resultados
+        total_proveedores = proveedores + len(reales)
+        _ocs(cargador, rng, ocs, total_proveedores, items_max, hoy, dias)
+        _documentos(cargador, rng, facturas, total_proveedores, items_max, asientos, hoy, dias)
+        cargador.vaciar()
+        conn.execute("COMMIT")
+
+        log_info(logger, "Creando índices...")
+        conn.executescript(db_backend.INDICES)
+        conn.execute("ANALYZE")
+        conn.execute("PRAGMA journal_mode=WAL")
+
+        filas = {tabla: conn.execute(f"SELECT COUNT(*) FROM {tabla}").fetchone()[0] for tabla in db_backend.TABLAS_ERP}
+        log_success(logger, f"Réplica generada: {sum(filas.values()):,} filas en {time.perf_counter() - inicio:.1f}s")
+        return filas
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera datos sintéticos en la réplica SQLite del ERP")
+    parser.add_argument('--ruta', default=db_config.DB_SQLITE_PATH, help="Archivo SQLite (DB_SQLITE_PATH)")
+    parser.add_argument('--proveedores', type=int, default=2000)
+    parser.add_argument('--ocs', type=int, default=20000)
+    parser.add_argument('--facturas', type=int, default=100000, help="Comprobantes en ISMST_DOCUMENTOS_CAB")
+    parser.add_argument('--items-max', type=int, default=5, help="Items por OC y por comprobante (1 a N)")
+    parser.add_argument('--asientos', type=float, default=1.0, help="Fracción de comprobantes con asiento")
+    parser.add_argument('--anios', type=int, default=3, help="Antigüedad de los datos")
+    parser.add_argument('--semilla', type=int, default=1)
+    parser.add_argument('--desde-resultados', nargs='?', const=os.path.join(os.path.dirname(__file__), '..', 'data'),
+                        metavar='CARPETA_DATA', help="Agrega los proveedores de las facturas ya procesadas")
+    parser.add_argument('--reemplazar', action='store_true', help="Borra la réplica existente")
+    args = parser.parse_args()
+
+    try:
+        filas = generar(args.ruta, args.proveedores, args.ocs, args.facturas, args.items_max, args.asientos,
+                        args.anios, args.semilla, args.desde_resultados, args.reemplazar)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    print(json.dumps(filas, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    from logging_config import setup_logging
+    setup_logging()
+    main()
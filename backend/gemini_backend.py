@@ -0,0 +1,339 @@
+"""
+Backends de llamada al modelo: grabación y reproducción offline
+'grabar' llama a Gemini y guarda cada par pedido/respuesta, identificado por un hash del contenido;
+'replay' responde desde esas grabaciones sin red, con latencia simulada e inyección de errores,
+para medir el resto del sistema de forma reproducible. Las grabaciones también se siembran desde
+los resultados ya procesados (data/processed) cuyo archivo sigue en data/uploads.
+
+Uso: python gemini_backend.py sembrar [carpeta_data]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import logging
+import threading
+from copy import deepcopy
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Dict, List, Optional, Tuple
+from google.api_core import exceptions as gexc
+from PIL import Image
+import db_config
+from gemini_retry import uso_tokens
+from rendering import renderizar_pdf
+from result_index import ResultIndex
+from result_archive import ResultArchive
+from logging_config import log_info, log_success, log_warning, EMOJI
+
+logger = logging.getLogger(__name__)
+
+# Errores inyectables en replay (GEMINI_REPLAY_ERRORES)
+ERRORES_SIMULADOS = {
+    '400': gexc.InvalidArgument,
+    '429': gexc.ResourceExhausted,
+    '500': gexc.InternalServerError,
+    '503': gexc.ServiceUnavailable,
+    '504': gexc.GatewayTimeout,
+}
+PAGINAS_EXTRACCION = 5  # extract_invoice_data envía las primeras 5 páginas
+
+
+class GrabacionNoEncontrada(LookupError):
+    """No hay grabación para el pedido (no es transitorio: no se reintenta)"""
+
+
+def _nombre_modelo(model) -> str:
+    return str(getattr(model, 'model_name', '') or '').replace('models/', '')
+
+
+def huella_imagen(img: Image.Image) -> str:
+    """Hash de los píxeles (no del PNG): el mismo render da la misma huella aunque cambie la codificación"""
+    h = hashlib.sha256(f"{img.mode}:{img.size}".encode())
+    h.update(img.tobytes())
+    return h.hexdigest()
+
+
+def claves(modelo: str, proposito: str, contents) -> Tuple[str, str]:
+    """
+    (clave, clave_documento). clave: modelo + todas las partes del pedido, exacta.
+    clave_documento: propósito + imágenes, para reproducir aunque cambien el prompt o el modelo.
+    """
+    exacta = hashlib.sha256(modelo.encode())
+    documento = hashlib.sha256(proposito.encode())
+    for parte in contents if isinstance(contents, (list, tuple)) else [contents]:
+        if isinstance(parte, Image.Image):
+            huella = huella_imagen(parte).encode()
+            exacta.update(b'I' + huella)
+            documento.update(huella)
+        else:
+            exacta.update(b'T' + str(parte).encode('utf-8'))
+    return exacta.hexdigest()[:32], documento.hexdigest()[:32]
+
+
+class RespuestaGrabada:
+    """Lo que el sistema usa de una respuesta de generate_content: text y usage_metadata"""
+
+    def __init__(self, texto: str, uso: Optional[Dict] = None):
+        self.text = texto
+        uso = uso or {}
+        self.usage_metadata = SimpleNamespace(
+            prompt_token_count=uso.get('tokens_entrada'),
+            candidates_token_count=uso.get('tokens_salida'),
+            cached_content_token_count=uso.get('tokens_cache'),
+            total_token_count=uso.get('tokens_total'),
+        )
+
+
+class Grabaciones:
+    """Carpeta de grabaciones (<clave>.json), indexada en memoria por clave y por documento"""
+
+    def __init__(self, carpeta: str):
+        self.carpeta = carpeta
+        self._lock = threading.Lock()
+        self._por_clave = {}
+        self._por_documento = {}
+        if os.path.isdir(carpeta):
+            for nombre in os.listdir(carpeta):
+                if nombre.endswith('.json'):
+                    try:
+                        with open(os.path.join(carpeta, nombre), encoding='utf-8') as f:
+                            self._indexar(json.load(f))
+                    except (OSError, ValueError) as e:
+                        log_warning(logger, f"Grabación inválida ({nombre}): {e}")
+
+    def __len__(self):
+        return len(self._por_clave)
+
+    def _indexar(self, grabacion: Dict):
+        self._por_clave[grabacion['clave']] = grabacion
+        self._por_documento[grabacion['clave_documento']] = grabacion
+
+    def buscar(self, clave: str, clave_documento: str) -> Optional[Dict]:
+        with self._lock:
+            return self._por_clave.get(clave) or self._por_documento.get(clave_documento)
+
+    def guardar(self, grabacion: Dict):
+        os.makedirs(self.carpeta, exist_ok=True)
+        ruta = os.path.join(self.carpeta, f"{grabacion['clave']}.json")
+        with open(f"{ruta}.tmp", 'w', encoding='utf-8') as f:
+            json.dump(grabacion, f, ensure_ascii=False)
+        os.replace(f"{ruta}.tmp", ruta)
+        with self._lock:
+            self._indexar(grabacion)
+
+
+class BackendGrabador:
+    """Llama a Gemini y graba cada respuesta exitosa"""
+
+    def __init__(self, grabaciones: Grabaciones):
+        self.grabaciones = grabaciones
+
+    def generar(self, model, contents, timeout: float, proposito: str, kwargs: dict):
+        inicio = time.monotonic()
+        response = model.generate_content(contents, request_options={'timeout': timeout}, **kwargs)
+        modelo = _nombre_modelo(model)
+        clave, clave_documento = claves(modelo, proposito, contents)
+        try:
+            self.grabaciones.guardar({
+                'clave': clave,
+                'clave_documento': clave_documento,
+                'proposito': proposito,
+                'modelo': modelo,
+                'texto': response.text,
+                'uso': uso_tokens(response),
+                'segundos': round(time.monotonic() - inicio, 3),
+                'grabado_en': datetime.now().isoformat(timespec='seconds'),
+            })
+        except Exception as e:
+            log_warning(logger, f"No se pudo grabar la respuesta de Gemini: {e}")
+        return response
+
+
+def _parsear_latencia(texto: str) -> Tuple[str, List[float]]:
+    """'grabada' | 'cero' | 'fija:2' | 'uniforme:1,3' | 'normal:2,0.5' | 'lognormal:2,0.4' -> (tipo, parámetros)"""
+    tipo, _, parametros = (texto or 'grabada').partition(':')
+    try:
+        valores = [float(v) for v in parametros.split(',') if v.strip()]
+    except ValueError:
+        valores = []
+    return tipo.strip().lower(), valores
+
+
+def _parsear_errores(texto: str) -> List[Tuple[str, float]]:
+    """'503=0.05,429=0.02,timeout=0.01' -> [('503', 0.05), ...]"""
+    errores = []
+    for parte in (texto or '').split(','):
+        codigo, _, tasa = parte.partition('=')
+        codigo = codigo.strip().lower()
+        if codigo in ERRORES_SIMULADOS or codigo == 'timeout':
+            try:
+                errores.append((codigo, float(tasa)))
+            except ValueError:
+                continue
+    return errores
+
+
+class BackendReplay:
+    """
+    Responde desde las grabaciones, sin red. La latencia sale de la grabación o de una
+    distribución (GEMINI_REPLAY_LATENCIA), multiplicada por GEMINI_REPLAY_ESCALA; los errores
+    se inyectan con la tasa de cada código (GEMINI_REPLAY_ERRORES). Con GEMINI_REPLAY_SEMILLA
+    la secuencia de latencias y errores es reproducible.
+    """
+
+    def __init__(self, grabaciones: Grabaciones, latencia: str = None, errores: str = None,
+                 escala: float = None, semilla: Optional[int] = None):
+        self.grabaciones = grabaciones
+        self.latencia = _parsear_latencia(latencia if latencia is not None else db_config.GEMINI_REPLAY_LATENCIA)
+        self.errores = _parsear_errores(errores if errores is not None else db_config.GEMINI_REPLAY_ERRORES)
+        self.escala = escala if escala is not None else db_config.GEMINI_REPLAY_ESCALA
+        self._random = random.Random(semilla if semilla is not None else db_config.GEMINI_REPLAY_SEMILLA)
+        self._lock = threading.Lock()
+        log_info(logger, f"{EMOJI['database']} Gemini en modo replay: {len(grabaciones)} grabación(es), "
+                         f"latencia {self.latencia[0]}, errores {self.errores or 'no'}")
+
+    def _sortear(self, grabacion: Dict) -> Tuple[float, Optional[str]]:
+        """(segundos de latencia, código de error o None)"""
+        tipo, p = self.latencia
+        with self._lock:
+            if tipo == 'cero':
+                segundos = 0.0
+            elif tipo == 'fija' and p:
+                segundos = p[0]
+            elif tipo == 'uniforme' and len(p) >= 2:
+                segundos = self._random.uniform(p[0], p[1])
+            elif tipo == 'normal' and len(p) >= 2:
+                segundos = max(0.0, self._random.gauss(p[0], p[1]))
+            elif tipo == 'lognormal' and len(p) >= 2:
+                # p[0] es la mediana (en segundos), p[1] el desvío del logaritmo
+                segundos = self._random.lognormvariate(0, p[1]) * p[0]
+            else:
+                segundos = grabacion.get('segundos') or 0.0
+
+            error = None
+            sorteo = self._random.random()
+            for codigo, tasa in self.errores:
+                if sorteo < tasa:
+                    error = codigo
+                    break
+                sorteo -= tasa
+        return segundos * self.escala, error
+
+    def generar(self, model, contents, timeout: float, proposito: str, kwargs: dict):
+        clave, clave_documento = claves(_nombre_modelo(model), proposito, contents)
+        grabacion = self.grabaciones.buscar(clave, clave_documento)
+        if grabacion is None:
+            raise GrabacionNoEncontrada(f"Sin grabación para {proposito} (clave {clave}, documento {clave_documento})")
+
+        segundos, error = self._sortear(grabacion)
+        if error == 'timeout' or segundos > timeout:
+            time.sleep(timeout)
+            raise gexc.DeadlineExceeded(f"Replay: sin respuesta en {timeout:.1f}s")
+        time.sleep(segundos)
+        if error is not None:
+            raise ERRORES_SIMULADOS[error](f"Replay: error {error} inyectado")
+        return RespuestaGrabada(grabacion['texto'], grabacion.get('uso'))
+
+
+def crear_backend(modo: str = None):
+    """Backend para GeminiRetry según GEMINI_BACKEND: None (llamada directa), grabador o replay"""
+    modo = (modo or db_config.GEMINI_BACKEND).lower()
+    if modo == 'grabar':
+        return BackendGrabador(Grabaciones(db_config.GEMINI_GRABACIONES_DIR))
+    if modo == 'replay':
+        return BackendReplay(Grabaciones(db_config.GEMINI_GRABACIONES_DIR))
+    return None
+
+
+# ===== Siembra desde resultados procesados =====
+
+def _imagenes(file_path: str) -> List[Image.Image]:
+    """Las mismas páginas que recibe Gemini en extract_invoice_data"""
+    if file_path.lower().endswith('.pdf'):
+        return renderizar_pdf(file_path)
+    return [Image.open(file_path)]
+
+
+def _extraccion_original(extraccion: Dict) -> Dict:
+    """Quita lo que agrega el post-procesamiento (validación, código de proveedor del sistema)"""
+    original = deepcopy(extraccion)
+    original.pop('validacion_aritmetica', None)
+    proveedor = (original.get('cabecera') or {}).get('proveedor')
+    if isinstance(proveedor, dict):
+        proveedor.pop('codigo_sistema', None)
+    return original
+
+
+def sembrar(carpeta_data: str) -> Dict:
+    """
+    Graba la extracción de cada resultado exitoso cuyo archivo sigue subido (por su sha256).
+    Los resultados anteriores a las subidas por contenido no tienen sha256 ni otra referencia al
+    archivo: no se pueden sembrar y sólo se cuentan ('sin_hash').
+    Devuelve {'grabadas', 'sin_archivo', 'existentes', 'sin_hash'}.
+    """
+    uploads = os.path.join(carpeta_data, 'uploads')
+    indice = ResultIndex(os.path.join(carpeta_data, 'resultados.sqlite3'))
+    archivo = ResultArchive(os.path.join(carpeta_data, 'processed'), indice)
+    archivo.sincronizar_indice()
+    grabaciones = Grabaciones(db_config.GEMINI_GRABACIONES_DIR)
+
+    subidos = {}
+    if os.path.isdir(uploads):
+        for nombre in os.listdir(uploads):
+            subidos.setdefault(nombre.split('.')[0], os.path.join(uploads, nombre))
+
+    cuenta = {'grabadas': 0, 'sin_archivo': 0, 'existentes': 0, 'sin_hash': indice.exitosos_sin_hash()}
+    if cuenta['sin_hash']:
+        log_warning(logger, f"{cuenta['sin_hash']} resultado(s) sin sha256 (anteriores a las subidas por contenido): "
+                            "no se sabe qué archivo les corresponde, no se siembran")
+    for filename, sha256 in indice.exitosos_con_hash():
+        ruta = subidos.get(sha256)
+        result = archivo.leer(filename) if ruta else None
+        if not result or not result.get('extraction'):
+            cuenta['sin_archivo'] += 1
+            continue
+
+        imagenes = _imagenes(ruta)[:PAGINAS_EXTRACCION]
+        llamadas = (result.get('consumo_gemini') or {}).get('llamadas') or []
+        llamada = next((ll for ll in llamadas if ll.get('proposito') == 'extraccion' and ll.get('ok')), {})
+        modelo = llamada.get('modelo') or db_config.GEMINI_MODELO_FUERTE
+        clave, clave_documento = claves(modelo, 'extraccion', imagenes + ["Extrae los datos de esta factura."])
+        if grabaciones.buscar(clave, clave_documento):
+            cuenta['existentes'] += 1
+            continue
+
+        grabaciones.guardar({
+            'clave': clave,
+            'clave_documento': clave_documento,
+            'proposito': 'extraccion',
+            'modelo': modelo,
+            'texto': json.dumps(_extraccion_original(result['extraction']), ensure_ascii=False),
+            'uso': {k: llamada.get(k) for k in ('tokens_entrada', 'tokens_salida', 'tokens_cache', 'tokens_total')},
+            'segundos': llamada.get('segundos'),
+            'grabado_en': datetime.now().isoformat(timespec='seconds'),
+            'origen': filename,
+        })
+        cuenta['grabadas'] += 1
+
+    log_success(logger, f"Grabaciones sembradas desde resultados: {cuenta}")
+    return cuenta
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] != 'sembrar':
+        print("Uso: python gemini_backend.py sembrar [carpeta_data]")
+        print("Siembra sólo resultados con sha256 cuyo archivo sigue en uploads/ (no los legados sin hash)")
+        return
+
+    carpeta_data = sys.argv[2] if len(sys.argv) > 2 else os.path.join(os.path.dirname(__file__), '..', 'data')
+    print(json.dumps(sembrar(carpeta_data), ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    from logging_config import setup_logging
+    setup_logging()
+    main()
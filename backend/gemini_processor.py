@@ -10,146 +10,184 @@ from typing import Optional, Dict, List
 import google.generativeai as genai
 import fitz  # PyMuPDF
 from PIL import Image
-import io
-from logging_config import log_info, log_success, log_error, log_warning, EMOJI
+import time
+import db_config
+from logging_config import log_info, log_success, log_error, log_warning, log_detalle, EMOJI
+from gemini_retry import GeminiRetry
+from gemini_backend import crear_backend
+from invoice_schema import FACTURA_SCHEMA, CONCILIACION_SCHEMA, CORRECCION_SCHEMA
+from invoice_validator import validar_aritmetica, prompt_correccion, aplicar_correccion, resumen_validacion
+from prompt_cache import PromptCache, cargar_ejemplos_few_shot
+from progress import emitir
+from metrics import medir_etapa, GEMINI_SEGUNDOS
+from rendering import renderizar_pdf
+from cuit import corregir_cuit, PREFIJOS_VALIDOS
+from model_tiering import TierStats, TIER_RAPIDO, TIER_FUERTE, es_pdf_digital, problemas_extraccion
 
 logger = logging.getLogger(__name__)
 
 
+def instrucciones_extraccion() -> str:
+    """Prompt estático de extracción (la estructura la impone FACTURA_SCHEMA)"""
+    # Crear lista de CUITs a ignorar para el prompt
+    cuits_ignorar = ', '.join(db_config.CUITS_PROPIOS)
+    
+    return f"""
+    Analiza facturas argentinas y extrae sus datos.
+    
+    IMPORTANTE:
+    - El PROVEEDOR es quien EMITE (arriba en la factura)
+    - NO uses estos CUITs (son del receptor): {cuits_ignorar}
+    - Extrae EXACTAMENTE lo que ves, no inventes datos
+    - El CUIT debe tener 11 dígitos sin guiones
+    - Fechas en formato YYYY-MM-DD; usa null si un dato no figura
+    """
+
+
 class GeminiProcessor:
     """Procesador de documentos con Gemini AI"""
     
     def __init__(self, api_key: str, db_integrator=None):
-        if not api_key:
+        # En replay las respuestas salen de grabaciones locales: no hace falta API key ni red
+        offline = db_config.GEMINI_BACKEND == 'replay'
+        if not api_key and not offline:
             raise ValueError("GEMINI_API_KEY no configurada")
         
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-2.5-flash')
+        if api_key:
+            genai.configure(api_key=api_key)
+        # Tiers de modelo: rápido para PDFs digitales, fuerte para escaneos y escalamientos
+        self.modelos = {
+            TIER_RAPIDO: db_config.GEMINI_MODELO_RAPIDO,
+            TIER_FUERTE: db_config.GEMINI_MODELO_FUERTE
+        }
+        self.tier_stats = TierStats(self.modelos)
+        self.model = genai.GenerativeModel(self.modelos[TIER_FUERTE])
+        self.retry = GeminiRetry(crear_backend())
+        
+        # Respuestas JSON restringidas por esquema (sin markdown que limpiar)
+        self.config_extraccion = genai.GenerationConfig(
+            response_mime_type="application/json",
+            response_schema=FACTURA_SCHEMA
+        )
+        self.config_conciliacion = genai.GenerationConfig(
+            response_mime_type="application/json",
+            response_schema=CONCILIACION_SCHEMA
+        )
+        self.config_correccion = genai.GenerationConfig(
+            response_mime_type="application/json",
+            response_schema=CORRECCION_SCHEMA
+        )
+        
+        # Prompt de extracción + ejemplos few-shot registrados una sola vez por modelo (context caching)
+        instrucciones = instrucciones_extraccion()
+        ejemplos = cargar_ejemplos_few_shot(db_config.GEMINI_FEW_SHOT_DIR)
+        self.caches_extraccion = {
+            tier: PromptCache(nombre, instrucciones, self.config_extraccion, ejemplos,
+                              usar_cache=db_config.GEMINI_CONTEXT_CACHE and not offline)
+            for tier, nombre in self.modelos.items()
+        }
         self.db = db_integrator  # Referencia a DatabaseIntegrator para búsquedas
         log_success(logger, "Gemini AI configurado correctamente")
     
-    def pdf_to_images(self, pdf_path: str) -> List[Image.Image]:
-        """Convierte PDF a lista de imágenes PIL"""
+    def pdf_to_images(self, pdf_path: str, doc=None) -> List[Image.Image]:
+        """Convierte PDF a lista de imágenes PIL (doc: el PDF ya abierto, si se tiene)"""
         log_info(logger, f"Convirtiendo PDF a imágenes: {os.path.basename(pdf_path)}")
+        emitir('render', "Convirtiendo PDF a imágenes")
+        inicio = time.monotonic()
         images = []
         
         try:
-            doc = fitz.open(pdf_path)
-            log_info(logger, f"PDF tiene {len(doc)} página(s)")
-            
-            for i, page in enumerate(doc, 1):
-                pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))
-                img_bytes = pix.tobytes("png")
-                images.append(Image.open(io.BytesIO(img_bytes)))
-                log_info(logger, f"  {EMOJI['check']} Página {i} convertida")
+            # Rasterizado en el pool de procesos (todas las páginas en paralelo)
+            images = renderizar_pdf(pdf_path, doc=doc)
+            log_info(logger, f"PDF tiene {len(images)} página(s)")
             
             log_success(logger, f"PDF convertido: {len(images)} imagen(es)")
+            emitir('render', f"PDF convertido: {len(images)} imagen(es)", "success",
+                   paginas=len(images), duracion=round(time.monotonic() - inicio, 3))
             return images
             
         except Exception as e:
             log_error(logger, f"Error leyendo PDF: {e}")
             return []
     
-    def extract_invoice_data(self, file_path: str) -> Optional[Dict]:
-        """Extrae datos de una factura usando Gemini"""
-        log_info(logger, f"{EMOJI['start']} Iniciando extracción de datos")
-        log_info(logger, f"Archivo: {os.path.basename(file_path)}")
-        
-        # Importar configuración
-        import db_config
-        
-        content_parts = []
-        
-        # Cargar imágenes
+    @medir_etapa('render', vacio_es_error=True)
+    def cargar_imagenes(self, file_path: str, doc=None) -> List[Image.Image]:
+        """Páginas de la factura como imágenes PIL (PDF renderizado o imagen directa)"""
         if file_path.lower().endswith('.pdf'):
-            images = self.pdf_to_images(file_path)
+            images = self.pdf_to_images(file_path, doc)
             if not images:
                 log_error(logger, "No se pudieron cargar imágenes del PDF")
-                return None
-            
-            log_info(logger, f"Procesando {len(images)} imagen(es) con Gemini AI...")
-            for i, img in enumerate(images[:5], 1):
-                content_parts.append(img)
-                log_info(logger, f"  {EMOJI['bullet']} Imagen {i} agregada al prompt")
-                
-        elif file_path.lower().endswith(('.png', '.jpg', '.jpeg')):
+            return images
+        
+        if file_path.lower().endswith(('.png', '.jpg', '.jpeg')):
             try:
                 img = Image.open(file_path)
-                content_parts.append(img)
                 log_info(logger, "Imagen cargada correctamente")
+                return [img]
             except Exception as e:
                 log_error(logger, f"Error leyendo imagen: {e}")
-                return None
         
-        # Crear lista de CUITs a ignorar para el prompt
-        cuits_ignorar = ', '.join(db_config.CUITS_PROPIOS)
+        return []
+    
+    @medir_etapa('modelo', vacio_es_error=True)
+    def extract_invoice_data(self, file_path: str, imagenes: Optional[List[Image.Image]] = None,
+                             digital: Optional[bool] = None) -> Optional[Dict]:
+        """
+        Extrae datos de una factura usando Gemini
+        imagenes: páginas ya renderizadas (evita volver a convertir el PDF)
+        digital: si el PDF tiene capa de texto, cuando ya se sabe (con imágenes y digital no se abre el PDF)
+        """
+        log_info(logger, f"{EMOJI['start']} Iniciando extracción de datos")
+        log_info(logger, f"Archivo: {os.path.basename(file_path)}")
         
-        # Prompt para extracción - SIMPLIFICADO
-        prompt = f"""
-        Analiza esta factura argentina y extrae los datos en formato JSON.
+        # Cargar imágenes y ver si el PDF es digital, abriéndolo una sola vez
+        doc = None
+        if file_path.lower().endswith('.pdf') and (imagenes is None or digital is None):
+            try:
+                doc = fitz.open(file_path)
+            except Exception as e:
+                log_warning(logger, f"No se pudo abrir el PDF: {e}")
+        try:
+            images = imagenes if imagenes is not None else self.cargar_imagenes(file_path, doc)
+            if digital is None:
+                digital = es_pdf_digital(doc)
+        finally:
+            if doc is not None:
+                doc.close()
+        if not images:
+            return None
         
-        IMPORTANTE:
-        - El PROVEEDOR es quien EMITE (arriba en la factura)
-        - NO uses estos CUITs (son del receptor): {cuits_ignorar}
-        - Extrae EXACTAMENTE lo que ves, no inventes datos
-        - El CUIT debe tener 11 dígitos sin guiones
+        log_info(logger, f"Procesando {len(images)} imagen(es) con Gemini AI...")
+        content_parts = []
+        for i, img in enumerate(images[:5], 1):
+            content_parts.append(img)
+            log_detalle(logger, "Imagen %d agregada al prompt", i)
         
-        JSON requerido:
-        {{
-          "cabecera": {{
-            "proveedor": {{
-              "nombre": "Razón Social del EMISOR",
-              "cuit": "CUIT del EMISOR (11 dígitos, sin guiones)",
-              "codigo_sistema": null
-            }},
-            "factura": {{
-              "tipo_comprobante": "FACTURA A/B/C",
-              "punto_emision": "0001",
-              "numero_comprobante": "00012345",
-              "fecha_emision": "YYYY-MM-DD",
-              "fecha_vencimiento": "YYYY-MM-DD o null",
-              "moneda": "ARS",
-              "cotizacion": 1.0,
-              "importe_total": 0.0,
-              "importe_neto_gravado": 0.0,
-              "importe_iva": 0.0,
-              "importe_no_gravado": 0.0,
-              "importe_exento": 0.0
-            }},
-            "orden_compra_vinculada": {{
-              "numero": "número de OC o null",
-              "encontrada_en_factura": true/false
-            }},
-            "impuestos": [
-              {{"tipo": "PERCEP_IIBB", "monto": 0.0}}
-            ],
-            "observaciones": ""
-          }},
-          "items": [
-            {{
-              "linea": 1,
-              "descripcion": "Descripción",
-              "cantidad": 0.0,
-              "precio_unitario": 0.0,
-              "alicuota_iva": 21.0,
-              "importe_neto": 0.0,
-              "importe_iva": 0.0,
-              "total_linea": 0.0
-            }}
-          ]
-        }}
+        # Las instrucciones estáticas viajan en el caché de contexto (o como system_instruction)
+        content_parts.append("Extrae los datos de esta factura.")
         
-        Responde SOLO con JSON válido, sin markdown.
-        """
-        content_parts.append(prompt)
+        # Tier inicial: PDFs digitales van al modelo rápido, escaneos e imágenes al fuerte
+        tier = TIER_RAPIDO if db_config.GEMINI_TIERING and digital else TIER_FUERTE
+        data = self._extraer_con_modelo(tier, content_parts)
+        
+        escalada = False
+        if tier == TIER_RAPIDO:
+            problemas = problemas_extraccion(data, self.db.cuits_proveedores() if self.db else None)
+            if problemas:
+                log_warning(logger, f"Extracción con modelo rápido no pasó la validación: {'; '.join(problemas)}")
+                log_info(logger, f"Escalando a modelo fuerte ({self.modelos[TIER_FUERTE]})")
+                emitir('escalamiento', f"Escalando a {self.modelos[TIER_FUERTE]}: {'; '.join(problemas)}", "warning")
+                escalada = True
+                data = self._extraer_con_modelo(TIER_FUERTE, content_parts)
+        
+        self.tier_stats.registrar_extraccion(tier, escalada)
+        self.tier_stats.log_resumen()
+        if not data:
+            return None
         
         try:
-            log_info(logger, f"{EMOJI['search']} Enviando a Gemini AI para análisis...")
-            response = self.model.generate_content(content_parts)
-            
-            log_info(logger, "Respuesta recibida, parseando JSON...")
-            json_str = response.text.replace('```json', '').replace('```', '').strip()
-            data = json.loads(json_str)
+            # VALIDACIÓN 0: Consistencia aritmética (con relectura parcial si no cierra)
+            data['validacion_aritmetica'] = self._validar_y_corregir(data, content_parts[:-1])
             
             # VALIDACIÓN 1: Verificar que el CUIT exista
             cuit_extraido = data['cabecera']['proveedor'].get('cuit')
@@ -161,7 +199,8 @@ class GeminiProcessor:
                 log_info(logger, f"🔍 Buscando proveedor en BD por nombre: {nombre_extraido}")
                 
                 # Buscar en BD
-                proveedores_similares = self.db.buscar_proveedor_por_nombre(nombre_extraido)
+                with self.db.lock:
+                    proveedores_similares = self.db.buscar_proveedor_por_nombre(nombre_extraido)
                 
                 if proveedores_similares and len(proveedores_similares) > 0:
                     mejor_match = proveedores_similares[0]
@@ -204,13 +243,6 @@ class GeminiProcessor:
                 log_error(logger, f"❌ ERROR: CUIT contiene caracteres no numéricos: {cuit_extraido}")
                 return None
             
-            # Validar prefijo (debe empezar con 20, 23, 27, 30 o 33)
-            prefijo = cuit_limpio[:2]
-            if prefijo not in ['20', '23', '27', '30', '33']:
-                log_error(logger, f"❌ ERROR: CUIT con prefijo inválido: {prefijo}")
-                log_error(logger, f"CUIT completo: {cuit_extraido}")
-                return None
-            
             # VALIDACIÓN 2: Verificar que el CUIT no sea uno de los nuestros
             es_cuit_propio = cuit_limpio in [c.replace('-', '').replace(' ', '') for c in db_config.CUITS_PROPIOS]
             
@@ -221,7 +253,8 @@ class GeminiProcessor:
                 # Intentar buscar por nombre
                 if nombre_extraido:
                     log_info(logger, f"🔍 Buscando proveedor en BD por nombre: {nombre_extraido}")
-                    proveedores_similares = self.db.buscar_proveedor_por_nombre(nombre_extraido)
+                    with self.db.lock:
+                        proveedores_similares = self.db.buscar_proveedor_por_nombre(nombre_extraido)
                     
                     if proveedores_similares and len(proveedores_similares) > 0:
                         mejor_match = proveedores_similares[0]
@@ -241,8 +274,31 @@ class GeminiProcessor:
                     log_error(logger, "❌ Se detectó CUIT propio y no hay nombre para buscar")
                     return None
             
+            # VALIDACIÓN 3: Prefijo y dígito verificador, corrigiendo antes localmente errores de un
+            # dígito (también en el prefijo: "38..." por "30...")
+            if not es_cuit_propio:
+                conocidos = self.db.cuits_proveedores() if self.db else {}
+                cuit_corregido = corregir_cuit(cuit_limpio, conocidos)
+                
+                if cuit_corregido is None:
+                    prefijo = cuit_limpio[:2]
+                    if prefijo not in PREFIJOS_VALIDOS:
+                        # Debe empezar con 20, 23, 27, 30 o 33
+                        log_error(logger, f"❌ ERROR: CUIT con prefijo inválido: {prefijo}")
+                        log_error(logger, f"CUIT completo: {cuit_extraido}")
+                    else:
+                        log_error(logger, f"❌ ERROR: CUIT con dígito verificador inválido: {cuit_extraido}")
+                    log_error(logger, "Ningún proveedor conocido está a un dígito de distancia")
+                    return None
+                
+                if cuit_corregido != cuit_limpio:
+                    log_warning(logger, f"CUIT mal leído corregido localmente: {cuit_limpio} {EMOJI['arrow']} {cuit_corregido}")
+                    data['cabecera']['proveedor']['cuit'] = cuit_corregido
+                    data['cabecera']['proveedor']['codigo_sistema'] = conocidos.get(cuit_corregido)
+            
             # Log de datos extraídos
             log_success(logger, "Datos extraídos correctamente")
+            emitir('extraccion', "Datos extraídos", "success", cabecera=data['cabecera'], items=len(data['items']))
             log_info(logger, f"{EMOJI['user']} Proveedor: {data['cabecera']['proveedor']['nombre']}")
             log_info(logger, f"{EMOJI['document']} CUIT: {data['cabecera']['proveedor']['cuit']}")
             log_info(logger, f"{EMOJI['document']} Factura: {data['cabecera']['factura']['tipo_comprobante']} {data['cabecera']['factura']['punto_emision']}-{data['cabecera']['factura']['numero_comprobante']}")
@@ -258,12 +314,68 @@ class GeminiProcessor:
             
             return data
             
+        except Exception as e:
+            log_error(logger, f"Error en extracción: {e}")
+            return None
+    
+    def _validar_y_corregir(self, data: Dict, imagenes: List) -> Dict:
+        """Cruza items contra totales; si no cierran, pide al modelo sólo los campos fallidos"""
+        fallas = validar_aritmetica(data)
+        if not fallas:
+            return resumen_validacion([], [], False)
+        
+        log_warning(logger, f"{len(fallas)} inconsistencia(s) aritmética(s), releyendo sólo esos campos")
+        emitir('validacion', f"{len(fallas)} inconsistencia(s) aritmética(s), releyendo esos campos", "warning")
+        try:
+            response = self.retry.generar(
+                self.model,
+                imagenes + [prompt_correccion(fallas)],
+                proposito='correccion',
+                generation_config=self.config_correccion
+            )
+            correccion = json.loads(response.text)
+        except Exception as e:
+            log_error(logger, f"Error en relectura parcial: {e}")
+            return resumen_validacion(fallas, fallas, False)
+        
+        # Aplicar sobre una copia y quedarse con la versión que menos inconsistencias tenga
+        candidato = aplicar_correccion(json.loads(json.dumps(data)), correccion, fallas)
+        fallas_corregidas = validar_aritmetica(candidato)
+        if len(fallas_corregidas) >= len(fallas):
+            return resumen_validacion(fallas, fallas, False)
+        
+        data['cabecera'] = candidato['cabecera']
+        data['items'] = candidato['items']
+        return resumen_validacion(fallas, fallas_corregidas, True)
+    
+    def _extraer_con_modelo(self, tier: str, content_parts: List) -> Optional[Dict]:
+        """Llama al modelo del tier indicado y parsea la respuesta estructurada"""
+        log_info(logger, f"{EMOJI['search']} Enviando a Gemini AI para análisis (modelo {self.modelos[tier]})...")
+        emitir('modelo', f"Enviando a Gemini ({self.modelos[tier]})", modelo=self.modelos[tier])
+        inicio = time.monotonic()
+        response = None
+        try:
+            response = self.retry.generar(self.caches_extraccion[tier].modelo(), content_parts, generation_config=self.config_extraccion)
+            
+            log_info(logger, "Respuesta recibida, parseando JSON...")
+            data = json.loads(response.text)
+            duracion = time.monotonic() - inicio
+            self.tier_stats.registrar_llamada(tier, duracion, True)
+            GEMINI_SEGUNDOS.observar(duracion, modelo=self.modelos[tier], resultado='ok')
+            emitir('modelo', f"Respuesta de Gemini en {duracion:.1f}s", "success",
+                   modelo=self.modelos[tier], duracion=round(duracion, 3))
+            return data
+            
         except json.JSONDecodeError as e:
+            self.tier_stats.registrar_llamada(tier, time.monotonic() - inicio, False)
+            GEMINI_SEGUNDOS.observar(time.monotonic() - inicio, modelo=self.modelos[tier], resultado='json_invalido')
             log_error(logger, f"Error parseando JSON: {e}")
             log_error(logger, f"Respuesta de Gemini: {response.text[:200]}...")
             return None
         except Exception as e:
-            log_error(logger, f"Error en extracción: {e}")
+            self.tier_stats.registrar_llamada(tier, time.monotonic() - inicio, False)
+            GEMINI_SEGUNDOS.observar(time.monotonic() - inicio, modelo=self.modelos[tier], resultado='error')
+            log_error(logger, f"Error en extracción ({self.modelos[tier]}): {e}")
             return None
     
     def reconcile_documents(self, invoice_path: str, oc_data: List[Dict]) -> Optional[Dict]:
@@ -289,10 +401,10 @@ class GeminiProcessor:
         content_parts.append("DOCUMENTO 1: FACTURA DEL PROVEEDOR")
         for i, img in enumerate(invoice_imgs[:3], 1):
             content_parts.append(img)
-            log_info(logger, f"  {EMOJI['bullet']} Imagen {i} de factura agregada")
+            log_detalle(logger, "Imagen %d de factura agregada", i)
         
         # Datos de OC como texto
-        oc_text = json.dumps(oc_data, indent=2, ensure_ascii=False)
+        oc_text = json.dumps(oc_data, ensure_ascii=False, separators=(",", ":"))
         content_parts.append(f"DOCUMENTO 2: DATOS DE ORDEN DE COMPRA (BASE DE DATOS):\n{oc_text}")
         log_info(logger, "Datos de OC agregados al prompt")
         
@@ -305,41 +417,16 @@ class GeminiProcessor:
         2. Busca su correspondencia en el JSON de la OC (usa lógica semántica).
         3. Verifica cantidades y precios.
         4. Detecta items no autorizados.
-        
-        Responde SOLO con JSON:
-        {
-            "resumen": "Explicación del resultado",
-            "match_exitoso": boolean,
-            "nro_orden_compra": "número de OC",
-            "discrepancias": [
-                {
-                    "item_factura": "...",
-                    "item_oc": "...",
-                    "tipo_error": "Precio/Cantidad/No Encontrado",
-                    "detalle": "..."
-                }
-            ],
-            "items_ok": [
-                {
-                    "descripcion": "...",
-                    "cantidad": 0,
-                    "precio": 0,
-                    "item_oc": 1
-                }
-            ]
-        }
-        
-        NO uses markdown, SOLO JSON.
         """
         content_parts.append(prompt)
         
         try:
             log_info(logger, f"{EMOJI['search']} Enviando a Gemini AI para conciliación...")
-            response = self.model.generate_content(content_parts)
+            response = self.retry.generar(self.model, content_parts, proposito='conciliacion',
+                                           generation_config=self.config_conciliacion)
             
             log_info(logger, "Respuesta recibida, parseando resultado...")
-            json_str = response.text.replace('```json', '').replace('```', '').strip()
-            data = json.loads(json_str)
+            data = json.loads(response.text)
             
             # Log de resultados
             if data.get('match_exitoso'):
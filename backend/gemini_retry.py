@@ -0,0 +1,248 @@
+"""
+Capa de llamadas resilientes a Gemini
+Reintentos clasificados, backoff exponencial con jitter, deadline por llamada y hedging
+"""
+
+import os
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, Optional
+from google.api_core import exceptions as gexc
+from PIL import Image
+import db_config
+import tracing
+import gemini_usage
+from metrics import GEMINI_HEDGES_ABANDONADOS
+from logging_config import log_info, log_warning, log_error
+
+logger = logging.getLogger(__name__)
+
+# Errores transitorios: tiene sentido volver a intentar
+ERRORES_REINTENTABLES = (
+    gexc.ResourceExhausted,     # 429 - cuota / rate limit
+    gexc.TooManyRequests,
+    gexc.InternalServerError,   # 500
+    gexc.BadGateway,            # 502
+    gexc.ServiceUnavailable,    # 503
+    gexc.GatewayTimeout,        # 504
+    gexc.DeadlineExceeded,
+    gexc.Aborted,
+    gexc.Unknown,
+    TimeoutError,
+    ConnectionError,
+)
+
+
+class DeadlineExcedido(TimeoutError):
+    """Se agotó el tiempo total asignado a la llamada"""
+
+
+def es_reintentable(error: Exception) -> bool:
+    """Clasifica el error: True si es transitorio (red, cuota, 5xx)"""
+    return isinstance(error, ERRORES_REINTENTABLES)
+
+
+def bytes_imagen(img: Image.Image) -> Optional[int]:
+    """Bytes que viajan de una imagen respaldada por archivo (el SDK envía el archivo tal cual)"""
+    ruta = getattr(img, 'filename', None)
+    if ruta and os.path.exists(ruta):
+        return os.path.getsize(ruta)
+    return None
+
+
+def bytes_sin_comprimir(img: Image.Image) -> int:
+    """Estimación para imágenes en memoria: ancho × alto × bandas (cota superior del WebP que arma el SDK)"""
+    return img.width * img.height * len(img.getbands())
+
+
+def resumen_payload(contents) -> Dict:
+    """
+    Imágenes, bytes de imagen y caracteres de texto del pedido.
+    Las imágenes en memoria no tienen archivo que medir: sus bytes son una estimación
+    (bytes_sin_comprimir) y se cuentan en imagenes_estimadas.
+    """
+    imagenes, estimadas, bytes_imagenes, caracteres = 0, 0, 0, 0
+    for parte in contents if isinstance(contents, (list, tuple)) else [contents]:
+        if isinstance(parte, str):
+            caracteres += len(parte)
+        elif isinstance(parte, Image.Image):
+            imagenes += 1
+            tamanio = bytes_imagen(parte)
+            if tamanio is None:
+                estimadas += 1
+                tamanio = bytes_sin_comprimir(parte)
+            bytes_imagenes += tamanio
+    return {'imagenes': imagenes, 'imagenes_estimadas': estimadas,
+            'bytes_imagenes': bytes_imagenes, 'caracteres_prompt': caracteres}
+
+
+def uso_tokens(response) -> Dict:
+    """Tokens de usage_metadata de la respuesta (None los que no vengan)"""
+    uso = getattr(response, 'usage_metadata', None)
+    return {
+        'tokens_entrada': getattr(uso, 'prompt_token_count', None),
+        'tokens_salida': getattr(uso, 'candidates_token_count', None),
+        'tokens_cache': getattr(uso, 'cached_content_token_count', None) or None,
+        'tokens_total': getattr(uso, 'total_token_count', None),
+    }
+
+
+class GeminiRetry:
+    """Ejecuta generate_content con reintentos, deadline y hedging opcional"""
+
+    def __init__(self, backend=None):
+        self.backend = backend  # gemini_backend (grabar / replay); None = llamada directa
+        self.max_intentos = max(1, db_config.GEMINI_REINTENTOS)
+        self.backoff_base = db_config.GEMINI_BACKOFF_BASE
+        self.backoff_max = db_config.GEMINI_BACKOFF_MAX
+        self.timeout_intento = db_config.GEMINI_TIMEOUT_INTENTO
+        self.deadline = db_config.GEMINI_DEADLINE
+        self.hedging = db_config.GEMINI_HEDGING
+        self.hedging_min_muestras = db_config.GEMINI_HEDGING_MIN_MUESTRAS
+
+        self._latencias = deque(maxlen=200)
+        self._lock = threading.Lock()
+        # Por cada llamada simultánea del pipeline: la original y su cobertura, más el cupo de
+        # perdedoras abandonadas que siguen corriendo hasta su timeout (no se pueden cancelar)
+        self.abandonados_max = max(1, db_config.PIPELINE_MODELO)
+        self._abandonados = 0
+        self._executor = ThreadPoolExecutor(max_workers=3 * self.abandonados_max,
+                                            thread_name_prefix="gemini-hedge") if self.hedging else None
+
+    def generar(self, model, contents, proposito: str = 'extraccion', **kwargs):
+        """
+        Llama a model.generate_content respetando la política de reintentos.
+        Cada llamada es un span y queda registrada en gemini_usage (tokens, payload, latencia, intentos).
+        proposito: 'extraccion' | 'correccion' | 'conciliacion'
+        """
+        modelo = str(getattr(model, 'model_name', '') or '').replace('models/', '') or None
+        payload = resumen_payload(contents)
+        llamada = {'proposito': proposito, 'modelo': modelo, **payload, 'intentos': 0, 'hedges': 0, 'abandonados': 0}
+        inicio = time.monotonic()
+        response = None
+        try:
+            with tracing.span('gemini', modelo=modelo, proposito=proposito, **payload) as actual:
+                response = self._generar(model, contents, llamada, **kwargs)
+                if actual is not None:
+                    actual.set(**uso_tokens(response))
+                return response
+        finally:
+            llamada.update(uso_tokens(response), segundos=round(time.monotonic() - inicio, 3), ok=response is not None)
+            gemini_usage.registrar(llamada)
+
+    def _generar(self, model, contents, llamada: Dict, **kwargs):
+        inicio = time.monotonic()
+        ultimo_error = None
+
+        for intento in range(1, self.max_intentos + 1):
+            restante = self.deadline - (time.monotonic() - inicio)
+            if restante <= 0:
+                break
+
+            timeout = min(self.timeout_intento, restante)
+            llamada['intentos'] = intento
+            tracing.anotar(intentos=intento)
+            try:
+                return self._intentar(model, contents, timeout, kwargs, llamada)
+            except Exception as e:
+                ultimo_error = e
+                if not es_reintentable(e):
+                    log_error(logger, f"Error no reintentable de Gemini ({type(e).__name__}): {e}")
+                    raise
+
+                if intento == self.max_intentos:
+                    break
+
+                espera = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (intento - 1)))
+                restante = self.deadline - (time.monotonic() - inicio)
+                if espera >= restante:
+                    break
+
+                log_warning(logger, f"Gemini falló ({type(e).__name__}), intento {intento}/{self.max_intentos}. Reintentando en {espera:.1f}s")
+                time.sleep(espera)
+
+        if ultimo_error is None:
+            ultimo_error = DeadlineExcedido(f"Deadline de {self.deadline:.0f}s agotado")
+        log_error(logger, f"Gemini sin respuesta tras reintentos: {ultimo_error}")
+        raise ultimo_error
+
+    def _intentar(self, model, contents, timeout: float, kwargs: dict, llamada: Dict):
+        """Un intento; con hedging lanza una segunda llamada si supera el p95"""
+        proposito = llamada['proposito']
+        umbral = self._umbral_hedging()
+        if umbral is None or umbral >= timeout:
+            return self._llamar(model, contents, timeout, kwargs, proposito)
+
+        inicio = time.monotonic()
+        pendientes = {self._executor.submit(self._llamar, model, contents, timeout, kwargs, proposito)}
+        hechos, pendientes = wait(pendientes, timeout=umbral)
+
+        if not hechos:
+            with self._lock:
+                hay_cupo = self._abandonados < self.abandonados_max
+            if hay_cupo:
+                log_info(logger, f"Gemini supera p95 ({umbral:.1f}s), lanzando petición de cobertura (hedge)")
+                restante = max(0.0, timeout - (time.monotonic() - inicio))
+                pendientes.add(self._executor.submit(self._llamar, model, contents, restante, kwargs, proposito))
+                llamada['hedges'] += 1
+            else:
+                log_warning(logger, f"Gemini supera p95 ({umbral:.1f}s) pero hay {self.abandonados_max} peticiones abandonadas en curso: sin hedge")
+
+        ultimo_error = None
+        try:
+            while hechos or pendientes:
+                for futuro in hechos:
+                    if futuro.exception() is None:
+                        return futuro.result()
+                    ultimo_error = futuro.exception()
+                if not pendientes:
+                    break
+                restante = timeout - (time.monotonic() - inicio)
+                if restante <= 0:
+                    break
+                hechos, pendientes = wait(pendientes, timeout=restante, return_when=FIRST_COMPLETED)
+        finally:
+            self._abandonar(pendientes, llamada)
+
+        raise ultimo_error or DeadlineExcedido(f"Sin respuesta de Gemini en {timeout:.0f}s")
+
+    def _abandonar(self, pendientes, llamada: Dict):
+        """Cancela las peticiones que no arrancaron; las que ya corren se cuentan hasta que terminen"""
+        corriendo = [futuro for futuro in pendientes if not futuro.cancel()]
+        if not corriendo:
+            return
+        with self._lock:
+            self._abandonados += len(corriendo)
+        llamada['abandonados'] += len(corriendo)
+        GEMINI_HEDGES_ABANDONADOS.inc(len(corriendo), modelo=llamada.get('modelo') or '')
+        for futuro in corriendo:
+            futuro.add_done_callback(self._liberar)
+
+    def _liberar(self, _futuro):
+        with self._lock:
+            self._abandonados -= 1
+
+    def _llamar(self, model, contents, timeout: float, kwargs: dict, proposito: str):
+        """Llamada directa con timeout de transporte (o a través del backend configurado)"""
+        inicio = time.monotonic()
+        if self.backend is None:
+            response = model.generate_content(contents, request_options={'timeout': timeout}, **kwargs)
+        else:
+            response = self.backend.generar(model, contents, timeout, proposito, kwargs)
+        with self._lock:
+            self._latencias.append(time.monotonic() - inicio)
+        return response
+
+    def _umbral_hedging(self) -> Optional[float]:
+        """p95 de latencias recientes, o None si el hedging no aplica"""
+        if not self.hedging:
+            return None
+        with self._lock:
+            if len(self._latencias) < self.hedging_min_muestras:
+                return None
+            ordenadas = sorted(self._latencias)
+        return ordenadas[int(0.95 * (len(ordenadas) - 1))]
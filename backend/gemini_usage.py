@@ -0,0 +1,52 @@
+"""
+Consumo de Gemini por llamada
+Cada generate_content deja modelo, propósito, tokens (usage_metadata), imágenes y bytes enviados,
+largo del prompt, latencia e intentos. Las llamadas de una factura se juntan en su resultado
+y el índice de resultados las agrega por día, proveedor y modelo.
+"""
+
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, List
+from metrics import GEMINI_TOKENS, GEMINI_BYTES_IMAGENES
+
+# Llamadas registradas dentro del bloque recolectar() en curso (los threads heredan la lista)
+_llamadas = contextvars.ContextVar('llamadas_gemini', default=None)
+
+CAMPOS_SUMA = ('imagenes', 'imagenes_estimadas', 'bytes_imagenes', 'caracteres_prompt',
+               'tokens_entrada', 'tokens_salida', 'tokens_cache', 'tokens_total', 'intentos',
+               'hedges', 'abandonados')
+
+
+@contextmanager
+def recolectar():
+    """Junta en una lista las llamadas a Gemini hechas dentro del bloque"""
+    llamadas = []
+    token = _llamadas.set(llamadas)
+    try:
+        yield llamadas
+    finally:
+        _llamadas.reset(token)
+
+
+def registrar(llamada: Dict):
+    """Suma la llamada a las métricas y a la recolección en curso (si hay)"""
+    modelo = llamada.get('modelo') or ''
+    for tipo in ('entrada', 'salida', 'cache'):
+        if llamada.get(f'tokens_{tipo}'):
+            GEMINI_TOKENS.inc(llamada[f'tokens_{tipo}'], modelo=modelo, tipo=tipo)
+    if llamada.get('bytes_imagenes'):
+        GEMINI_BYTES_IMAGENES.inc(llamada['bytes_imagenes'], modelo=modelo)
+
+    llamadas = _llamadas.get()
+    if llamadas is not None:
+        llamadas.append(llamada)
+
+
+def resumen(llamadas: List[Dict]) -> Dict:
+    """{'llamadas': [...], 'total': {...}} para guardar con el resultado"""
+    total = {campo: sum(ll.get(campo) or 0 for ll in llamadas) for campo in CAMPOS_SUMA}
+    total['llamadas'] = len(llamadas)
+    total['errores'] = sum(1 for ll in llamadas if not ll.get('ok'))
+    total['segundos'] = round(sum(ll.get('segundos') or 0 for ll in llamadas), 3)
+    return {'llamadas': llamadas, 'total': total}
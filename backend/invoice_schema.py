@@ -0,0 +1,176 @@
+"""
+Esquemas de respuesta estructurada para Gemini
+Gemini devuelve JSON validado contra estos esquemas (response_schema)
+"""
+
+# Tipos básicos reutilizables
+_TEXTO = {"type": "string"}
+_TEXTO_NULO = {"type": "string", "nullable": True}
+_NUMERO = {"type": "number"}
+
+
+FACTURA_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "cabecera": {
+            "type": "object",
+            "properties": {
+                "proveedor": {
+                    "type": "object",
+                    "properties": {
+                        "nombre": {**_TEXTO, "description": "Razón social del EMISOR"},
+                        "cuit": {**_TEXTO_NULO, "description": "CUIT del EMISOR, 11 dígitos sin guiones"},
+                        "codigo_sistema": _TEXTO_NULO,
+                    },
+                    "required": ["nombre", "cuit"],
+                },
+                "factura": {
+                    "type": "object",
+                    "properties": {
+                        "tipo_comprobante": {**_TEXTO, "description": "FACTURA A/B/C, NOTA DE CREDITO A, etc."},
+                        "punto_emision": {**_TEXTO, "description": "Ej: 0001"},
+                        "numero_comprobante": {**_TEXTO, "description": "Ej: 00012345"},
+                        "fecha_emision": {**_TEXTO, "description": "YYYY-MM-DD"},
+                        "fecha_vencimiento": {**_TEXTO_NULO, "description": "YYYY-MM-DD"},
+                        "moneda": {**_TEXTO, "description": "ARS, USD"},
+                        "cotizacion": _NUMERO,
+                        "importe_total": _NUMERO,
+                        "importe_neto_gravado": _NUMERO,
+                        "importe_iva": _NUMERO,
+                        "importe_no_gravado": _NUMERO,
+                        "importe_exento": _NUMERO,
+                    },
+                    "required": [
+                        "tipo_comprobante", "punto_emision", "numero_comprobante",
+                        "fecha_emision", "fecha_vencimiento", "moneda", "cotizacion",
+                        "importe_total", "importe_neto_gravado", "importe_iva",
+                        "importe_no_gravado", "importe_exento",
+                    ],
+                },
+                "orden_compra_vinculada": {
+                    "type": "object",
+                    "properties": {
+                        "numero": _TEXTO_NULO,
+                        "encontrada_en_factura": {"type": "boolean"},
+                    },
+                    "required": ["numero", "encontrada_en_factura"],
+                },
+                "impuestos": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "tipo": {**_TEXTO, "description": "Ej: PERCEP_IIBB"},
+                            "monto": _NUMERO,
+                        },
+                        "required": ["tipo", "monto"],
+                    },
+                },
+                "observaciones": _TEXTO,
+            },
+            "required": ["proveedor", "factura", "orden_compra_vinculada", "impuestos", "observaciones"],
+        },
+        "items": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "linea": {"type": "integer"},
+                    "descripcion": _TEXTO,
+                    "cantidad": _NUMERO,
+                    "precio_unitario": _NUMERO,
+                    "alicuota_iva": _NUMERO,
+                    "importe_neto": _NUMERO,
+                    "importe_iva": _NUMERO,
+                    "total_linea": _NUMERO,
+                },
+                "required": [
+                    "linea", "descripcion", "cantidad", "precio_unitario",
+                    "alicuota_iva", "importe_neto", "importe_iva", "total_linea",
+                ],
+            },
+        },
+    },
+    "required": ["cabecera", "items"],
+}
+
+
+CONCILIACION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "resumen": {**_TEXTO, "description": "Explicación del resultado"},
+        "match_exitoso": {"type": "boolean"},
+        "nro_orden_compra": _TEXTO_NULO,
+        "discrepancias": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "item_factura": _TEXTO,
+                    "item_oc": _TEXTO_NULO,
+                    "tipo_error": {"type": "string", "enum": ["Precio", "Cantidad", "No Encontrado"]},
+                    "detalle": _TEXTO,
+                },
+                "required": ["item_factura", "item_oc", "tipo_error", "detalle"],
+            },
+        },
+        "items_ok": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "descripcion": _TEXTO,
+                    "cantidad": _NUMERO,
+                    "precio": _NUMERO,
+                    "item_oc": {"type": "integer"},
+                },
+                "required": ["descripcion", "cantidad", "precio", "item_oc"],
+            },
+        },
+    },
+    "required": ["resumen", "match_exitoso", "nro_orden_compra", "discrepancias", "items_ok"],
+}
+
+
+# Relectura parcial: sólo los importes que no cerraron (todos opcionales)
+CORRECCION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "factura": {
+            "type": "object",
+            "properties": {
+                "importe_total": _NUMERO,
+                "importe_neto_gravado": _NUMERO,
+                "importe_iva": _NUMERO,
+                "importe_no_gravado": _NUMERO,
+                "importe_exento": _NUMERO,
+            },
+        },
+        "impuestos": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "tipo": _TEXTO,
+                    "monto": _NUMERO,
+                },
+                "required": ["tipo", "monto"],
+            },
+        },
+        "items": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "linea": {"type": "integer"},
+                    "cantidad": _NUMERO,
+                    "precio_unitario": _NUMERO,
+                    "importe_neto": _NUMERO,
+                    "importe_iva": _NUMERO,
+                    "total_linea": _NUMERO,
+                },
+                "required": ["linea"],
+            },
+        },
+    },
+}
@@ -0,0 +1,179 @@
+"""
+Validador de consistencia aritmética de facturas extraídas
+Cruza items contra totales e identifica qué campos hay que volver a leer
+"""
+
+import logging
+import re
+from typing import Dict, List, Optional
+from logging_config import log_success, log_warning
+
+logger = logging.getLogger(__name__)
+
+# Tolerancias (redondeo a centavos en cada línea de la factura)
+TOLERANCIA_LINEA = 0.05
+TOLERANCIA_TOTAL = 1.0
+
+CAMPOS_TOTALES = ['importe_total', 'importe_neto_gravado', 'importe_iva', 'importe_no_gravado', 'importe_exento']
+
+# Letra al final del tipo de comprobante ("FACTURA B", "NOTA DE CREDITO C")
+PATRON_LETRA = re.compile(r'\b([ABCEM])\s*$')
+
+
+def _num(valor) -> float:
+    try:
+        return float(valor or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _cierra(a: float, b: float, tolerancia: float) -> bool:
+    return abs(a - b) <= tolerancia
+
+
+def _iva_incluido(factura: Dict) -> bool:
+    """Facturas B/C: los importes de las líneas ya incluyen el IVA (no se discrimina)"""
+    letra = PATRON_LETRA.search(str(factura.get('tipo_comprobante') or '').strip().upper())
+    return bool(letra) and letra.group(1) in ('B', 'C')
+
+
+def _falla(tipo: str, campos: List[str], detalle: str, linea: Optional[int] = None) -> Dict:
+    return {'tipo': tipo, 'campos': campos, 'linea': linea, 'detalle': detalle}
+
+
+def validar_totales_cabecera(data: Dict) -> List[Dict]:
+    """Total = neto gravado + IVA + no gravado + exento + impuestos"""
+    factura = data['cabecera']['factura']
+    impuestos = sum(_num(imp.get('monto')) for imp in data['cabecera'].get('impuestos') or [])
+    componentes = sum(_num(factura.get(c)) for c in CAMPOS_TOTALES[1:]) + impuestos
+    total = _num(factura.get('importe_total'))
+
+    if _cierra(componentes, total, TOLERANCIA_TOTAL):
+        return []
+    return [_falla(
+        'totales',
+        CAMPOS_TOTALES + ['impuestos'],
+        f"Componentes ${componentes:,.2f} (incl. impuestos ${impuestos:,.2f}) vs total ${total:,.2f}"
+    )]
+
+
+def validar_aritmetica(data: Dict) -> List[Dict]:
+    """Devuelve la lista de inconsistencias aritméticas (vacía si todo cierra)"""
+    fallas = []
+    items = data.get('items') or []
+    factura = data['cabecera']['factura']
+
+    # 1. Cada línea: neto + IVA = total de línea
+    for item in items:
+        neto, iva, total = _num(item.get('importe_neto')), _num(item.get('importe_iva')), _num(item.get('total_linea'))
+        if not _cierra(neto + iva, total, TOLERANCIA_LINEA):
+            fallas.append(_falla(
+                'linea',
+                ['importe_neto', 'importe_iva', 'total_linea'],
+                f"Línea {item.get('linea')}: neto ${neto:,.2f} + IVA ${iva:,.2f} != total ${total:,.2f}",
+                item.get('linea')
+            ))
+
+    # 2. Suma de líneas vs cabecera (sólo si las líneas cierran por sí mismas)
+    if items and not fallas:
+        tolerancia = max(TOLERANCIA_TOTAL, TOLERANCIA_LINEA * len(items))
+
+        if _iva_incluido(factura):
+            # B/C: las líneas suman el total de la factura sin percepciones/impuestos
+            suma_lineas = sum(_num(i.get('total_linea')) for i in items)
+            impuestos = sum(_num(imp.get('monto')) for imp in data['cabecera'].get('impuestos') or [])
+            total_sin_impuestos = _num(factura.get('importe_total')) - impuestos
+            if not _cierra(suma_lineas, total_sin_impuestos, tolerancia):
+                fallas.append(_falla(
+                    'suma_total',
+                    CAMPOS_TOTALES + ['impuestos'],
+                    f"Suma de líneas (IVA incluido) ${suma_lineas:,.2f} vs total sin impuestos ${total_sin_impuestos:,.2f}"
+                ))
+        else:
+            suma_neto = sum(_num(i.get('importe_neto')) for i in items)
+            suma_iva = sum(_num(i.get('importe_iva')) for i in items)
+            neto_cabecera = sum(_num(factura.get(c)) for c in ['importe_neto_gravado', 'importe_no_gravado', 'importe_exento'])
+
+            if not _cierra(suma_neto, neto_cabecera, tolerancia):
+                fallas.append(_falla(
+                    'suma_neto',
+                    ['importe_neto_gravado', 'importe_no_gravado', 'importe_exento'],
+                    f"Suma neto de líneas ${suma_neto:,.2f} vs neto de cabecera ${neto_cabecera:,.2f}"
+                ))
+            if suma_iva > 0 and not _cierra(suma_iva, _num(factura.get('importe_iva')), tolerancia):
+                fallas.append(_falla(
+                    'suma_iva',
+                    ['importe_iva'],
+                    f"Suma IVA de líneas ${suma_iva:,.2f} vs IVA de cabecera ${_num(factura.get('importe_iva')):,.2f}"
+                ))
+
+    # 3. Cabecera: total vs componentes e impuestos
+    fallas.extend(validar_totales_cabecera(data))
+    return fallas
+
+
+def prompt_correccion(fallas: List[Dict]) -> str:
+    """Prompt mínimo que pide releer sólo los campos inconsistentes"""
+    lineas = sorted({f['linea'] for f in fallas if f['linea'] is not None})
+    campos_cabecera = sorted({c for f in fallas if f['linea'] is None for c in f['campos'] if c != 'impuestos'})
+    pedir_impuestos = any('impuestos' in f['campos'] for f in fallas)
+
+    pedidos = []
+    if lineas:
+        pedidos.append(f"- items (líneas {', '.join(str(l) for l in lineas)}): cantidad, precio_unitario, importe_neto, importe_iva, total_linea")
+    if campos_cabecera:
+        pedidos.append(f"- factura: {', '.join(campos_cabecera)}")
+    if pedir_impuestos:
+        pedidos.append("- impuestos: todas las percepciones/retenciones con su monto")
+
+    detalle = "\n".join(f"- {f['detalle']}" for f in fallas)
+    return (
+        "Los importes extraídos de esta factura no cierran:\n"
+        f"{detalle}\n"
+        "Relee en la imagen SOLO estos valores y devuélvelos exactos:\n"
+        + "\n".join(pedidos)
+    )
+
+
+def aplicar_correccion(data: Dict, correccion: Dict, fallas: List[Dict]) -> Dict:
+    """Combina la corrección parcial con la extracción original (sólo campos pedidos)"""
+    lineas = {f['linea'] for f in fallas if f['linea'] is not None}
+    campos_cabecera = {c for f in fallas if f['linea'] is None for c in f['campos']}
+
+    factura = data['cabecera']['factura']
+    for campo, valor in (correccion.get('factura') or {}).items():
+        if campo in campos_cabecera and campo in CAMPOS_TOTALES and valor is not None:
+            factura[campo] = valor
+
+    if 'impuestos' in campos_cabecera and correccion.get('impuestos') is not None:
+        data['cabecera']['impuestos'] = correccion['impuestos']
+
+    items_por_linea = {item.get('linea'): item for item in data.get('items') or []}
+    for corregido in correccion.get('items') or []:
+        item = items_por_linea.get(corregido.get('linea'))
+        if item is None or corregido.get('linea') not in lineas:
+            continue
+        for campo, valor in corregido.items():
+            if campo != 'linea' and valor is not None:
+                item[campo] = valor
+
+    return data
+
+
+def resumen_validacion(fallas_iniciales: List[Dict], fallas_finales: List[Dict], corregido: bool) -> Dict:
+    """Bloque que se adjunta a la extracción para auditoría"""
+    if not fallas_finales:
+        if fallas_iniciales:
+            log_success(logger, f"Consistencia aritmética restablecida ({len(fallas_iniciales)} inconsistencia(s) corregidas)")
+        else:
+            log_success(logger, "Consistencia aritmética OK")
+    else:
+        for falla in fallas_finales:
+            log_warning(logger, f"Inconsistencia aritmética: {falla['detalle']}")
+
+    return {
+        'ok': not fallas_finales,
+        'corregido': corregido,
+        'fallas_iniciales': [f['detalle'] for f in fallas_iniciales],
+        'fallas': [f['detalle'] for f in fallas_finales]
+    }
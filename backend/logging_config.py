@@ -1,50 +1,216 @@
 """
 Configuración de logging mejorado para el sistema
+Los threads que loguean sólo encolan el registro; un thread aparte lo formatea (texto con
+colores o JSON) y lo escribe en stdout. Las líneas de detalle (por item, por página) se pueden
+muestrear por logger con LOG_MUESTREO.
 """
-import logging
 import sys
+import copy
+import json
+import queue
+import atexit
+import logging
+import itertools
+import threading
 from datetime import datetime
+from functools import lru_cache
+from logging.handlers import QueueHandler, QueueListener
+import db_config
 
-def setup_logging():
-    """Configura el sistema de logging con formato detallado"""
-    
-    # Formato detallado con colores (solo para consola)
-    class ColoredFormatter(logging.Formatter):
-        """Formatter con colores para la consola"""
-        
-        COLORS = {
-            'DEBUG': '\033[36m',      # Cyan
-            'INFO': '\033[32m',       # Verde
-            'WARNING': '\033[33m',    # Amarillo
-            'ERROR': '\033[31m',      # Rojo
-            'CRITICAL': '\033[35m',   # Magenta
-            'RESET': '\033[0m'
+DETALLE = 'detalle'  # Sufijo de los loggers de líneas por item/página (log_detalle)
+
+_listener = None
+
+
+class ColoredFormatter(logging.Formatter):
+    """Formatter con colores para la consola"""
+
+    COLORS = {
+        'DEBUG': '\033[36m',      # Cyan
+        'INFO': '\033[32m',       # Verde
+        'WARNING': '\033[33m',    # Amarillo
+        'ERROR': '\033[31m',      # Rojo
+        'CRITICAL': '\033[35m',   # Magenta
+        'RESET': '\033[0m'
+    }
+
+    def format(self, record):
+        # Copia: el mismo registro puede pasar por otros handlers
+        record = copy.copy(record)
+        log_color = self.COLORS.get(record.levelname, self.COLORS['RESET'])
+        record.levelname = f"{log_color}{record.levelname:8}{self.COLORS['RESET']}"
+        return super().format(record)
+
+
+class JSONFormatter(logging.Formatter):
+    """Un objeto JSON por línea, con el trace ID del request (para producción y agregadores de logs)"""
+
+    def format(self, record):
+        entrada = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'nivel': record.levelname,
+            'logger': record.name,
+            'mensaje': record.getMessage(),
+            'thread': record.threadName,
         }
-        
-        def format(self, record):
-            log_color = self.COLORS.get(record.levelname, self.COLORS['RESET'])
-            record.levelname = f"{log_color}{record.levelname:8}{self.COLORS['RESET']}"
-            return super().format(record)
-    
+        for campo in ('trace_id', 'span_id', 'muestreo'):
+            valor = getattr(record, campo, None)
+            if valor is not None:
+                entrada[campo] = valor
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entrada['excepcion'] = record.exc_text
+        return json.dumps(entrada, ensure_ascii=False, default=str)
+
+
+class FiltroTraza(logging.Filter):
+    """Agrega el trace/span ID del contexto que loguea (antes de que el registro cambie de thread)"""
+
+    def filter(self, record):
+        # tracing importa este módulo: se busca ya cargado, sin importarlo desde acá
+        tracing = sys.modules.get('tracing')
+        actual = tracing.span_actual() if tracing else None
+        if actual is not None:
+            record.trace_id = actual.trace_id
+            record.span_id = actual.span_id
+        return True
+
+
+class FiltroMuestreo(logging.Filter):
+    """
+    Deja pasar 1 de cada N registros INFO/DEBUG de los loggers configurados (WARNING o más, siempre).
+    tasas: {'app.detalle': 0.1, 'detalle': 0.2}; una clave aplica al logger con ese nombre, a sus
+    hijos y a los loggers que terminan en '.<clave>' (ej. 'detalle' para todos los de detalle).
+    """
+
+    def __init__(self, tasas):
+        super().__init__()
+        self.tasas = tasas
+        self._cada = {}  # logger -> (N, contador) o None si no se muestrea
+        self._lock = threading.Lock()
+
+    def _regla(self, nombre):
+        regla = self._cada.get(nombre, False)
+        if regla is not False:
+            return regla
+        tasa = None
+        for clave, valor in self.tasas.items():
+            if nombre == clave or nombre.startswith(clave + '.') or nombre.endswith('.' + clave):
+                tasa = valor if tasa is None else min(tasa, valor)
+        regla = None
+        if tasa is not None and tasa < 1:
+            regla = (round(1 / tasa) if tasa > 0 else 0, itertools.count())
+        with self._lock:
+            self._cada[nombre] = regla
+        return regla
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not self.tasas:
+            return True
+        regla = self._regla(record.name)
+        if regla is None:
+            return True
+        cada, contador = regla
+        if cada == 0:
+            return False
+        if next(contador) % cada:
+            return False
+        record.muestreo = 1 / cada
+        return True
+
+
+class ColaNoBloqueante(QueueHandler):
+    """Encola sin esperar: con la cola llena descarta el registro (y lo cuenta) antes que frenar el procesamiento"""
+
+    def __init__(self, cola):
+        super().__init__(cola)
+        self.descartados = 0
+
+    def prepare(self, record):
+        # El mensaje se arma acá (una vez, con los args del momento); el formato, en el listener
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.descartados += 1
+
+
+def _parsear_muestreo(texto):
+    """'app.detalle=0.1,detalle=0.2' -> {'app.detalle': 0.1, 'detalle': 0.2}"""
+    tasas = {}
+    for parte in (texto or '').split(','):
+        if '=' not in parte:
+            continue
+        nombre, valor = parte.split('=', 1)
+        try:
+            tasas[nombre.strip()] = min(1.0, max(0.0, float(valor)))
+        except ValueError:
+            continue
+    return tasas
+
+
+def _detener():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def setup_logging():
+    """
+    Configura el logger raíz: texto con colores o JSON (LOG_FORMATO), escritura en un thread
+    aparte (LOG_ASINCRONO) y muestreo de líneas de detalle (LOG_MUESTREO).
+    Llamarla de nuevo reemplaza la configuración anterior.
+    """
+    global _listener
+    _detener()
+
+    nivel = logging.getLevelName(db_config.LOG_NIVEL)
+    nivel = nivel if isinstance(nivel, int) else logging.INFO
+
     # Configurar logger raíz
     logger = logging.getLogger()
-    logger.setLevel(logging.INFO)
-    
-    # Handler para consola con colores
+    logger.setLevel(nivel)
+
+    # Handler para consola
     console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setLevel(logging.INFO)
-    console_formatter = ColoredFormatter(
-        '%(asctime)s - [%(levelname)s] - %(name)s - %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
-    )
-    console_handler.setFormatter(console_formatter)
-    
+    console_handler.setLevel(nivel)
+    if db_config.LOG_FORMATO == 'json':
+        console_handler.setFormatter(JSONFormatter())
+    else:
+        console_handler.setFormatter(ColoredFormatter(
+            '%(asctime)s - [%(levelname)s] - %(name)s - %(message)s',
+            datefmt='%Y-%m-%d %H:%M:%S'
+        ))
+
+    if db_config.LOG_ASINCRONO:
+        handler = ColaNoBloqueante(queue.Queue(maxsize=db_config.LOG_COLA))
+        _listener = QueueListener(handler.queue, console_handler, respect_handler_level=True)
+        _listener.start()
+    else:
+        handler = console_handler
+    handler.addFilter(FiltroMuestreo(_parsear_muestreo(db_config.LOG_MUESTREO)))
+    handler.addFilter(FiltroTraza())
+
     # Limpiar handlers existentes y agregar el nuevo
     logger.handlers.clear()
-    logger.addHandler(console_handler)
-    
+    logger.addHandler(handler)
+
     return logger
 
+
+# Al salir se escribe lo que quedó en la cola
+atexit.register(_detener)
+
 # Emojis para logs más visuales
 EMOJI = {
     'start': '🚀',
@@ -63,40 +229,63 @@ EMOJI = {
     'bullet': '•'
 }
 
+# Los helpers aceptan args al estilo %: el mensaje sólo se arma si el nivel está habilitado
+# (y el registro no se descarta por muestreo). Ej: log_info(logger, "PDF con %d página(s)", n)
+
 def log_section(logger, title):
     """Loguea una sección con separador visual"""
+    if not logger.isEnabledFor(logging.INFO):
+        return
     logger.info("=" * 60)
-    logger.info(f"{EMOJI['start']} {title}")
+    logger.info("%s %s", EMOJI['start'], title)
     logger.info("=" * 60)
 
-def log_step(logger, step_number, description):
+def log_step(logger, step_number, description, *args):
     """Loguea un paso del proceso"""
-    logger.info(f"{EMOJI['arrow']} PASO {step_number}: {description}")
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(f"{EMOJI['arrow']} PASO {step_number}: {description}", *args)
 
-def log_success(logger, message):
+def log_success(logger, message, *args):
     """Loguea un éxito"""
-    logger.info(f"{EMOJI['success']} {message}")
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(f"{EMOJI['success']} {message}", *args)
 
-def log_error(logger, message):
+def log_error(logger, message, *args):
     """Loguea un error"""
-    logger.error(f"{EMOJI['error']} {message}")
+    if logger.isEnabledFor(logging.ERROR):
+        logger.error(f"{EMOJI['error']} {message}", *args)
 
-def log_warning(logger, message):
+def log_warning(logger, message, *args):
     """Loguea un warning"""
-    logger.warning(f"{EMOJI['warning']} {message}")
+    if logger.isEnabledFor(logging.WARNING):
+        logger.warning(f"{EMOJI['warning']} {message}", *args)
 
-def log_info(logger, message):
+def log_info(logger, message, *args):
     """Loguea información"""
-    logger.info(f"{EMOJI['info']} {message}")
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(f"{EMOJI['info']} {message}", *args)
+
+@lru_cache(maxsize=None)
+def _logger_detalle(logger):
+    return logger.getChild(DETALLE)
+
+def log_detalle(logger, message, *args):
+    """Línea por item/página: va al logger '<logger>.detalle' (muestreable con LOG_MUESTREO)"""
+    detalle = _logger_detalle(logger)
+    if detalle.isEnabledFor(logging.INFO):
+        detalle.info(f"  {EMOJI['bullet']} {message}", *args)
 
-def log_database(logger, operation, table, details=""):
+def log_database(logger, operation, table, details="", *args):
     """Loguea operación de base de datos"""
-    logger.info(f"{EMOJI['database']} DB {operation}: {table} {details}")
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(f"{EMOJI['database']} DB {operation}: {table} {details}", *args)
 
 def log_found(logger, entity, value):
     """Loguea cuando se encuentra algo"""
-    logger.info(f"{EMOJI['check']} Encontrado {entity}: {value}")
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("%s Encontrado %s: %s", EMOJI['check'], entity, value)
 
 def log_not_found(logger, entity, value):
     """Loguea cuando NO se encuentra algo"""
-    logger.warning(f"{EMOJI['cross']} NO encontrado {entity}: {value}")
+    if logger.isEnabledFor(logging.WARNING):
+        logger.warning("%s NO encontrado %s: %s", EMOJI['cross'], entity, value)
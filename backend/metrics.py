@@ -0,0 +1,228 @@
+"""
+Registro de métricas en memoria (contadores e histogramas con p50/p95/p99)
+Se exportan en formato de texto de Prometheus desde /api/metrics
+"""
+
+import math
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from typing import Dict, List, Optional, Tuple
+import tracing
+
+CUANTILES = (0.5, 0.95, 0.99)
+MUESTRAS_MAX = 1024  # Ventana de observaciones recientes para los percentiles
+
+
+def _percentil(ordenadas: List[float], p: float) -> Optional[float]:
+    """Percentil por rango más cercano (con pocas muestras el p99 es el máximo)"""
+    if not ordenadas:
+        return None
+    return ordenadas[max(0, math.ceil(p * len(ordenadas)) - 1)]
+
+
+def _escapar(valor) -> str:
+    return str(valor).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _etiquetas_texto(nombres: Tuple[str, ...], valores: Tuple, extra: str = "") -> str:
+    partes = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        partes.append(extra)
+    return "{" + ",".join(partes) + "}" if partes else ""
+
+
+class _Metrica:
+    tipo = ""
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Tuple[str, ...] = ()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def _clave(self, etiquetas: Dict) -> Tuple:
+        return tuple(str(etiquetas.get(n, '')) for n in self.etiquetas)
+
+    def exportar(self) -> List[str]:
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}"]
+        with self._lock:
+            series = list(self._series.items())
+        for clave, valor in sorted(series):
+            lineas.extend(self._lineas(clave, valor))
+        return lineas
+
+
+class Contador(_Metrica):
+    """Valor que sólo crece (ej. requests, errores)"""
+    tipo = "counter"
+
+    def inc(self, valor: float = 1, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            self._series[clave] = self._series.get(clave, 0) + valor
+
+    def valor(self, **etiquetas) -> float:
+        with self._lock:
+            return self._series.get(self._clave(etiquetas), 0)
+
+    def _lineas(self, clave, valor) -> List[str]:
+        return [f"{self.nombre}{_etiquetas_texto(self.etiquetas, clave)} {valor:g}"]
+
+
+class Histograma(_Metrica):
+    """
+    Duraciones (u otros valores): cantidad, suma y p50/p95/p99 de las últimas MUESTRAS_MAX
+    observaciones. Se exporta como summary de Prometheus.
+    """
+    tipo = "summary"
+
+    def observar(self, valor: float, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            serie = self._series.get(clave)
+            if serie is None:
+                serie = self._series[clave] = {'cantidad': 0, 'suma': 0.0, 'muestras': deque(maxlen=MUESTRAS_MAX)}
+            serie['cantidad'] += 1
+            serie['suma'] += valor
+            serie['muestras'].append(valor)
+
+    @contextmanager
+    def medir(self, **etiquetas):
+        """Observa la duración del bloque en segundos (también si termina con excepción)"""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(time.perf_counter() - inicio, **etiquetas)
+
+    def resumen(self, **etiquetas) -> Dict:
+        """{cantidad, suma, p50, p95, p99} de una serie"""
+        with self._lock:
+            serie = self._series.get(self._clave(etiquetas))
+            if serie is None:
+                return {'cantidad': 0, 'suma': 0.0, 'p50': None, 'p95': None, 'p99': None}
+            ordenadas = sorted(serie['muestras'])
+            return {
+                'cantidad': serie['cantidad'],
+                'suma': round(serie['suma'], 6),
+                **{f"p{int(q * 100)}": _percentil(ordenadas, q) for q in CUANTILES}
+            }
+
+    def _lineas(self, clave, serie) -> List[str]:
+        ordenadas = sorted(serie['muestras'])
+        lineas = []
+        for q in CUANTILES:
+            valor = _percentil(ordenadas, q)
+            etiquetas = _etiquetas_texto(self.etiquetas, clave, f'quantile="{q:g}"')
+            lineas.append(f"{self.nombre}{etiquetas} {valor:.6g}")
+        etiquetas = _etiquetas_texto(self.etiquetas, clave)
+        lineas.append(f"{self.nombre}_sum{etiquetas} {serie['suma']:.6g}")
+        lineas.append(f"{self.nombre}_count{etiquetas} {serie['cantidad']}")
+        return lineas
+
+
+class Registro:
+    """Métricas del proceso; crear dos veces el mismo nombre devuelve la misma métrica"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metricas = {}
+
+    def _registrar(self, clase, nombre: str, ayuda: str, etiquetas: Tuple[str, ...]):
+        with self._lock:
+            metrica = self._metricas.get(nombre)
+            if metrica is None:
+                metrica = self._metricas[nombre] = clase(nombre, ayuda, etiquetas)
+            return metrica
+
+    def contador(self, nombre: str, ayuda: str, etiquetas: Tuple[str, ...] = ()) -> Contador:
+        return self._registrar(Contador, nombre, ayuda, etiquetas)
+
+    def histograma(self, nombre: str, ayuda: str, etiquetas: Tuple[str, ...] = ()) -> Histograma:
+        return self._registrar(Histograma, nombre, ayuda, etiquetas)
+
+    def exportar(self) -> str:
+        """Todas las métricas en formato de texto de Prometheus (0.0.4)"""
+        with self._lock:
+            metricas = sorted(self._metricas.values(), key=lambda m: m.nombre)
+        lineas = []
+        for metrica in metricas:
+            lineas.extend(metrica.exportar())
+        return "\n".join(lineas) + "\n"
+
+
+REGISTRO = Registro()
+
+# Etapas del procesamiento: render, duplicado, modelo, proveedor, insercion, commit, asiento
+ETAPA_SEGUNDOS = REGISTRO.histograma(
+    'facturas_etapa_segundos', 'Duración de cada etapa del procesamiento de facturas', ('etapa',))
+ETAPA_ERRORES = REGISTRO.contador(
+    'facturas_etapa_errores_total', 'Etapas terminadas con error', ('etapa',))
+FACTURAS = REGISTRO.contador(
+    'facturas_procesadas_total', 'Facturas procesadas por resultado', ('resultado',))
+
+GEMINI_SEGUNDOS = REGISTRO.histograma(
+    'gemini_llamada_segundos', 'Latencia de las llamadas de extracción a Gemini', ('modelo', 'resultado'))
+GEMINI_TOKENS = REGISTRO.contador(
+    'gemini_tokens_total', 'Tokens consumidos en Gemini (entrada, salida, cache)', ('modelo', 'tipo'))
+GEMINI_BYTES_IMAGENES = REGISTRO.contador(
+    'gemini_bytes_imagenes_total', 'Bytes de imagen enviados a Gemini', ('modelo',))
+GEMINI_HEDGES_ABANDONADOS = REGISTRO.contador(
+    'gemini_hedges_abandonados_total', 'Peticiones a Gemini que perdieron el hedge y siguieron corriendo', ('modelo',))
+
+BD_SEGUNDOS = REGISTRO.histograma(
+    'bd_operacion_segundos', 'Duración de las operaciones de DatabaseIntegrator', ('operacion',))
+BD_ERRORES = REGISTRO.contador(
+    'bd_operacion_errores_total', 'Operaciones de BD que fallaron', ('operacion',))
+
+HTTP_SEGUNDOS = REGISTRO.histograma(
+    'http_request_segundos', 'Duración de los requests a la API', ('ruta', 'metodo'))
+HTTP_REQUESTS = REGISTRO.contador(
+    'http_requests_total', 'Requests a la API por estado HTTP', ('ruta', 'metodo', 'estado'))
+
+
+@contextmanager
+def etapa(nombre: str):
+    """Mide una etapa del procesamiento (también como span de la traza) y cuenta las que terminan con excepción"""
+    inicio = time.perf_counter()
+    try:
+        with tracing.span(nombre):
+            yield
+    except Exception:
+        ETAPA_ERRORES.inc(etapa=nombre)
+        raise
+    finally:
+        ETAPA_SEGUNDOS.observar(time.perf_counter() - inicio, etapa=nombre)
+
+
+def medir_etapa(nombre: str, vacio_es_error: bool = False):
+    """Decorador de etapa; con vacio_es_error también cuenta como error un resultado vacío (None, [])"""
+    def decorador(funcion):
+        @wraps(funcion)
+        def medida(*args, **kwargs):
+            with etapa(nombre):
+                resultado = funcion(*args, **kwargs)
+            if vacio_es_error and not resultado:
+                ETAPA_ERRORES.inc(etapa=nombre)
+            return resultado
+        return medida
+    return decorador
+
+
+def operacion_bd(funcion):
+    """Decorador: duración de una operación de BD (los métodos que atrapan sus errores los cuentan con BD_ERRORES)"""
+    operacion = funcion.__name__.lstrip('_')
+
+    @wraps(funcion)
+    def medida(*args, **kwargs):
+        try:
+            with BD_SEGUNDOS.medir(operacion=operacion):
+                return funcion(*args, **kwargs)
+        except Exception:
+            BD_ERRORES.inc(operacion=operacion)
+            raise
+    return medida
@@ -0,0 +1,131 @@
+"""
+Escalonamiento de modelos para la extracción
+Primero un modelo rápido/barato; se escala al modelo fuerte sólo si la validación falla
+"""
+
+import logging
+import threading
+from collections import deque
+from typing import Dict, List, Optional
+import db_config
+from cuit import normalizar_cuit, corregir_cuit, PREFIJOS_VALIDOS
+from invoice_validator import validar_totales_cabecera
+from logging_config import log_info
+
+logger = logging.getLogger(__name__)
+
+TIER_RAPIDO = 'rapido'
+TIER_FUERTE = 'fuerte'
+
+# Caracteres mínimos de texto en la primera página para considerar un PDF "nativo digital"
+MIN_CARACTERES_TEXTO = 200
+
+
+def es_pdf_digital(doc) -> bool:
+    """True si el PDF (documento fitz ya abierto, o None) tiene capa de texto: generado digitalmente, no escaneado"""
+    if doc is None or len(doc) == 0:
+        return False
+    try:
+        return len(doc[0].get_text().strip()) >= MIN_CARACTERES_TEXTO
+    except Exception:
+        return False
+
+
+def problemas_extraccion(data: Optional[Dict], cuits_conocidos: Optional[Dict] = None) -> List[str]:
+    """Chequeos rápidos sobre la extracción: CUIT, CUIT propio y aritmética de totales"""
+    if not data:
+        return ["Sin respuesta válida del modelo"]
+
+    problemas = []
+    cabecera = data.get('cabecera') if isinstance(data, dict) else None
+    if not isinstance(cabecera, dict) or not isinstance(cabecera.get('proveedor'), dict) or 'factura' not in cabecera:
+        return ["Estructura de respuesta incompleta"]
+    proveedor = cabecera['proveedor']
+
+    cuit = str(proveedor.get('cuit') or '').replace('-', '').replace(' ', '')
+    if not cuit or cuit == 'null':
+        problemas.append("CUIT ausente")
+    elif len(cuit) != 11 or not cuit.isdigit():
+        problemas.append(f"CUIT inválido: {cuit}")
+    elif cuit in [normalizar_cuit(c) for c in db_config.CUITS_PROPIOS]:
+        problemas.append(f"CUIT propio detectado como proveedor: {cuit}")
+    elif corregir_cuit(cuit, cuits_conocidos or {}) is None:
+        # Los errores de un dígito corregibles localmente (también en el prefijo) no justifican escalar
+        if cuit[:2] not in PREFIJOS_VALIDOS:
+            problemas.append(f"CUIT con prefijo inválido: {cuit[:2]}")
+        else:
+            problemas.append(f"CUIT con dígito verificador inválido: {cuit}")
+
+    try:
+        problemas.extend(f['detalle'] for f in validar_totales_cabecera(data))
+    except (KeyError, TypeError):
+        problemas.append("Importes no disponibles")
+
+    return problemas
+
+
+class TierStats:
+    """Latencias y tasa de escalamiento por tier (thread-safe)"""
+
+    def __init__(self, modelos: Dict[str, str]):
+        self.modelos = modelos
+        self._lock = threading.Lock()
+        self._stats = {
+            tier: {'llamadas': 0, 'fallidas': 0, 'latencias': deque(maxlen=500)}
+            for tier in modelos
+        }
+        self._extracciones = 0
+        self._escaladas = 0
+        self._directas_fuerte = 0
+
+    def registrar_llamada(self, tier: str, segundos: float, ok: bool):
+        with self._lock:
+            stats = self._stats[tier]
+            stats['llamadas'] += 1
+            stats['latencias'].append(segundos)
+            if not ok:
+                stats['fallidas'] += 1
+
+    def registrar_extraccion(self, tier_inicial: str, escalada: bool):
+        with self._lock:
+            self._extracciones += 1
+            if tier_inicial == TIER_FUERTE:
+                self._directas_fuerte += 1
+            if escalada:
+                self._escaladas += 1
+
+    def reporte(self) -> Dict:
+        """Resumen por tier: latencias (p50/p95) y tasa de escalamiento"""
+        with self._lock:
+            tiers = {}
+            for tier, stats in self._stats.items():
+                latencias = sorted(stats['latencias'])
+                tiers[tier] = {
+                    'modelo': self.modelos[tier],
+                    'llamadas': stats['llamadas'],
+                    'fallidas': stats['fallidas'],
+                    'latencia_p50': _percentil(latencias, 0.50),
+                    'latencia_p95': _percentil(latencias, 0.95),
+                    'latencia_media': round(sum(latencias) / len(latencias), 3) if latencias else None,
+                }
+
+            iniciadas_rapido = self._extracciones - self._directas_fuerte
+            return {
+                'extracciones': self._extracciones,
+                'iniciadas_en_rapido': iniciadas_rapido,
+                'directas_a_fuerte': self._directas_fuerte,
+                'escaladas': self._escaladas,
+                'tasa_escalamiento': round(self._escaladas / iniciadas_rapido, 3) if iniciadas_rapido else None,
+                'tiers': tiers,
+            }
+
+    def log_resumen(self):
+        r = self.reporte()
+        if r['tasa_escalamiento'] is not None:
+            log_info(logger, f"Tiering: {r['escaladas']}/{r['iniciadas_en_rapido']} escaladas ({r['tasa_escalamiento']:.0%})")
+
+
+def _percentil(valores: List[float], p: float) -> Optional[float]:
+    if not valores:
+        return None
+    return round(valores[int(p * (len(valores) - 1))], 3)
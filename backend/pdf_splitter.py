@@ -0,0 +1,157 @@
+"""
+Separación de PDFs con varias facturas
+Detecta dónde empieza cada factura (capa de texto, QR de AFIP, "Página 1 de N") y genera un PDF por factura
+"""
+
+import io
+import re
+import json
+import base64
+import logging
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse, parse_qs
+import fitz  # PyMuPDF
+from upload_store import guardar_por_contenido
+from logging_config import log_info, log_success, log_warning, EMOJI
+
+logger = logging.getLogger(__name__)
+
+# Layout estándar de AFIP: "Punto de Venta: 00003  Comp. Nro: 00001234"
+PATRON_PUNTO_VENTA = re.compile(r'Punto\s+de\s+Venta\s*:?\s*(\d{1,5})', re.IGNORECASE)
+PATRON_COMP_NRO = re.compile(r'Comp\.?\s*N(?:ro|°|º)\.?\s*:?\s*(\d{1,8})', re.IGNORECASE)
+# Formato corto: "N° 0003-00001234"
+PATRON_NUMERO = re.compile(r'N\s*[°ºo\.]\s*:?\s*(\d{4,5})\s*-\s*(\d{8})\b')
+PATRON_PAGINA = re.compile(r'(?:P[áa]g(?:ina)?\.?|Hoja)\s*(\d{1,3})\s*(?:de|/)\s*(\d{1,3})\b', re.IGNORECASE)
+PATRON_COPIA = re.compile(r'\b(DUPLICADO|TRIPLICADO|CUADRUPLICADO)\b')
+PATRON_ORIGINAL = re.compile(r'\bORIGINAL\b')
+PATRON_QR_AFIP = re.compile(r'https?://(?:www\.)?afip\.gob\.ar/fe/qr/?\?p=[A-Za-z0-9_\-+/=%]+')
+
+
+def datos_qr(url: str) -> Optional[Dict]:
+    """Datos del QR de AFIP (JSON en base64 en el parámetro p): cuit, ptoVta, tipoCmp, nroCmp, importe..."""
+    try:
+        p = parse_qs(urlparse(url).query).get('p', [''])[0]
+        p = p.replace('-', '+').replace('_', '/')
+        datos = json.loads(base64.b64decode(p + '=' * (-len(p) % 4)))
+        return datos if isinstance(datos, dict) else None
+    except Exception:
+        return None
+
+
+def urls_qr(page, texto: str) -> List[str]:
+    """URLs de QR de AFIP de la página (links del código o URL en la capa de texto)"""
+    urls = [link.get('uri') or '' for link in page.get_links()]
+    urls += [m.group(0) for m in PATRON_QR_AFIP.finditer(texto)]
+    return [url for url in urls if 'afip.gob.ar/fe/qr' in url]
+
+
+def _clave_qr(url: str) -> Optional[Tuple]:
+    """(tipo, punto de venta, número) del QR de AFIP"""
+    datos = datos_qr(url)
+    try:
+        return (int(datos['tipoCmp']), int(datos['ptoVta']), int(datos['nroCmp']))
+    except Exception:
+        return None
+
+
+def analizar_pagina(page) -> Dict:
+    """Señales de una página: identidad del comprobante (tipo, punto, número), 'Página i de N' y copias"""
+    texto = page.get_text()
+    senales = {'clave': None, 'pagina': None, 'copia': bool(PATRON_COPIA.search(texto)),
+               'original': bool(PATRON_ORIGINAL.search(texto))}
+
+    # 1. QR de AFIP (link del código o URL en la capa de texto)
+    for url in urls_qr(page, texto):
+        senales['clave'] = _clave_qr(url)
+        if senales['clave']:
+            break
+
+    # 2. Punto de venta y número en el texto
+    if senales['clave'] is None:
+        punto, numero = PATRON_PUNTO_VENTA.search(texto), PATRON_COMP_NRO.search(texto)
+        if punto and numero:
+            senales['clave'] = (None, int(punto.group(1)), int(numero.group(1)))
+        else:
+            corto = PATRON_NUMERO.search(texto)
+            if corto:
+                senales['clave'] = (None, int(corto.group(1)), int(corto.group(2)))
+
+    pagina = PATRON_PAGINA.search(texto)
+    if pagina:
+        senales['pagina'] = (int(pagina.group(1)), int(pagina.group(2)))
+
+    return senales
+
+
+def _misma_factura(a: Tuple, b: Tuple) -> bool:
+    """Compara punto/número (y el tipo si ambas claves lo tienen)"""
+    if a[1:] != b[1:]:
+        return False
+    return a[0] is None or b[0] is None or a[0] == b[0]
+
+
+def detectar_facturas(pdf_path: str) -> List[List[int]]:
+    """Páginas (índices 0-based) de cada factura del PDF. Sin señales: una sola factura"""
+    with fitz.open(pdf_path) as doc:
+        senales = [analizar_pagina(page) for page in doc]
+
+    grupos, claves = [], []
+    for i, s in enumerate(senales):
+        nueva = not grupos
+        if not nueva and s['pagina'] and s['pagina'][0] == 1 and s['pagina'][1] >= 1:
+            nueva = True  # "Página 1 de N" abre una factura
+        if not nueva and s['clave'] and claves[-1] and not _misma_factura(s['clave'], claves[-1]):
+            nueva = True  # Otro punto de venta / número de comprobante
+        # Una copia (DUPLICADO) del mismo comprobante no es otra factura aunque diga "Página 1 de 1"
+        if nueva and grupos and s['clave'] and claves[-1] and _misma_factura(s['clave'], claves[-1]):
+            nueva = False
+
+        if nueva:
+            grupos.append([i])
+            claves.append(s['clave'])
+        else:
+            grupos[-1].append(i)
+            claves[-1] = claves[-1] or s['clave']
+
+    # Copias DUPLICADO/TRIPLICADO: sobra mandarlas al modelo si está el ORIGINAL
+    depurados = []
+    for grupo in grupos:
+        if any(senales[i]['original'] and not senales[i]['copia'] for i in grupo):
+            grupo = [i for i in grupo if not senales[i]['copia']] or grupo
+        depurados.append(grupo)
+    return depurados
+
+
+def dividir_pdf(pdf_path: str, carpeta: str) -> List[Dict]:
+    """
+    Separa el PDF en un archivo por factura (guardado por contenido en carpeta).
+    Devuelve [{'filename', 'paginas'}], o [] si el archivo tiene una sola factura.
+    """
+    if not pdf_path.lower().endswith('.pdf'):
+        return []
+
+    try:
+        grupos = detectar_facturas(pdf_path)
+    except Exception as e:
+        log_warning(logger, f"No se pudo analizar el PDF para separar facturas: {e}")
+        return []
+
+    if len(grupos) <= 1:
+        return []
+
+    log_info(logger, f"{EMOJI['document']} El PDF contiene {len(grupos)} facturas")
+    partes = []
+    with fitz.open(pdf_path) as doc:
+        for grupo in grupos:
+            parte = fitz.open()
+            for pagina in grupo:
+                parte.insert_pdf(doc, from_page=pagina, to_page=pagina)
+            parte.set_metadata({})  # Bytes deterministas: la misma factura da el mismo hash
+            contenido = parte.tobytes(garbage=3, deflate=True, no_new_id=True)
+            parte.close()
+
+            filename, _, _ = guardar_por_contenido(io.BytesIO(contenido), carpeta, 'pdf')
+            partes.append({'filename': filename, 'paginas': [p + 1 for p in grupo]})
+
+    log_success(logger, "Facturas separadas: " + ", ".join(f"págs. {p['paginas']}" for p in partes))
+    return partes
@@ -0,0 +1,100 @@
+"""
+Huella perceptual de facturas (pHash con NumPy)
+Detecta re-escaneos de la misma factura aunque los bytes del archivo sean distintos
+"""
+
+import threading
+from typing import Iterable, Optional, Tuple
+import numpy as np
+from PIL import Image
+
+LADO = 64          # Se reduce la página a LADO x LADO en escala de grises
+FRECUENCIAS = 16   # Bloque de bajas frecuencias de la DCT -> FRECUENCIAS² bits
+BYTES_HUELLA = FRECUENCIAS * FRECUENCIAS // 8
+UMBRAL_TINTA = 40  # Niveles de gris por debajo del fondo para considerar un píxel como contenido
+
+
+def _matriz_dct(n: int) -> np.ndarray:
+    """Matriz de la DCT-II ortonormal de n puntos"""
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matriz = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    matriz[0] /= np.sqrt(2.0)
+    return matriz
+
+
+_DCT = _matriz_dct(LADO)
+
+
+def _recortar_margenes(gris: Image.Image) -> Image.Image:
+    """Recorta al contenido: el escáner agrega márgenes y desplazamientos distintos en cada pasada"""
+    pixeles = np.asarray(gris)
+    tinta = pixeles < np.median(pixeles) - UMBRAL_TINTA
+    filas, columnas = np.nonzero(tinta)
+    if len(filas) == 0:
+        return gris
+    return gris.crop((columnas.min(), filas.min(), columnas.max() + 1, filas.max() + 1))
+
+
+def huella_perceptual(imagen: Image.Image) -> str:
+    """pHash de FRECUENCIAS² bits (hex): bajas frecuencias de la DCT comparadas contra su mediana"""
+    gris = _recortar_margenes(imagen.convert('L')).resize((LADO, LADO), Image.LANCZOS)
+    pixeles = np.asarray(gris, dtype=np.float64)
+
+    bajas = (_DCT @ pixeles @ _DCT.T)[:FRECUENCIAS, :FRECUENCIAS]
+    mediana = np.median(bajas.flatten()[1:])  # Sin la componente continua (brillo medio)
+    bits = (bajas > mediana).flatten()
+    return np.packbits(bits).tobytes().hex()
+
+
+def distancia_hamming(a: str, b: str) -> int:
+    """Bits distintos entre dos huellas"""
+    return bin(int(a, 16) ^ int(b, 16)).count('1')
+
+
+class IndiceHuellas:
+    """Búsqueda del vecino más cercano por distancia de Hamming (vectorizada, en memoria)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._refs = []
+        self._matriz = np.zeros((0, BYTES_HUELLA), dtype=np.uint8)
+
+    def __len__(self):
+        return len(self._refs)
+
+    def cargar(self, pares: Iterable[Tuple[str, str]]):
+        """Reemplaza el contenido con pares (referencia, huella hex)"""
+        refs, filas = [], []
+        for ref, huella in pares:
+            if huella and len(huella) == BYTES_HUELLA * 2:
+                refs.append(ref)
+                filas.append(np.frombuffer(bytes.fromhex(huella), dtype=np.uint8))
+        with self._lock:
+            self._refs = refs
+            self._matriz = np.vstack(filas) if filas else np.zeros((0, BYTES_HUELLA), dtype=np.uint8)
+
+    def agregar(self, ref: str, huella: str):
+        if not huella or len(huella) != BYTES_HUELLA * 2:
+            return
+        fila = np.frombuffer(bytes.fromhex(huella), dtype=np.uint8)[None, :]
+        with self._lock:
+            self._refs.append(ref)
+            self._matriz = np.vstack([self._matriz, fila])
+
+    def quitar(self, refs: Iterable[str]):
+        quitar = set(refs)
+        with self._lock:
+            conservar = [i for i, ref in enumerate(self._refs) if ref not in quitar]
+            self._refs = [self._refs[i] for i in conservar]
+            self._matriz = self._matriz[conservar]
+
+    def mas_cercano(self, huella: str) -> Optional[Tuple[str, int]]:
+        """(referencia, distancia) de la huella más parecida, o None si el índice está vacío"""
+        consulta = np.frombuffer(bytes.fromhex(huella), dtype=np.uint8)
+        with self._lock:
+            if not self._refs:
+                return None
+            distancias = np.unpackbits(self._matriz ^ consulta, axis=1).sum(axis=1)
+            mejor = int(np.argmin(distancias))
+            return self._refs[mejor], int(distancias[mejor])
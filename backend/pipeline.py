@@ -0,0 +1,162 @@
+"""
+Pipeline por etapas con colas acotadas
+Cada etapa tiene su propia concurrencia: mientras una factura espera al modelo, la siguiente
+se renderiza y la anterior se escribe en la BD
+"""
+
+import time
+import queue
+import threading
+import contextvars
+from typing import Any, Callable, Dict, List, Optional
+
+
+class Terminado:
+    """Valor que devuelve una etapa para saltear las etapas siguientes (ej. error o duplicado)"""
+
+    def __init__(self, valor: Any):
+        self.valor = valor
+
+
+class Etapa:
+    """Etapa del pipeline: funcion(valor) -> valor (o Terminado), con `concurrencia` threads"""
+
+    def __init__(self, nombre: str, funcion: Callable[[Any], Any], concurrencia: int = 1):
+        self.nombre = nombre
+        self.funcion = funcion
+        self.concurrencia = max(1, concurrencia)
+
+
+class _Item:
+    __slots__ = ('indice', 'valor', 'contexto', 'terminado')
+
+    def __init__(self, indice: int, valor: Any, contexto: contextvars.Context):
+        self.indice = indice
+        self.valor = valor
+        self.contexto = contexto
+        self.terminado = False
+
+
+_FIN = object()
+
+
+class Pipeline:
+    """
+    Ejecuta items a través de las etapas en orden. Entre etapas hay colas de `capacidad`
+    items, así una etapa lenta frena a las anteriores en lugar de acumular memoria.
+    Un error en una etapa termina ese item: su resultado es la excepción.
+    """
+
+    def __init__(self, etapas: List[Etapa], capacidad: int = 4):
+        self.etapas = etapas
+        self.capacidad = max(1, capacidad)
+        self._lock = threading.Lock()
+        self._metricas = {}
+
+    def procesar(self, valores: List[Any], contextos: Optional[List[contextvars.Context]] = None,
+                 al_terminar: Optional[Callable[[int, Any], None]] = None) -> List[Any]:
+        """
+        Resultados en el mismo orden que `valores`.
+        contextos: contexto de cada item (por defecto, una copia del contexto del llamador)
+        al_terminar(indice, resultado): se llama en el contexto del item apenas sale del pipeline
+        """
+        colas = [queue.Queue(maxsize=self.capacidad) for _ in self.etapas]
+        resultados = [None] * len(valores)
+        self._metricas = {
+            etapa.nombre: {'concurrencia': etapa.concurrencia, 'items': 0, 'ocupado': 0.0, 'espera_cola': 0.0}
+            for etapa in self.etapas
+        }
+        inicio = time.monotonic()
+
+        pendientes = [etapa.concurrencia for etapa in self.etapas]
+        threads = []
+        for i, etapa in enumerate(self.etapas):
+            siguiente = colas[i + 1] if i + 1 < len(self.etapas) else None
+            for _ in range(etapa.concurrencia):
+                thread = threading.Thread(
+                    target=self._trabajar,
+                    args=(i, etapa, colas[i], siguiente, resultados, pendientes, al_terminar),
+                    daemon=True
+                )
+                thread.start()
+                threads.append(thread)
+
+        # El thread llamador alimenta la primera etapa (se bloquea si la cola está llena)
+        for indice, valor in enumerate(valores):
+            contexto = contextos[indice] if contextos else contextvars.copy_context()
+            colas[0].put(_Item(indice, valor, contexto))
+        for _ in range(self.etapas[0].concurrencia):
+            colas[0].put(_FIN)
+
+        for thread in threads:
+            thread.join()
+
+        self._metricas['_total'] = {'items': len(valores), 'duracion': round(time.monotonic() - inicio, 3)}
+        return resultados
+
+    def _trabajar(self, i: int, etapa: Etapa, entrada: queue.Queue, salida: Optional[queue.Queue],
+                  resultados: List[Any], pendientes: List[int], al_terminar: Optional[Callable]):
+        while True:
+            esperando = time.monotonic()
+            item = entrada.get()
+            if item is _FIN:
+                break
+
+            comienzo = time.monotonic()
+            ejecutado = not item.terminado
+            if ejecutado:
+                try:
+                    valor = item.contexto.run(etapa.funcion, item.valor)
+                except Exception as e:
+                    valor = Terminado(e)
+                if isinstance(valor, Terminado):
+                    item.terminado = True
+                    valor = valor.valor
+                item.valor = valor
+
+            with self._lock:
+                metricas = self._metricas[etapa.nombre]
+                metricas['espera_cola'] += comienzo - esperando
+                if ejecutado:
+                    metricas['items'] += 1
+                    metricas['ocupado'] += time.monotonic() - comienzo
+
+            if salida is None:
+                resultados[item.indice] = item.valor
+                if al_terminar is not None:
+                    try:
+                        item.contexto.run(al_terminar, item.indice, item.valor)
+                    except Exception:
+                        pass  # Un callback no debe frenar al resto de los items
+            else:
+                salida.put(item)  # Los items terminados sólo atraviesan las colas hasta el final
+
+        # El último thread de la etapa avisa a la siguiente
+        with self._lock:
+            pendientes[i] -= 1
+            ultimo = pendientes[i] == 0
+        if ultimo and salida is not None:
+            for _ in range(self.etapas[i + 1].concurrencia):
+                salida.put(_FIN)
+
+    def metricas(self) -> Dict:
+        """Por etapa: items procesados, segundos ocupados, utilización y espera en cola"""
+        with self._lock:
+            total = self._metricas.get('_total', {})
+            duracion = total.get('duracion') or 0
+            reporte = {}
+            for nombre, m in self._metricas.items():
+                if nombre == '_total':
+                    continue
+                reporte[nombre] = {
+                    'concurrencia': m['concurrencia'],
+                    'items': m['items'],
+                    'ocupado': round(m['ocupado'], 3),
+                    'utilizacion': round(m['ocupado'] / (duracion * m['concurrencia']), 3) if duracion else None,
+                    'espera_cola': round(m['espera_cola'], 3),
+                }
+            reporte['total'] = {
+                **total,
+                'throughput_por_min': round(total['items'] * 60 / duracion, 2) if duracion else None
+            } if total else {}
+            return reporte
@@ -0,0 +1,130 @@
+"""
+Consulta anticipada de proveedor y OCs
+Apenas se conoce el CUIT del emisor (QR de AFIP o capa de texto del PDF) se consultan el estado
+del proveedor y sus OCs abiertas en conexiones propias, mientras Gemini extrae la factura. Cuando la extracción termina, la BD ya respondió.
+"""
+
+import re
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+import fitz  # PyMuPDF
+import db_config
+from cuit import normalizar_cuit
+from database_integrator import DatabaseIntegrator
+from pdf_splitter import datos_qr, urls_qr
+from progress import emitir
+from logging_config import log_info, log_warning, EMOJI
+
+logger = logging.getLogger(__name__)
+
+# "30-54340071-3", "30 54340071 3", "30543400713"
+PATRON_CUIT = re.compile(r'\b(\d{2})[-\s.]?(\d{8})[-\s.]?(\d)\b')
+
+
+def cuit_local(file_path: str, conocidos: Dict[str, str], doc=None) -> Optional[str]:
+    """
+    CUIT del emisor sin llamar al modelo: el del QR de AFIP, o el primero de la capa de texto
+    de la primera página que sea de un proveedor conocido (el CUIT propio no lo es).
+    None para imágenes y escaneos sin texto. doc: el PDF ya abierto con fitz, si se tiene.
+    """
+    if not file_path.lower().endswith('.pdf'):
+        return None
+
+    try:
+        if doc is None:
+            with fitz.open(file_path) as doc:
+                return cuit_local(file_path, conocidos, doc)
+        if not len(doc):
+            return None
+        page = doc[0]
+        texto = page.get_text()
+        for url in urls_qr(page, texto):
+            cuit = normalizar_cuit((datos_qr(url) or {}).get('cuit'))
+            if cuit in conocidos:
+                return cuit
+    except Exception as e:
+        log_warning(logger, f"No se pudo leer el PDF para anticipar el proveedor: {e}")
+        return None
+
+    propios = {normalizar_cuit(c) for c in db_config.CUITS_PROPIOS}
+    for match in PATRON_CUIT.finditer(texto):
+        cuit = ''.join(match.groups())
+        if cuit not in propios and cuit in conocidos:
+            return cuit
+    return None
+
+
+class Prefetch:
+    """Consultas en curso de un proveedor; sólo valen si la extracción llega al mismo código"""
+
+    def __init__(self, cuit: str, codigo: str, estado: Future, ocs: Future):
+        self.cuit = cuit
+        self.codigo = codigo
+        self._estado = estado
+        self._ocs = ocs
+
+    @staticmethod
+    def _resultado(futuro: Future):
+        try:
+            return futuro.result()
+        except Exception as e:
+            log_warning(logger, f"Consulta anticipada fallida, se consulta de nuevo: {e}")
+            return None
+
+    def estado(self, codigo: str) -> Optional[Tuple[bool, str]]:
+        """(activo, mensaje) de verificar_proveedor_activo, o None si no aplica"""
+        return self._resultado(self._estado) if codigo == self.codigo else None
+
+    def ocs(self, codigo: str) -> Optional[List[Dict]]:
+        """OCs activas de obtener_ocs_activas_proveedor, o None si no aplica"""
+        return self._resultado(self._ocs) if codigo == self.codigo else None
+
+
+class Prefetcher:
+    """
+    Lanza las consultas anticipadas. Cada thread del pool tiene su propia conexión:
+    no compite por el cursor compartido (ni por su lock) con la inserción de otras facturas.
+    """
+
+    def __init__(self, db: DatabaseIntegrator, conexiones: int = None):
+        self.db = db
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, conexiones or db_config.PREFETCH_CONEXIONES),
+            thread_name_prefix="prefetch"
+        )
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._conexiones = []
+
+    def _integrador(self) -> DatabaseIntegrator:
+        integrador = getattr(self._local, 'db', None)
+        if integrador is None:
+            integrador = DatabaseIntegrator()
+            self._local.db = integrador
+            with self._lock:
+                self._conexiones.append(integrador)
+        return integrador
+
+    def iniciar(self, file_path: str, doc=None) -> Optional[Prefetch]:
+        """Empieza las consultas si el CUIT se lee localmente; None si no (doc: el PDF ya abierto)"""
+        conocidos = self.db.cuits_proveedores()
+        cuit = cuit_local(file_path, conocidos, doc) if conocidos else None
+        if not cuit:
+            return None
+
+        codigo = conocidos[cuit]
+        log_info(logger, f"{EMOJI['search']} CUIT {cuit} leído del PDF: consultando proveedor {codigo} y OCs")
+        emitir('prefetch', f"Proveedor {codigo} anticipado desde el PDF", cuit=cuit, codigo=codigo)
+
+        estado = self._executor.submit(lambda: self._integrador().verificar_proveedor_activo(codigo))
+        ocs = self._executor.submit(lambda: self._integrador().obtener_ocs_activas_proveedor(codigo))
+        return Prefetch(cuit, codigo, estado, ocs)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            for integrador in self._conexiones:
+                integrador.close()
+            self._conexiones = []
@@ -0,0 +1,178 @@
+"""
+Perfilado a pedido de requests individuales
+Un request marcado se ejecuta bajo cProfile (determinístico, sólo el thread del request) o bajo
+un muestreador de pilas (todos los threads: pipeline, prefetch, hedging) y el perfil queda en
+PROFILING_DIR con el trace ID del request
+"""
+
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+import logging
+import secrets
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from io import StringIO
+from typing import Dict, List, Optional
+import db_config
+from logging_config import log_info, log_warning, EMOJI
+
+logger = logging.getLogger(__name__)
+
+MODOS = ('cprofile', 'muestreo')
+FUNCIONES_REPORTE = 40  # Filas del resumen en texto
+
+
+def _marco(frame) -> str:
+    codigo = frame.f_code
+    return f"{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{codigo.co_firstlineno})"
+
+
+class Muestreador(threading.Thread):
+    """Toma la pila de cada thread cada intervalo (tiempo de reloj: también cuenta las esperas de red y locks)"""
+
+    def __init__(self, intervalo: float):
+        super().__init__(name="profiling-muestreo", daemon=True)
+        self.intervalo = intervalo
+        self.pilas = Counter()
+        self.muestras = 0
+        self._fin = threading.Event()
+
+    def run(self):
+        propio = threading.get_ident()
+        while not self._fin.wait(self.intervalo):
+            nombres = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == propio:
+                    continue
+                pila = []
+                while frame is not None:
+                    pila.append(_marco(frame))
+                    frame = frame.f_back
+                self.pilas[(nombres.get(ident, str(ident)),) + tuple(reversed(pila))] += 1
+            self.muestras += 1
+
+    def detener(self):
+        self._fin.set()
+        self.join()
+
+    def folded(self) -> str:
+        """Pilas en formato 'folded' (flamegraph.pl, speedscope): thread;f1;f2 cantidad"""
+        return "".join(f"{';'.join(pila)} {cantidad}\n" for pila, cantidad in self.pilas.most_common())
+
+    def resumen(self) -> str:
+        """Funciones con más muestras propias (en la cima de la pila) e inclusivas"""
+        propias, inclusivas = Counter(), Counter()
+        for pila, cantidad in self.pilas.items():
+            propias[pila[-1]] += cantidad
+            for marco in set(pila[1:]):
+                inclusivas[marco] += cantidad
+
+        total = sum(self.pilas.values()) or 1
+        lineas = [f"{self.muestras} muestra(s) cada {self.intervalo * 1000:.0f} ms, {total} pila(s)", "",
+                  "Propias (cima de la pila):"]
+        lineas += [f"  {c / total:6.1%}  {c:6d}  {m}" for m, c in propias.most_common(FUNCIONES_REPORTE)]
+        lineas += ["", "Inclusivas:"]
+        lineas += [f"  {c / total:6.1%}  {c:6d}  {m}" for m, c in inclusivas.most_common(FUNCIONES_REPORTE)]
+        return "\n".join(lineas) + "\n"
+
+
+@contextmanager
+def perfilar(etiqueta: str, trace_id: Optional[str] = None, modo: str = 'cprofile'):
+    """
+    Perfila el bloque y lo guarda al salir (también si termina con excepción).
+    El valor es un dict con 'id' (prefijo de los archivos en PROFILING_DIR) y 'trace_id'.
+    """
+    modo = modo if modo in MODOS else 'cprofile'
+    trace_id = trace_id or secrets.token_hex(16)
+    perfil = {
+        'id': f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{trace_id}_{etiqueta}",
+        'trace_id': trace_id,
+        'etiqueta': etiqueta,
+        'modo': modo,
+        'creado': datetime.now().isoformat(timespec='milliseconds'),
+    }
+    log_info(logger, f"{EMOJI['search']} Perfilando {etiqueta} ({modo}), trace {trace_id}")
+
+    perfilador = cProfile.Profile() if modo == 'cprofile' else None
+    muestreador = Muestreador(db_config.PROFILING_INTERVALO_MS / 1000) if modo == 'muestreo' else None
+    inicio = time.perf_counter()
+    if perfilador:
+        perfilador.enable()
+    else:
+        muestreador.start()
+    try:
+        yield perfil
+    except BaseException as e:
+        perfil['error'] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        if perfilador:
+            perfilador.disable()
+        else:
+            muestreador.detener()
+        perfil['segundos'] = round(time.perf_counter() - inicio, 3)
+        try:
+            _guardar(perfil, perfilador, muestreador)
+        except Exception as e:
+            log_warning(logger, f"No se pudo guardar el perfil {perfil['id']}: {e}")
+
+
+def _guardar(perfil: Dict, perfilador: Optional[cProfile.Profile], muestreador: Optional[Muestreador]):
+    os.makedirs(db_config.PROFILING_DIR, exist_ok=True)
+    base = os.path.join(db_config.PROFILING_DIR, perfil['id'])
+
+    if perfilador:
+        # .prof se abre con pstats o snakeviz; el .txt es el top por tiempo acumulado
+        perfilador.dump_stats(f"{base}.prof")
+        texto = StringIO()
+        pstats.Stats(perfilador, stream=texto).sort_stats('cumulative').print_stats(FUNCIONES_REPORTE)
+        archivos = [f"{perfil['id']}.prof", f"{perfil['id']}.txt"]
+    else:
+        with open(f"{base}.folded", 'w', encoding='utf-8') as f:
+            f.write(muestreador.folded())
+        texto = StringIO(muestreador.resumen())
+        archivos = [f"{perfil['id']}.folded", f"{perfil['id']}.txt"]
+
+    with open(f"{base}.txt", 'w', encoding='utf-8') as f:
+        f.write(texto.getvalue())
+    perfil['archivos'] = archivos
+    with open(f"{base}.json", 'w', encoding='utf-8') as f:
+        json.dump(perfil, f, ensure_ascii=False, indent=2)
+
+    log_info(logger, f"Perfil guardado: {perfil['id']} ({perfil['segundos']:.1f}s)")
+    _aplicar_maximo()
+
+
+def _aplicar_maximo():
+    """Conserva los PROFILING_MAX perfiles más recientes"""
+    perfiles = listar()
+    for perfil in perfiles[db_config.PROFILING_MAX:]:
+        for nombre in perfil.get('archivos', []) + [f"{perfil['id']}.json"]:
+            try:
+                os.remove(os.path.join(db_config.PROFILING_DIR, nombre))
+            except OSError:
+                pass
+
+
+def listar() -> List[Dict]:
+    """Perfiles guardados, el más reciente primero"""
+    if not os.path.isdir(db_config.PROFILING_DIR):
+        return []
+
+    perfiles = []
+    for nombre in os.listdir(db_config.PROFILING_DIR):
+        if not nombre.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(db_config.PROFILING_DIR, nombre), encoding='utf-8') as f:
+                perfiles.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    perfiles.sort(key=lambda p: p.get('creado', ''), reverse=True)
+    return perfiles
@@ -0,0 +1,52 @@
+"""
+Eventos de progreso del procesamiento de facturas
+Los módulos emiten etapas; quien escucha (ej. el stream SSE de la API) las recibe al instante
+"""
+
+import time
+import contextvars
+from contextlib import contextmanager
+from typing import Callable, Dict
+
+# (callback, instante de inicio) del procesamiento que se está escuchando en este contexto
+_oyente = contextvars.ContextVar('oyente_progreso', default=None)
+
+
+@contextmanager
+def escuchar(callback: Callable[[Dict], None]):
+    """Registra un callback para los eventos emitidos dentro del bloque"""
+    token = _oyente.set((callback, time.monotonic()))
+    try:
+        yield
+    finally:
+        _oyente.reset(token)
+
+
+def contexto_etiquetado(**datos) -> contextvars.Context:
+    """Copia del contexto actual cuyos eventos llevan datos fijos (ej. parte=2), para correr en otro thread"""
+    contexto = contextvars.copy_context()
+    actual = contexto.get(_oyente)
+    if actual is not None:
+        callback, inicio = actual
+        contexto.run(_oyente.set, (lambda evento: callback({**evento, **datos}), inicio))
+    return contexto
+
+
+def emitir(etapa: str, mensaje: str = "", nivel: str = "info", **datos):
+    """Emite un evento de etapa (no hace nada si nadie escucha)"""
+    actual = _oyente.get()
+    if actual is None:
+        return
+
+    callback, inicio = actual
+    evento = {
+        'etapa': etapa,
+        'mensaje': mensaje,
+        'nivel': nivel,
+        't': round(time.monotonic() - inicio, 3),
+        **datos
+    }
+    try:
+        callback(evento)
+    except Exception:
+        pass  # El progreso nunca debe romper el procesamiento
@@ -0,0 +1,165 @@
+"""
+Context caching de las instrucciones de extracción
+Registra una vez el prompt estático (y ejemplos few-shot) en Gemini y lo referencia por handle
+"""
+
+import os
+import json
+import logging
+import threading
+import time
+from datetime import timedelta
+from typing import List, Optional
+import google.generativeai as genai
+from google.generativeai import caching
+import db_config
+from logging_config import log_info, log_success, log_warning, EMOJI
+
+logger = logging.getLogger(__name__)
+
+# Si la creación del caché falla, no reintentar en cada factura
+ESPERA_TRAS_FALLO = 15 * 60  # segundos
+# Renovar el caché un poco antes de que expire en el servidor
+MARGEN_RENOVACION = 60  # segundos
+# Mínimo de tokens que Gemini acepta en un caché explícito, por familia de modelo
+MINIMO_TOKENS_CACHE = {'flash': 1024, 'pro': 4096}
+MINIMO_TOKENS_DEFECTO = 4096
+# Estimación local de tokens; sólo se consulta count_tokens (red) si podría alcanzar el mínimo
+CARACTERES_POR_TOKEN = 4
+HOLGURA_ESTIMACION = 2
+
+
+def minimo_tokens_cache(model_name: str) -> int:
+    for familia, minimo in MINIMO_TOKENS_CACHE.items():
+        if f"-{familia}" in model_name:
+            return minimo
+    return MINIMO_TOKENS_DEFECTO
+
+
+def cargar_ejemplos_few_shot(directorio: str) -> List[str]:
+    """Lee ejemplos de extracción por proveedor (*.json) y los devuelve como texto"""
+    if not directorio or not os.path.isdir(directorio):
+        return []
+
+    ejemplos = []
+    for filename in sorted(os.listdir(directorio)):
+        if not filename.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directorio, filename), 'r', encoding='utf-8') as f:
+                ejemplo = json.load(f)
+        except Exception as e:
+            log_warning(logger, f"Ejemplo few-shot inválido ({filename}): {e}")
+            continue
+
+        proveedor = ejemplo.get('proveedor', filename)
+        texto = f"EJEMPLO DE EXTRACCIÓN CORRECTA - Proveedor: {proveedor}"
+        if ejemplo.get('notas'):
+            texto += f"\nNotas: {ejemplo['notas']}"
+        texto += "\n" + json.dumps(ejemplo.get('extraccion', {}), ensure_ascii=False, separators=(",", ":"))
+        ejemplos.append(texto)
+
+    if ejemplos:
+        log_info(logger, f"Cargados {len(ejemplos)} ejemplo(s) few-shot desde {directorio}")
+    return ejemplos
+
+
+class PromptCache:
+    """Modelo con instrucciones estáticas en caché de Gemini, con fallback local"""
+
+    def __init__(self, model_name: str, instrucciones: str, generation_config=None, ejemplos: Optional[List[str]] = None,
+                 usar_cache: Optional[bool] = None):
+        self.model_name = model_name
+        # Sin caché remoto (ej. en replay no hay red): siempre el modelo local
+        self.usar_cache = db_config.GEMINI_CONTEXT_CACHE if usar_cache is None else usar_cache
+        self.instrucciones = instrucciones
+        self.generation_config = generation_config
+        self.ejemplos = ejemplos or []
+
+        self._lock = threading.Lock()
+        self._modelo_cacheado = None
+        self._expira = 0.0
+        self._reintentar_desde = 0.0
+        self._creando = False
+
+        # Fallback: mismas instrucciones como system_instruction, enviadas en cada llamada
+        instruccion_local = "\n\n".join([instrucciones] + self.ejemplos)
+        self._modelo_local = genai.GenerativeModel(
+            model_name,
+            system_instruction=instruccion_local,
+            generation_config=generation_config
+        )
+
+        # Un prefijo por debajo del mínimo cacheable falla siempre: se descarta al arrancar
+        if self.usar_cache:
+            minimo = minimo_tokens_cache(model_name)
+            tokens = self._estimar_tokens()
+            if tokens * HOLGURA_ESTIMACION >= minimo:
+                tokens = self._contar_tokens()
+            if tokens < minimo:
+                log_info(logger, f"Prompt de extracción sin caché en {model_name}: {tokens} tokens (mínimo {minimo})")
+                self.usar_cache = False
+
+    def _estimar_tokens(self) -> int:
+        """Tokens del prefijo estático estimados por largo, sin red"""
+        return sum(len(parte) for parte in [self.instrucciones] + self.ejemplos) // CARACTERES_POR_TOKEN
+
+    def _contar_tokens(self) -> int:
+        """Tokens del prefijo estático (instrucciones + ejemplos); estimados si el conteo falla"""
+        try:
+            return genai.GenerativeModel(self.model_name).count_tokens([self.instrucciones] + self.ejemplos).total_tokens
+        except Exception as e:
+            log_warning(logger, f"No se pudieron contar los tokens del prompt ({e}), se estiman")
+            return self._estimar_tokens()
+
+    def modelo(self):
+        """Devuelve el modelo ligado al caché vigente, o el modelo local"""
+        if not self.usar_cache:
+            return self._modelo_local
+
+        with self._lock:
+            ahora = time.time()
+            if self._modelo_cacheado is not None and ahora < self._expira - MARGEN_RENOVACION:
+                return self._modelo_cacheado
+            if self._creando or ahora < self._reintentar_desde:
+                # Otro thread lo está creando (o falló hace poco): no se espera la red
+                vigente = self._modelo_cacheado is not None and ahora < self._expira
+                return self._modelo_cacheado if vigente else self._modelo_local
+            self._creando = True
+
+        try:
+            return self._crear_cache()
+        finally:
+            with self._lock:
+                self._creando = False
+
+    def _crear_cache(self):
+        """Registra instrucciones y ejemplos en Gemini (fuera del lock) y publica el modelo"""
+        ttl_min = db_config.GEMINI_CACHE_TTL_MIN
+        ahora = time.time()
+        try:
+            log_info(logger, f"{EMOJI['database']} Registrando prompt de extracción en caché de Gemini ({self.model_name}, TTL {ttl_min} min)")
+            cache = caching.CachedContent.create(
+                model=f"models/{self.model_name}",
+                display_name="facturas-extraccion",
+                system_instruction=self.instrucciones,
+                contents=self.ejemplos or None,
+                ttl=timedelta(minutes=ttl_min)
+            )
+            modelo = genai.GenerativeModel.from_cached_content(
+                cache,
+                generation_config=self.generation_config
+            )
+            with self._lock:
+                self._modelo_cacheado = modelo
+                self._expira = ahora + ttl_min * 60
+            log_success(logger, f"Prompt en caché: {cache.name}")
+            return modelo
+
+        except Exception as e:
+            # Ej: el prompt no alcanza el mínimo de tokens cacheables, o el modelo no lo soporta
+            log_warning(logger, f"Context caching no disponible, usando prompt local: {e}")
+            with self._lock:
+                self._modelo_cacheado = None
+                self._reintentar_desde = time.time() + ESPERA_TRAS_FALLO
+            return self._modelo_local
@@ -0,0 +1,508 @@
+"""
+Prueba de carga de la API (operadores concurrentes)
+Cada operador es un thread que repite acciones elegidas según una mezcla (subir, procesar,
+extraer, OC automática, historial) con una pausa entre acciones. La cantidad de operadores
+sube por escalones; por escalón y por endpoint se reportan latencias, errores y throughput,
+y el primer escalón en que la API se satura.
+
+Con --levantar arranca api.py tal como corre en producción (app.run con debug) contra los
+reemplazos offline: Gemini en replay, una copia de la réplica SQLite del ERP y una carpeta de
+datos temporal. Con --url se prueba un servidor ya levantado.
+
+Uso: python prueba_carga.py --levantar --corpus DIR [--escalones escalera|rampa|pico|1,2,4] [--duracion 30]
+     python prueba_carga.py --url http://localhost:5000 --corpus DIR --mezcla process=1,history=3
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import uuid
+import random
+import signal
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import db_config
+
+ENDPOINTS = ('upload', 'process', 'extract', 'process_oc_auto', 'history')
+EXTENSIONES = ('.pdf', '.png', '.jpg', '.jpeg')
+
+# Pesos por acción. 'operador': un día normal; 'cierre': fin de mes, mayormente carga de facturas
+MEZCLAS = {
+    'operador': {'upload': 15, 'process': 20, 'extract': 5, 'process_oc_auto': 5, 'history': 55},
+    'cierre': {'upload': 35, 'process': 40, 'extract': 5, 'process_oc_auto': 10, 'history': 10},
+    'consulta': {'upload': 2, 'process': 3, 'history': 95},
+}
+
+# Operadores por escalón. 'escalera': buscar el punto de saturación; 'pico': carga súbita y recuperación
+PERFILES = {
+    'escalera': [1, 2, 4, 8, 16, 32],
+    'rampa': [1, 2, 3, 4, 5, 6, 7, 8, 10, 12],
+    'pico': [2, 2, 16, 2],
+}
+
+# Saturación: el throughput crece menos que esto al sumar operadores, o empeoran errores/p95
+GANANCIA_MINIMA = 0.10
+MAX_ERRORES = 0.01
+FACTOR_P95 = 3.0
+P95_MINIMO_MS = 200  # Un p95 que crece menos que esto no se percibe
+
+
+def _percentil(ordenadas: List[float], p: float) -> Optional[float]:
+    """Percentil por rango más cercano (como en metrics)"""
+    if not ordenadas:
+        return None
+    return ordenadas[max(0, math.ceil(p * len(ordenadas)) - 1)]
+
+
+def parsear_mezcla(texto: str) -> Dict[str, float]:
+    """Nombre de una mezcla predefinida o 'process=3,history=5'"""
+    if texto in MEZCLAS:
+        return dict(MEZCLAS[texto])
+    mezcla = {}
+    for parte in texto.split(','):
+        endpoint, _, peso = parte.partition('=')
+        endpoint = endpoint.strip()
+        if endpoint not in ENDPOINTS:
+            raise ValueError(f"Endpoint desconocido en la mezcla: {endpoint}")
+        mezcla[endpoint] = float(peso)
+    if not any(mezcla.values()):
+        raise ValueError("La mezcla no tiene ningún peso positivo")
+    return mezcla
+
+
+def _multipart(nombre: str, contenido: bytes) -> Tuple[bytes, str]:
+    limite = uuid.uuid4().hex
+    cuerpo = (
+        f'--{limite}\r\nContent-Disposition: form-data; name="factura"; filename="{nombre}"\r\n'
+        f'Content-Type: application/octet-stream\r\n\r\n'
+    ).encode() + contenido + f'\r\n--{limite}--\r\n'.encode()
+    return cuerpo, f'multipart/form-data; boundary={limite}'
+
+
+def pedir(url: str, cuerpo: Optional[bytes] = None, tipo: Optional[str] = None,
+          timeout: float = 120) -> Tuple[Optional[int], Optional[Dict], Optional[str]]:
+    """(status, JSON de la respuesta, error); status None si no hubo respuesta"""
+    peticion = urllib.request.Request(url, data=cuerpo, headers={'Content-Type': tipo} if tipo else {})
+    try:
+        with urllib.request.urlopen(peticion, timeout=timeout) as respuesta:
+            status, texto = respuesta.status, respuesta.read()
+    except urllib.error.HTTPError as e:
+        status, texto = e.code, e.read()
+    except (urllib.error.URLError, OSError) as e:
+        motivo = getattr(e, 'reason', e)
+        return None, None, f"{type(motivo).__name__}: {motivo}"
+    try:
+        datos = json.loads(texto)
+    except ValueError:
+        datos = None
+    error = (datos or {}).get('error') if isinstance(datos, dict) else None
+    return status, datos, error or (None if status < 400 else f"HTTP {status}")
+
+
+class Operador(threading.Thread):
+    """Un usuario de la interfaz: sube facturas, las procesa y consulta el historial"""
+
+    def __init__(self, numero: int, prueba: 'PruebaCarga'):
+        super().__init__(name=f"operador-{numero}", daemon=True)
+        self.numero = numero
+        self.prueba = prueba
+        self.azar = random.Random(prueba.semilla * 1000 + numero)
+        self.pendientes = []  # Subidas todavía sin procesar
+        self.subidas = []
+
+    def run(self):
+        acciones, pesos = zip(*self.prueba.mezcla.items())
+        while self.prueba.activo(self.numero):
+            accion = self.azar.choices(acciones, pesos)[0]
+            getattr(self, f"_{accion}")()
+            if self.prueba.pensar:
+                self.prueba.detener.wait(self.azar.expovariate(1 / self.prueba.pensar))
+
+    def _archivo(self, pendiente: bool) -> Optional[str]:
+        """Una factura subida por este operador (sube una si no hay)"""
+        if pendiente and self.pendientes:
+            return self.pendientes.pop(0)
+        if not pendiente and self.subidas:
+            return self.azar.choice(self.subidas)
+        nombre = self._upload()
+        if nombre and pendiente:
+            self.pendientes.remove(nombre)
+        return nombre
+
+    def _upload(self) -> Optional[str]:
+        nombre, contenido = self.azar.choice(self.prueba.corpus)
+        # Bytes distintos en cada subida (las páginas no cambian): si no, la API devuelve el resultado previo
+        cuerpo, tipo = _multipart(nombre, contenido + f"\n% prueba_carga {uuid.uuid4().hex}\n".encode())
+        datos = self.prueba.llamar('upload', '/api/upload', cuerpo, tipo)
+        if not datos or 'factura' not in datos:
+            return None
+        self.pendientes.append(datos['factura'])
+        self.subidas = (self.subidas + [datos['factura']])[-20:]
+        return datos['factura']
+
+    def _post(self, endpoint: str, campo: str, pendiente: bool):
+        nombre = self._archivo(pendiente)
+        if nombre:
+            cuerpo = json.dumps({campo: nombre}).encode()
+            self.prueba.llamar(endpoint, f"/api/{endpoint}", cuerpo, 'application/json')
+
+    def _process(self):
+        self._post('process', 'factura_filename', True)
+
+    def _extract(self):
+        self._post('extract', 'factura_filename', False)
+
+    def _process_oc_auto(self):
+        self._post('process_oc_auto', 'oc_filename', False)
+
+    def _history(self):
+        consulta = self.azar.choice(['page=1', 'page=1', 'page=1', f"page={self.azar.randint(2, 5)}", 'page=1&estado=error'])
+        self.prueba.llamar('history', f"/api/history?{consulta}&page_size=50")
+
+
+class PruebaCarga:
+    """Escalones de operadores concurrentes contra la API y las muestras de cada request"""
+
+    def __init__(self, url: str, corpus: List[Tuple[str, bytes]], mezcla: Dict[str, float],
+                 pensar: float = 2.0, timeout: float = 120, semilla: int = 1):
+        self.url = url.rstrip('/')
+        self.corpus = corpus
+        self.mezcla = mezcla
+        self.pensar = pensar  # Pausa media entre acciones de un operador (segundos)
+        self.timeout = timeout
+        self.semilla = semilla
+        self.detener = threading.Event()
+        self.nivel = 0
+        self.escalon = 0
+        self.muestras = []  # (escalón, endpoint, segundos, 'ok' | 'rechazada' | 'error', respondió, motivo)
+        self._lock = threading.Lock()
+
+    def activo(self, numero: int) -> bool:
+        return not self.detener.is_set() and numero < self.nivel
+
+    def llamar(self, endpoint: str, ruta: str, cuerpo: Optional[bytes] = None,
+               tipo: Optional[str] = None) -> Optional[Dict]:
+        escalon = self.escalon
+        inicio = time.perf_counter()
+        status, datos, error = pedir(self.url + ruta, cuerpo, tipo, self.timeout)
+        segundos = time.perf_counter() - inicio
+
+        # Rechazada: 4xx o una factura que no se pudo procesar (ej. ya cargada en la BD)
+        if status is None or status >= 500:
+            estado = 'error'
+        elif status >= 400 or (isinstance(datos, dict) and datos.get('success') is False):
+            estado = 'rechazada'
+            errores = datos.get('errors') if isinstance(datos, dict) else None
+            error = error or (errores[0] if errores else None) or datos.get('message') or 'success: false'
+        else:
+            estado = 'ok'
+        with self._lock:
+            self.muestras.append((escalon, endpoint, segundos, estado, status is not None,
+                                  str(error)[:120] if error else None))
+        return datos
+
+    def preparar(self):
+        """Sube y procesa cada archivo del corpus una vez: arranca el sistema y verifica las grabaciones"""
+        for nombre, contenido in self.corpus:
+            cuerpo, tipo = _multipart(nombre, contenido)
+            status, datos, error = pedir(f"{self.url}/api/upload", cuerpo, tipo, self.timeout)
+            if status != 200:
+                raise RuntimeError(f"No se pudo subir {nombre}: {error}")
+            cuerpo = json.dumps({'factura_filename': datos['factura']}).encode()
+            status, datos, error = pedir(f"{self.url}/api/process", cuerpo, 'application/json', self.timeout)
+            if status != 200:
+                raise RuntimeError(f"No se pudo procesar {nombre}: {error}")
+            if not datos.get('success'):
+                print(f"  Aviso: {nombre} no se procesó bien ({datos.get('error')})")
+
+    def correr(self, escalones: List[int], duracion: float) -> List[Dict]:
+        operadores = {}
+        tiempos = []
+        try:
+            for i, nivel in enumerate(escalones):
+                self.escalon, self.nivel = i, nivel
+                for numero in range(nivel):
+                    if numero not in operadores or not operadores[numero].is_alive():
+                        operadores[numero] = Operador(numero, self)
+                        operadores[numero].start()
+                print(f"Escalón {i + 1}/{len(escalones)}: {nivel} operador(es) durante {duracion:.0f}s", flush=True)
+                inicio = time.perf_counter()
+                self.detener.wait(duracion)
+                tiempos.append(time.perf_counter() - inicio)
+        finally:
+            self.detener.set()
+            limite = time.monotonic() + self.timeout + 5
+            for operador in operadores.values():
+                operador.join(max(0, limite - time.monotonic()))
+        return [self._resumen(i, nivel, tiempos[i]) for i, nivel in enumerate(escalones[:len(tiempos)])]
+
+    def _resumen(self, escalon: int, nivel: int, segundos: float) -> Dict:
+        with self._lock:
+            propias = [m for m in self.muestras if m[0] == escalon]
+        por_endpoint = {}
+        for endpoint in ENDPOINTS:
+            muestras = [m for m in propias if m[1] == endpoint]
+            if not muestras:
+                continue
+            estados = Counter(m[3] for m in muestras)
+            # Latencia de las requests con respuesta (los timeouts sólo cuentan como error)
+            ordenadas = sorted(m[2] for m in muestras if m[4])
+            ms = lambda valor: round(valor * 1000, 1) if valor is not None else None
+            por_endpoint[endpoint] = {
+                'requests': len(muestras),
+                'ok': estados['ok'],
+                'rechazadas': estados['rechazada'],
+                'errores': estados['error'],
+                'tasa_error': round(estados['error'] / len(muestras), 4),
+                'por_segundo': round((estados['ok'] + estados['rechazada']) / segundos, 3),  # Respondidas sin error
+                'p50_ms': ms(_percentil(ordenadas, 0.50)),
+                'p95_ms': ms(_percentil(ordenadas, 0.95)),
+                'p99_ms': ms(_percentil(ordenadas, 0.99)),
+                'max_ms': ms(ordenadas[-1]) if ordenadas else None,
+                'motivos': dict(Counter(m[5] for m in muestras if m[5]).most_common(5)),
+            }
+        requests = sum(e['requests'] for e in por_endpoint.values())
+        return {
+            'escalon': escalon + 1,
+            'operadores': nivel,
+            'segundos': round(segundos, 1),
+            'requests': requests,
+            'por_segundo': round(sum(e['ok'] + e['rechazadas'] for e in por_endpoint.values()) / segundos, 3),
+            'tasa_error': round(sum(e['errores'] for e in por_endpoint.values()) / requests, 4) if requests else 0,
+            'endpoints': por_endpoint,
+        }
+
+
+def saturacion(escalones: List[Dict], max_errores: float = MAX_ERRORES, factor_p95: float = FACTOR_P95) -> Dict:
+    """Primer escalón saturado, global y por endpoint, y los operadores del escalón anterior"""
+    def punto(i: int, motivo: str) -> Dict:
+        return {
+            'escalon': escalones[i]['escalon'],
+            'operadores': escalones[i]['operadores'],
+            'soportados': escalones[i - 1]['operadores'] if i else 0,
+            'motivo': motivo,
+        }
+
+    resultado = {'global': None, 'endpoints': {}}
+    for i, actual in enumerate(escalones):
+        if actual['tasa_error'] > max_errores:
+            resultado['global'] = punto(i, f"errores {actual['tasa_error']:.1%}")
+            break
+        anterior = escalones[i - 1] if i else None
+        if anterior and actual['operadores'] > anterior['operadores'] and anterior['por_segundo']:
+            ganancia = actual['por_segundo'] / anterior['por_segundo'] - 1
+            if ganancia < GANANCIA_MINIMA:
+                resultado['global'] = punto(i, f"throughput {anterior['por_segundo']:.2f} -> "
+                                               f"{actual['por_segundo']:.2f} req/s ({ganancia:+.0%})")
+                break
+
+    for endpoint in ENDPOINTS:
+        base = next((e['endpoints'][endpoint]['p95_ms'] for e in escalones
+                     if endpoint in e['endpoints'] and e['endpoints'][endpoint]['p95_ms']), None)
+        for i, escalon in enumerate(escalones):
+            metricas = escalon['endpoints'].get(endpoint)
+            if not metricas:
+                continue
+            if metricas['tasa_error'] > max_errores:
+                resultado['endpoints'][endpoint] = punto(i, f"errores {metricas['tasa_error']:.1%}")
+                break
+            p95 = metricas['p95_ms']
+            if base and p95 and p95 > factor_p95 * base and p95 - base > P95_MINIMO_MS:
+                resultado['endpoints'][endpoint] = punto(i, f"p95 {base:,.0f} -> {p95:,.0f} ms")
+                break
+    return resultado
+
+
+def leer_corpus(carpeta: str, limite: int = 0) -> List[Tuple[str, bytes]]:
+    """(nombre, bytes) de los PDFs e imágenes de la carpeta, en orden"""
+    nombres = sorted(n for n in os.listdir(carpeta) if n.lower().endswith(EXTENSIONES))
+    nombres = nombres[:limite] if limite else nombres
+    corpus = []
+    for nombre in nombres:
+        with open(os.path.join(carpeta, nombre), 'rb') as f:
+            corpus.append((nombre, f.read()))
+    return corpus
+
+
+def _esperar_api(url: str, proceso: subprocess.Popen, log: str, espera: float = 60):
+    limite = time.monotonic() + espera
+    while time.monotonic() < limite:
+        if proceso.poll() is not None:
+            break
+        if pedir(f"{url}/api/health", timeout=2)[0] == 200:
+            return
+        time.sleep(0.5)
+    with open(log, encoding='utf-8', errors='replace') as f:
+        cola = f.read()[-3000:]
+    raise RuntimeError(f"La API no respondió en {url}:\n{cola}")
+
+
+def levantar(erp: str, puerto: int, temporal: str, latencia: str) -> subprocess.Popen:
+    """Arranca api.py contra Gemini en replay, una copia de la réplica del ERP y datos temporales"""
+    if not os.path.exists(erp):
+        raise FileNotFoundError(f"No existe la réplica del ERP {erp}: generarla con 'python erp_sintetico.py'")
+    copia = os.path.join(temporal, 'erp.sqlite3')
+    with sqlite3.connect(erp) as origen, sqlite3.connect(copia) as destino:
+        origen.backup(destino)
+
+    entorno = {
+        **os.environ,
+        'GEMINI_BACKEND': 'replay',
+        'GEMINI_REPLAY_LATENCIA': latencia,
+        'DB_BACKEND': 'sqlite',
+        'DB_SQLITE_PATH': copia,
+        'DATA_DIR': os.path.join(temporal, 'data'),
+        'API_PUERTO': str(puerto),
+        'RENDER_CACHE_DIR': os.path.join(temporal, 'render'),
+        'TRACING_DIR': os.path.join(temporal, 'traces'),
+        'DB_PLANES_DIR': os.path.join(temporal, 'query_plans'),
+        'PROFILING_DIR': os.path.join(temporal, 'profiles'),
+        'PYTHONUNBUFFERED': '1',
+    }
+    log = os.path.join(temporal, 'api.log')
+    # Grupo de procesos propio: con debug, el reloader de Flask corre la API en un proceso hijo
+    grupo = {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP} if sys.platform == 'win32' else {'start_new_session': True}
+    with open(log, 'w') as salida:
+        proceso = subprocess.Popen([sys.executable, 'api.py'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                   env=entorno, stdout=salida, stderr=subprocess.STDOUT, **grupo)
+    try:
+        _esperar_api(f"http://localhost:{puerto}", proceso, log)
+    except Exception:
+        bajar(proceso)
+        raise
+    return proceso
+
+
+def bajar(proceso: subprocess.Popen):
+    if proceso.poll() is not None:
+        return
+    if sys.platform == 'win32':
+        subprocess.run(['taskkill', '/T', '/F', '/PID', str(proceso.pid)], capture_output=True)
+    else:
+        os.killpg(proceso.pid, signal.SIGTERM)
+    try:
+        proceso.wait(10)
+    except subprocess.TimeoutExpired:
+        proceso.kill()
+
+
+def _imprimir(escalones: List[Dict], puntos: Dict):
+    fmt = lambda v: '-' if v is None else f"{v:,.0f}"
+    for e in escalones:
+        print(f"\nEscalón {e['escalon']}: {e['operadores']} operador(es), {e['requests']} requests, "
+              f"{e['por_segundo']:.2f} req/s, errores {e['tasa_error']:.1%}")
+        print(f"  {'endpoint':16} {'req':>6} {'ok':>6} {'rech':>5} {'err':>5} {'p50 ms':>8} {'p95 ms':>8} "
+              f"{'p99 ms':>8} {'max ms':>8}")
+        for nombre, m in e['endpoints'].items():
+            print(f"  {nombre:16} {m['requests']:>6} {m['ok']:>6} {m['rechazadas']:>5} {m['errores']:>5} "
+                  f"{fmt(m['p50_ms']):>8} {fmt(m['p95_ms']):>8} {fmt(m['p99_ms']):>8} {fmt(m['max_ms']):>8}")
+            for motivo, veces in m['motivos'].items():
+                print(f"      {veces:>5} x {motivo}")
+
+    print("\nSaturación:")
+    for nombre, p in [('global', puntos['global'])] + list(puntos['endpoints'].items()):
+        if p:
+            print(f"  {nombre:16} escalón {p['escalon']} ({p['operadores']} operadores): {p['motivo']}; "
+                  f"soporta {p['soportados']}")
+    if not puntos['global']:
+        print(f"  {'global':16} sin saturar hasta {max((e['operadores'] for e in escalones), default=0)} operadores")
+
+
+def main():
+    data = os.path.join(os.path.dirname(__file__), '..', 'data')
+    parser = argparse.ArgumentParser(description="Prueba de carga de la API con operadores concurrentes")
+    parser.add_argument('--url', help="API ya levantada (si no, usar --levantar)")
+    parser.add_argument('--levantar', action='store_true', help="Arranca api.py contra Gemini en replay y la réplica")
+    parser.add_argument('--erp', default=db_config.DB_SQLITE_PATH, help="Réplica del ERP (se usa una copia)")
+    parser.add_argument('--puerto', type=int, default=5055, help="Puerto de la API levantada")
+    parser.add_argument('--latencia', default='grabada', help="Latencia del replay (GEMINI_REPLAY_LATENCIA)")
+    parser.add_argument('--corpus', default=os.path.join(data, 'uploads'), help="Carpeta con PDFs/imágenes grabados")
+    parser.add_argument('--limite', type=int, default=0, help="Primeros N archivos del corpus (0 = todos)")
+    parser.add_argument('--mezcla', default='operador', help=f"{', '.join(MEZCLAS)} o 'process=3,history=5'")
+    parser.add_argument('--escalones', default='escalera',
+                        help=f"{', '.join(PERFILES)} u operadores de cada escalón (ej. 1,2,4,8)")
+    parser.add_argument('--duracion', type=float, default=30, help="Segundos por escalón")
+    parser.add_argument('--pensar', type=float, default=2.0, help="Pausa media entre acciones de un operador")
+    parser.add_argument('--timeout', type=float, default=120, help="Timeout de cada request (segundos)")
+    parser.add_argument('--max-errores', type=float, default=MAX_ERRORES, help="Tasa de error que se considera saturación")
+    parser.add_argument('--factor-p95', type=float, default=FACTOR_P95, help="p95 sobre el del primer escalón")
+    parser.add_argument('--semilla', type=int, default=1)
+    parser.add_argument('--etiqueta', default='')
+    parser.add_argument('--salida', default=db_config.BENCHMARK_DIR)
+    args = parser.parse_args()
+
+    if bool(args.url) == args.levantar:
+        parser.error("Indicar --url o --levantar")
+    try:
+        mezcla = parsear_mezcla(args.mezcla)
+        escalones = PERFILES.get(args.escalones) or [int(n) for n in args.escalones.split(',') if n.strip()]
+    except ValueError as e:
+        parser.error(str(e))
+    corpus = leer_corpus(args.corpus, args.limite)
+    if not corpus:
+        parser.error(f"No hay PDFs ni imágenes en {args.corpus}")
+
+    temporal = tempfile.mkdtemp(prefix='prueba_carga_')
+    proceso = None
+    try:
+        url = args.url
+        if args.levantar:
+            print(f"Levantando la API en el puerto {args.puerto}...", flush=True)
+            proceso = levantar(args.erp, args.puerto, temporal, args.latencia)
+            url = f"http://localhost:{args.puerto}"
+        prueba = PruebaCarga(url, corpus, mezcla, args.pensar, args.timeout, args.semilla)
+        print(f"Preparando ({len(corpus)} archivo(s))...", flush=True)
+        prueba.preparar()
+        inicio = time.perf_counter()
+        resultados = prueba.correr(escalones, args.duracion)
+        duracion = time.perf_counter() - inicio
+    except (FileNotFoundError, RuntimeError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    finally:
+        if proceso:
+            bajar(proceso)
+        shutil.rmtree(temporal, ignore_errors=True)
+
+    puntos = saturacion(resultados, args.max_errores, args.factor_p95)
+    creado = datetime.now()
+    resultado = {
+        'id': f"carga_{creado.strftime('%Y%m%d_%H%M%S')}{'_' + args.etiqueta if args.etiqueta else ''}",
+        'etiqueta': args.etiqueta,
+        'creado': creado.isoformat(timespec='seconds'),
+        'config': {
+            'url': url if args.url else 'levantada (replay + réplica SQLite)',
+            'latencia_replay': args.latencia if args.levantar else None,
+            'mezcla': mezcla,
+            'escalones': escalones,
+            'duracion': args.duracion,
+            'pensar': args.pensar,
+            'timeout': args.timeout,
+            'corpus': len(corpus),
+        },
+        'segundos': round(duracion, 1),
+        'escalones': resultados,
+        'saturacion': puntos,
+    }
+    os.makedirs(args.salida, exist_ok=True)
+    ruta = os.path.join(args.salida, f"{resultado['id']}.json")
+    with open(ruta, 'w', encoding='utf-8') as f:
+        json.dump(resultado, f, ensure_ascii=False, indent=2)
+
+    _imprimir(resultados, puntos)
+    print(f"\nResultado: {ruta}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Renderizado de PDFs en un pool de procesos
+Las páginas se rasterizan y codifican a PNG fuera de los threads de Flask (sin competir por el GIL)
+y se entregan como archivos: Gemini los envía tal cual, sin volver a codificarlos
+"""
+
+import io
+import os
+import time
+import atexit
+import hashlib
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List
+import fitz  # PyMuPDF
+from PIL import Image
+import db_config
+from logging_config import log_warning, log_info
+
+logger = logging.getLogger(__name__)
+
+ZOOM = 2  # Matriz 2x: ~144 dpi, suficiente para leer importes
+
+_pool = None
+_lock_pool = threading.Lock()
+_ultima_poda = 0.0
+
+
+def _renderizar_pagina(pdf_path: str, indice: int, zoom: float, destino: str) -> str:
+    """(Proceso del pool) Renderiza una página a PNG en destino"""
+    if os.path.exists(destino):
+        return destino
+    with fitz.open(pdf_path) as doc:
+        pix = doc[indice].get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+    temporal = f"{destino}.{os.getpid()}.tmp"
+    pix.save(temporal, output='png')
+    os.replace(temporal, destino)
+    return destino
+
+
+def _obtener_pool():
+    global _pool
+    with _lock_pool:
+        if _pool is None:
+            procesos = db_config.RENDER_PROCESOS or os.cpu_count() or 1
+            # spawn: hacer fork de un proceso con threads de Flask puede heredar locks tomados
+            _pool = ProcessPoolExecutor(max_workers=procesos, mp_context=multiprocessing.get_context('spawn'))
+            atexit.register(_pool.shutdown, wait=False, cancel_futures=True)
+            log_info(logger, f"Pool de renderizado iniciado: {procesos} proceso(s)")
+        return _pool
+
+
+def _descartar_pool():
+    global _pool
+    with _lock_pool:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def _podar_cache(carpeta: str):
+    """Borra páginas renderizadas hace más de RENDER_CACHE_HORAS (como mucho cada 10 minutos)"""
+    global _ultima_poda
+    ahora = time.time()
+    if ahora - _ultima_poda < 600:
+        return
+    _ultima_poda = ahora
+
+    limite = ahora - db_config.RENDER_CACHE_HORAS * 3600
+    with os.scandir(carpeta) as entradas:
+        for entrada in entradas:
+            try:
+                if entrada.is_file() and entrada.stat().st_mtime < limite:
+                    os.remove(entrada.path)
+            except OSError:
+                pass
+
+
+def _clave(pdf_path: str, zoom: float) -> str:
+    """Identifica el PDF por ruta, tamaño y fecha de modificación (las páginas ya renderizadas se reutilizan)"""
+    estado = os.stat(pdf_path)
+    base = f"{os.path.abspath(pdf_path)}|{estado.st_size}|{estado.st_mtime_ns}|{zoom}"
+    return hashlib.sha1(base.encode()).hexdigest()[:16]
+
+
+def renderizar_pdf(pdf_path: str, zoom: float = ZOOM, doc=None) -> List[Image.Image]:
+    """
+    Páginas del PDF como imágenes PIL respaldadas por archivos PNG.
+    RENDER_PROCESOS: 0 = un proceso por CPU; < 0 renderiza en el thread actual, en memoria.
+    doc: el PDF ya abierto con fitz, si quien llama lo tiene (no se vuelve a abrir)
+    """
+    if doc is None:
+        with fitz.open(pdf_path) as doc:
+            return renderizar_pdf(pdf_path, zoom, doc)
+
+    paginas = len(doc)
+    if db_config.RENDER_PROCESOS < 0:
+        return [_cargar(_a_png_en_memoria(page, zoom)) for page in doc]
+
+    carpeta = db_config.RENDER_CACHE_DIR
+    os.makedirs(carpeta, exist_ok=True)
+    _podar_cache(carpeta)
+
+    clave = _clave(pdf_path, zoom)
+    destinos = [os.path.join(carpeta, f"{clave}_{i + 1:03d}.png") for i in range(paginas)]
+
+    try:
+        pool = _obtener_pool()
+        futuros = [pool.submit(_renderizar_pagina, pdf_path, i, zoom, destino) for i, destino in enumerate(destinos)]
+        rutas = [futuro.result() for futuro in futuros]
+    except (BrokenProcessPool, RuntimeError, OSError) as e:
+        # Pool caído o que no pudo arrancar (sin fds/memoria para crear procesos, intérprete cerrándose)
+        log_warning(logger, f"Pool de renderizado no disponible ({e}): se renderiza en este proceso")
+        _descartar_pool()
+        rutas = [_renderizar_pagina(pdf_path, i, zoom, destino) for i, destino in enumerate(destinos)]
+
+    return [_cargar(ruta) for ruta in rutas]
+
+
+def _cargar(fuente) -> Image.Image:
+    """Decodifica la imagen y cierra el archivo (Image.open solo deja el descriptor abierto hasta leer los píxeles)"""
+    with Image.open(fuente) as imagen:
+        imagen.load()
+    return imagen
+
+
+def _a_png_en_memoria(page, zoom: float) -> io.BytesIO:
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+    return io.BytesIO(pix.tobytes("png"))
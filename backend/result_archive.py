@@ -0,0 +1,230 @@
+"""
+Archivo de resultados procesados
+IDs únicos, JSON compacto comprimido (gzip por registro), carpetas por mes y retención configurable
+
+Mantenimiento explícito: python result_archive.py [--compactar] [--retencion DIAS]
+"""
+
+import os
+import re
+import gzip
+import json
+import argparse
+import time
+import uuid
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, Optional, Tuple
+import db_config
+from logging_config import log_info, log_success, log_error, log_warning, EMOJI
+
+logger = logging.getLogger(__name__)
+
+# result_YYYYmmdd_HHMMSS[_<hex>].json[.gz] (los legados no tienen sufijo ni .gz)
+NOMBRE_VALIDO = re.compile(r'^result_(\d{8})_\d{6}(_[0-9a-f]+)?\.json(\.gz)?$')
+
+
+def _timestamp(filename: str) -> Optional[datetime]:
+    try:
+        return datetime.strptime(filename[len('result_'):len('result_') + 15], '%Y%m%d_%H%M%S')
+    except ValueError:
+        return None
+
+
+class ResultArchive:
+    """
+    Guarda y lee resultados en <carpeta>/<YYYYmm>/result_<timestamp>_<id>.json.gz.
+    Mantiene sincronizado el índice del historial (altas, renombres y bajas).
+    """
+
+    def __init__(self, folder: str, indice=None):
+        self.folder = folder
+        self.indice = indice
+        self._lock_mantenimiento = threading.Lock()
+        self._hilo_mantenimiento = None
+        os.makedirs(folder, exist_ok=True)
+
+    # ------------------------------------------------------------------
+    # Escritura / lectura
+    # ------------------------------------------------------------------
+
+    def guardar(self, result: Dict, sha256: Optional[str] = None) -> str:
+        """
+        Guarda el resultado comprimido y devuelve su nombre (único aunque terminen en el mismo segundo).
+        sha256: hash del archivo de la factura, para reconocer re-subidas (queda también en el
+        registro, así el índice se puede reconstruir desde los archivos sin perderlo).
+        """
+        if sha256:
+            result = {**result, 'sha256': sha256}
+        ahora = datetime.now()
+        filename = f"result_{ahora.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:12]}.json.gz"
+        carpeta = os.path.join(self.folder, ahora.strftime('%Y%m'))
+        os.makedirs(carpeta, exist_ok=True)
+
+        ruta = os.path.join(carpeta, filename)
+        temporal = f"{ruta}.tmp"
+        with gzip.open(temporal, 'wt', encoding='utf-8', compresslevel=6) as f:
+            json.dump(result, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(temporal, ruta)  # Nunca queda un archivo a medio escribir
+
+        if self.indice is not None:
+            self.indice.registrar(filename, result, sha256)
+        return filename
+
+    def leer(self, filename: str) -> Optional[Dict]:
+        """Lee un resultado (comprimido o legado). None si no existe o el nombre no es válido"""
+        ruta = self._ruta(filename)
+        if ruta is None:
+            return None
+        return self._cargar(ruta)
+
+    def _ruta(self, filename: str) -> Optional[str]:
+        """Ubica el archivo: carpeta del mes, raíz (legados) o versión ya compactada"""
+        filename = os.path.basename(filename)
+        match = NOMBRE_VALIDO.match(filename)
+        if not match:
+            return None
+
+        nombres = [filename] if filename.endswith('.gz') else [filename, f"{filename}.gz"]
+        carpetas = [os.path.join(self.folder, match.group(1)[:6]), self.folder]
+        for carpeta in carpetas:
+            for nombre in nombres:
+                ruta = os.path.join(carpeta, nombre)
+                if os.path.exists(ruta):
+                    return ruta
+        return None
+
+    @staticmethod
+    def _cargar(ruta: str) -> Dict:
+        if ruta.endswith('.gz'):
+            with gzip.open(ruta, 'rt', encoding='utf-8') as f:
+                return json.load(f)
+        with open(ruta, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _recorrer(self) -> Iterator[Tuple[str, str]]:
+        """(nombre, ruta) de todos los resultados: raíz (legados) y carpetas por mes"""
+        with os.scandir(self.folder) as entradas:
+            for entrada in entradas:
+                if entrada.is_dir() and entrada.name.isdigit():
+                    with os.scandir(entrada.path) as archivos:
+                        for archivo in archivos:
+                            if NOMBRE_VALIDO.match(archivo.name):
+                                yield archivo.name, archivo.path
+                elif entrada.is_file() and NOMBRE_VALIDO.match(entrada.name):
+                    yield entrada.name, entrada.path
+
+    # ------------------------------------------------------------------
+    # Mantenimiento: índice, compactación y retención
+    # ------------------------------------------------------------------
+
+    def sincronizar_indice(self):
+        """Indexa los resultados que todavía no están en el índice"""
+        if self.indice is None:
+            return
+        rutas = dict(self._recorrer())
+        self.indice.sincronizar(rutas, self._cargar)
+
+    def compactar(self) -> int:
+        """Convierte los result_*.json legados (indent=2) a .json.gz compacto en su carpeta del mes"""
+        compactados = 0
+        for nombre, ruta in list(self._recorrer()):
+            if nombre.endswith('.gz'):
+                continue
+            try:
+                data = self._cargar(ruta)
+                momento = _timestamp(nombre) or datetime.fromtimestamp(os.path.getmtime(ruta))
+                carpeta = os.path.join(self.folder, momento.strftime('%Y%m'))
+                os.makedirs(carpeta, exist_ok=True)
+
+                nuevo = f"{nombre}.gz"
+                destino = os.path.join(carpeta, nuevo)
+                with gzip.open(f"{destino}.tmp", 'wt', encoding='utf-8', compresslevel=6) as f:
+                    json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+                os.replace(f"{destino}.tmp", destino)
+                os.remove(ruta)
+
+                if self.indice is not None:
+                    self.indice.renombrar(nombre, nuevo)
+                compactados += 1
+            except Exception as e:
+                log_warning(logger, f"No se pudo compactar {nombre}: {e}")
+
+        if compactados:
+            log_success(logger, f"{compactados} resultado(s) legados compactados")
+        return compactados
+
+    def aplicar_retencion(self, dias: int) -> int:
+        """Elimina resultados más viejos que `dias` (0 = no elimina nada)"""
+        if dias <= 0:
+            return 0
+
+        limite = datetime.now() - timedelta(days=dias)
+        eliminados = []
+        for nombre, ruta in list(self._recorrer()):
+            momento = _timestamp(nombre)
+            if momento is not None and momento < limite:
+                try:
+                    os.remove(ruta)
+                    eliminados.append(nombre)
+                except OSError as e:
+                    log_warning(logger, f"No se pudo eliminar {nombre}: {e}")
+
+        # Carpetas de meses que quedaron vacías
+        with os.scandir(self.folder) as entradas:
+            for entrada in entradas:
+                if entrada.is_dir() and entrada.name.isdigit() and not os.listdir(entrada.path):
+                    os.rmdir(entrada.path)
+
+        if eliminados:
+            if self.indice is not None:
+                self.indice.eliminar(eliminados)
+            log_info(logger, f"{EMOJI['database']} Retención: {len(eliminados)} resultado(s) de más de {dias} días eliminados")
+        return len(eliminados)
+
+    def mantener(self, compactar: bool = None, retencion_dias: int = None):
+        """Índice al día; compactación de legados y retención sólo si están habilitadas (opt-in)"""
+        compactar = db_config.RESULT_COMPACTAR_LEGADOS if compactar is None else compactar
+        retencion_dias = db_config.RESULT_RETENTION_DAYS if retencion_dias is None else retencion_dias
+        with self._lock_mantenimiento:
+            try:
+                if compactar:
+                    self.compactar()
+                self.aplicar_retencion(retencion_dias)
+                self.sincronizar_indice()
+            except Exception as e:
+                log_error(logger, f"Error en mantenimiento del archivo de resultados: {e}")
+
+    def iniciar_mantenimiento(self):
+        """Thread de fondo: mantenimiento al arrancar y después cada RESULT_MANTENIMIENTO_HORAS (fuera de los requests)"""
+        if self._hilo_mantenimiento is not None:
+            return
+        self._hilo_mantenimiento = threading.Thread(target=self._mantener_periodicamente,
+                                                    name="mantenimiento-resultados", daemon=True)
+        self._hilo_mantenimiento.start()
+
+    def _mantener_periodicamente(self):
+        while True:
+            self.mantener()
+            time.sleep(max(60.0, db_config.RESULT_MANTENIMIENTO_HORAS * 3600))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mantenimiento del archivo de resultados (índice, compactación, retención)")
+    parser.add_argument('--carpeta-data', default=db_config.DATA_DIR, help="Carpeta con processed/ y resultados.sqlite3")
+    parser.add_argument('--compactar', action='store_true', help="Convierte los result_*.json legados a .json.gz")
+    parser.add_argument('--retencion', type=int, default=0, metavar='DIAS',
+                        help="Elimina los resultados más viejos que DIAS (0 = no elimina nada)")
+    args = parser.parse_args()
+
+    from result_index import ResultIndex
+    indice = ResultIndex(os.path.join(args.carpeta_data, 'resultados.sqlite3'))
+    archivo = ResultArchive(os.path.join(args.carpeta_data, 'processed'), indice)
+    archivo.mantener(compactar=args.compactar, retencion_dias=args.retencion)
+
+
+if __name__ == "__main__":
+    from logging_config import setup_logging
+    setup_logging()
+    main()
@@ -0,0 +1,470 @@
+"""
+Índice SQLite de resultados procesados
+Evita abrir todos los result_*.json en cada consulta del historial
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+from perceptual_hash import IndiceHuellas
+from cuit import normalizar_cuit
+from logging_config import log_info, log_success, log_error, log_warning, EMOJI
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS resultados (
+        filename            TEXT PRIMARY KEY,
+        timestamp           TEXT NOT NULL,      -- YYYYmmdd_HHMMSS (como en el nombre del archivo)
+        procesado_en        TEXT NOT NULL,      -- ISO, para filtrar por fecha
+        success             INTEGER NOT NULL,
+        proveedor           TEXT,
+        cuit                TEXT,
+        tipo_comprobante    TEXT,
+        punto_emision       TEXT,
+        numero_comprobante  TEXT,
+        fecha_emision       TEXT,
+        importe_total       REAL,
+        error_message       TEXT,
+        preview             TEXT,               -- JSON del bloque cabecera.factura
+        sha256              TEXT,               -- Hash del archivo de la factura (dedup de uploads)
+        huella              TEXT                -- pHash de la primera página (re-escaneos)
+    );
+    CREATE INDEX IF NOT EXISTS idx_resultados_orden ON resultados (procesado_en DESC, filename DESC);
+    CREATE INDEX IF NOT EXISTS idx_resultados_cuit ON resultados (cuit, procesado_en DESC);
+    CREATE INDEX IF NOT EXISTS idx_resultados_success ON resultados (success, procesado_en DESC);
+
+    -- Una fila por llamada a Gemini de cada resultado (result['consumo_gemini'])
+    CREATE TABLE IF NOT EXISTS consumo_gemini (
+        filename            TEXT NOT NULL,
+        orden               INTEGER NOT NULL,   -- Posición de la llamada dentro del resultado
+        procesado_en        TEXT NOT NULL,
+        cuit                TEXT,
+        proveedor           TEXT,
+        modelo              TEXT,
+        proposito           TEXT,               -- extraccion | correccion | conciliacion
+        imagenes            INTEGER,
+        bytes_imagenes      INTEGER,
+        caracteres_prompt   INTEGER,
+        tokens_entrada      INTEGER,
+        tokens_salida       INTEGER,
+        tokens_cache        INTEGER,
+        tokens_total        INTEGER,
+        segundos            REAL,
+        intentos            INTEGER,
+        ok                  INTEGER,
+        PRIMARY KEY (filename, orden)
+    );
+    CREATE INDEX IF NOT EXISTS idx_consumo_procesado ON consumo_gemini (procesado_en);
+"""
+
+# Columnas agregadas después de la primera versión del índice
+MIGRACIONES = {
+    'sha256': "ALTER TABLE resultados ADD COLUMN sha256 TEXT",
+    'huella': "ALTER TABLE resultados ADD COLUMN huella TEXT",
+}
+
+PAGE_SIZE_MAX = 200
+TOTALES_MAX = 256  # Conteos del historial en caché (por combinación de filtros)
+
+# Agrupaciones del reporte de consumo de Gemini
+GRUPOS_CONSUMO = {
+    'dia': "substr(procesado_en, 1, 10)",
+    'proveedor': "cuit",
+    'modelo': "modelo",
+    'proposito': "proposito",
+}
+AGREGADOS_CONSUMO = """
+    COUNT(DISTINCT filename) AS facturas,
+    COUNT(*) AS llamadas,
+    SUM(1 - ok) AS errores,
+    SUM(intentos) - COUNT(*) AS reintentos,
+    SUM(imagenes) AS imagenes,
+    SUM(bytes_imagenes) AS bytes_imagenes,
+    SUM(caracteres_prompt) AS caracteres_prompt,
+    SUM(tokens_entrada) AS tokens_entrada,
+    SUM(tokens_salida) AS tokens_salida,
+    SUM(tokens_cache) AS tokens_cache,
+    SUM(tokens_total) AS tokens_total,
+    SUM(segundos) AS segundos,
+    MAX(segundos) AS segundos_max
+"""
+COLUMNAS_LLAMADA = ('modelo', 'proposito', 'imagenes', 'bytes_imagenes', 'caracteres_prompt',
+                    'tokens_entrada', 'tokens_salida', 'tokens_cache', 'tokens_total', 'segundos', 'intentos')
+
+
+def _cuit(valor) -> Optional[str]:
+    """CUIT como se guarda y se busca en el índice: sin guiones ni espacios (None si no hay)"""
+    return normalizar_cuit(valor) or None
+
+
+def _filtro_proveedor(proveedor: str) -> Tuple[str, List]:
+    """Condición por CUIT (en cualquier formato) o por nombre parcial"""
+    cuit = normalizar_cuit(proveedor)
+    if len(cuit) == 11 and cuit.isdigit():
+        return "cuit = ?", [cuit]
+    return "proveedor LIKE ?", [f"%{proveedor}%"]
+
+
+def _timestamp_de(filename: str) -> str:
+    """'result_20251128_103600_<id>.json.gz' -> '20251128_103600'"""
+    return filename.replace('result_', '').split('.')[0][:15]
+
+
+def _resumen(filename: str, data: Dict, sha256: Optional[str] = None) -> Dict:
+    """Proyección de un resultado a la fila del índice"""
+    # Navegación segura para evitar errores con None
+    cabecera = (data.get('extraction') or {}).get('cabecera') or {}
+    factura = cabecera.get('factura') if isinstance(cabecera.get('factura'), dict) else {}
+    proveedor = cabecera.get('proveedor') if isinstance(cabecera.get('proveedor'), dict) else {}
+    errors = data.get('errors') or []
+
+    timestamp = _timestamp_de(filename)
+    try:
+        procesado_en = datetime.strptime(timestamp, '%Y%m%d_%H%M%S').isoformat()
+    except ValueError:
+        procesado_en = datetime.now().isoformat(timespec='seconds')
+
+    return {
+        'filename': filename,
+        'timestamp': timestamp,
+        'procesado_en': procesado_en,
+        'success': 1 if data.get('success') else 0,
+        'proveedor': proveedor.get('nombre'),
+        'cuit': _cuit(proveedor.get('cuit')),
+        'tipo_comprobante': factura.get('tipo_comprobante'),
+        'punto_emision': factura.get('punto_emision'),
+        'numero_comprobante': factura.get('numero_comprobante'),
+        'fecha_emision': factura.get('fecha_emision'),
+        'importe_total': factura.get('importe_total'),
+        'error_message': errors[0] if errors else None,
+        'preview': json.dumps(factura, ensure_ascii=False),
+        'sha256': sha256 or data.get('sha256'),
+        'huella': data.get('huella')
+    }
+
+
+def _llamadas(fila: Dict, data: Dict) -> List[Tuple]:
+    """Filas de consumo_gemini de un resultado (ninguna si es anterior al registro de consumo)"""
+    llamadas = (data.get('consumo_gemini') or {}).get('llamadas') or []
+    return [
+        (fila['filename'], orden, fila['procesado_en'], fila['cuit'], fila['proveedor'],
+         *(llamada.get(c) for c in COLUMNAS_LLAMADA), 1 if llamada.get('ok') else 0)
+        for orden, llamada in enumerate(llamadas)
+    ]
+
+
+class ResultIndex:
+    """Índice de resultados con paginación y filtros"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._huellas = None  # IndiceHuellas de resultados exitosos (se carga al primer uso)
+        self._totales = {}  # (where, params) -> COUNT(*); se vacía con cada escritura
+
+        with self._conectar() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            columnas = {row['name'] for row in conn.execute("PRAGMA table_info(resultados)")}
+            for columna, ddl in MIGRACIONES.items():
+                if columna not in columnas:
+                    conn.execute(ddl)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_resultados_sha256 ON resultados (sha256, success)")
+            conn.execute("DROP INDEX IF EXISTS idx_resultados_procesado")  # Reemplazado por idx_resultados_orden
+            self._normalizar_cuits(conn)
+
+    @staticmethod
+    def _normalizar_cuits(conn: sqlite3.Connection):
+        """CUITs indexados antes de guardarlos normalizados ('30-54340071-3' -> '30543400713')"""
+        conn.create_function('normalizar_cuit', 1, _cuit, deterministic=True)
+        for tabla in ('resultados', 'consumo_gemini'):
+            conn.execute(f"UPDATE {tabla} SET cuit = normalizar_cuit(cuit) WHERE cuit GLOB '*[^0-9]*' OR cuit = ''")
+
+    @contextmanager
+    def _conectar(self):
+        """Conexión corta por operación (commit al salir, siempre se cierra)"""
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def registrar(self, filename: str, data: Dict, sha256: Optional[str] = None, reemplazar: bool = True) -> bool:
+        """
+        Agrega (o actualiza) un resultado en el índice; un sha256 o huella ya guardados no se pierden.
+        reemplazar=False: si el resultado ya está indexado no se toca (False)
+        """
+        fila = _resumen(filename, data, sha256)
+        columnas = ', '.join(fila)
+        marcadores = ', '.join('?' for _ in fila)
+        if reemplazar:
+            actualizar = ', '.join(
+                f"{c} = COALESCE(excluded.{c}, {c})" if c in ('sha256', 'huella') else f"{c} = excluded.{c}"
+                for c in fila if c != 'filename'
+            )
+            conflicto = f"ON CONFLICT (filename) DO UPDATE SET {actualizar}"
+        else:
+            conflicto = "ON CONFLICT (filename) DO NOTHING"
+        llamadas = _llamadas(fila, data)
+        with self._lock, self._conectar() as conn:
+            insertada = conn.execute(
+                f"INSERT INTO resultados ({columnas}) VALUES ({marcadores}) {conflicto}", tuple(fila.values())
+            ).rowcount > 0
+            if not insertada:
+                return False
+            conn.execute("DELETE FROM consumo_gemini WHERE filename = ?", (filename,))
+            if llamadas:
+                conn.executemany(
+                    f"INSERT INTO consumo_gemini VALUES ({', '.join('?' for _ in llamadas[0])})", llamadas
+                )
+            self._totales.clear()
+
+        if self._huellas is not None and fila['success'] and fila['huella']:
+            self._huellas.agregar(filename, fila['huella'])
+        return True
+
+    def buscar_exitoso_por_hash(self, sha256: str) -> Optional[str]:
+        """Último resultado exitoso de un archivo con ese hash (None si nunca se procesó bien)"""
+        with self._conectar() as conn:
+            fila = conn.execute(
+                """
+                SELECT filename FROM resultados
+                WHERE sha256 = ? AND success = 1
+                ORDER BY procesado_en DESC, filename DESC
+                LIMIT 1
+                """,
+                (sha256,)
+            ).fetchone()
+        return fila['filename'] if fila else None
+
+    def exitosos_con_hash(self) -> List[Tuple[str, str]]:
+        """(filename, sha256) de los resultados exitosos de archivos subidos por contenido"""
+        with self._conectar() as conn:
+            return [
+                (fila['filename'], fila['sha256'])
+                for fila in conn.execute("SELECT filename, sha256 FROM resultados WHERE success = 1 AND sha256 IS NOT NULL")
+            ]
+
+    def exitosos_sin_hash(self) -> int:
+        """Resultados exitosos sin sha256 (anteriores a las subidas por contenido)"""
+        with self._conectar() as conn:
+            return conn.execute("SELECT COUNT(*) FROM resultados WHERE success = 1 AND sha256 IS NULL").fetchone()[0]
+
+    def proveedores_exitosos(self) -> List[Tuple[str, str]]:
+        """(cuit, proveedor) distintos de los resultados exitosos (el nombre más reciente por CUIT)"""
+        with self._conectar() as conn:
+            return [
+                (fila['cuit'], fila['proveedor'])
+                for fila in conn.execute(
+                    """
+                    SELECT cuit, proveedor, MAX(procesado_en) FROM resultados
+                    WHERE success = 1 AND cuit IS NOT NULL AND cuit != ''
+                    GROUP BY cuit
+                    """
+                )
+            ]
+
+    def buscar_similar(self, huella: str, distancia_max: int) -> Optional[Tuple[str, int, Tuple]]:
+        """
+        (filename, distancia, comprobante) del resultado exitoso con la huella más parecida, si está
+        dentro de distancia_max. comprobante: (cuit, punto_emision, numero_comprobante) de ese resultado
+        """
+        if self._huellas is None:
+            huellas = IndiceHuellas()
+            with self._conectar() as conn:
+                huellas.cargar(
+                    (fila['filename'], fila['huella'])
+                    for fila in conn.execute("SELECT filename, huella FROM resultados WHERE success = 1 AND huella IS NOT NULL")
+                )
+            self._huellas = huellas
+
+        cercano = self._huellas.mas_cercano(huella)
+        if cercano is None or cercano[1] > distancia_max:
+            return None
+        with self._conectar() as conn:
+            fila = conn.execute(
+                "SELECT cuit, punto_emision, numero_comprobante FROM resultados WHERE filename = ?", (cercano[0],)
+            ).fetchone()
+        return cercano[0], cercano[1], tuple(fila) if fila else (None, None, None)
+
+    def renombrar(self, anterior: str, nuevo: str):
+        """Actualiza el nombre de un resultado (ej. al compactarlo)"""
+        with self._lock, self._conectar() as conn:
+            conn.execute("UPDATE resultados SET filename = ? WHERE filename = ?", (nuevo, anterior))
+            conn.execute("UPDATE consumo_gemini SET filename = ? WHERE filename = ?", (nuevo, anterior))
+        self._huellas = None
+
+    def eliminar(self, filenames: List[str]):
+        """Quita resultados del índice (ej. por retención)"""
+        with self._lock, self._conectar() as conn:
+            conn.executemany("DELETE FROM resultados WHERE filename = ?", [(f,) for f in filenames])
+            conn.executemany("DELETE FROM consumo_gemini WHERE filename = ?", [(f,) for f in filenames])
+            self._totales.clear()
+        if self._huellas is not None:
+            self._huellas.quitar(filenames)
+
+    def sincronizar(self, rutas: Dict[str, str], cargar: Callable[[str], Dict]):
+        """
+        Indexa los resultados que todavía no están en el índice (migración inicial)
+        rutas: {filename: ruta}. cargar: lee un resultado desde su ruta.
+        """
+        try:
+            with self._conectar() as conn:
+                indexados = {row[0] for row in conn.execute("SELECT filename FROM resultados")}
+
+            pendientes = [f for f in rutas if f not in indexados]
+            if not pendientes:
+                return
+
+            log_info(logger, f"{EMOJI['database']} Indexando {len(pendientes)} resultado(s) existentes...")
+            for filename in pendientes:
+                try:
+                    # Sin pisar lo que un request haya guardado mientras tanto (con su sha256)
+                    self.registrar(filename, cargar(rutas[filename]), reemplazar=False)
+                except Exception as e:
+                    log_warning(logger, f"No se pudo indexar {filename}: {e}")
+            log_success(logger, "Índice de resultados actualizado")
+
+        except Exception as e:
+            log_error(logger, f"Error sincronizando índice de resultados: {e}")
+
+    def listar(self, page: int = 1, page_size: int = 50, desde: Optional[str] = None,
+               hasta: Optional[str] = None, proveedor: Optional[str] = None,
+               estado: Optional[str] = None, cursor: Optional[str] = None) -> Dict:
+        """
+        Página del historial, más reciente primero.
+        desde/hasta: YYYY-MM-DD (fecha de procesamiento). proveedor: nombre parcial o CUIT.
+        estado: 'ok' | 'error'. cursor: 'siguiente' de la página anterior (keyset: el costo no
+        depende de la profundidad); sin cursor, `page` salta con OFFSET.
+        """
+        page = max(1, page)
+        page_size = min(max(1, page_size), PAGE_SIZE_MAX)
+
+        condiciones, params = [], []
+        if desde:
+            condiciones.append("procesado_en >= ?")
+            params.append(desde)
+        if hasta:
+            condiciones.append("procesado_en < date(?, '+1 day')")
+            params.append(hasta)
+        if proveedor:
+            condicion, valores = _filtro_proveedor(proveedor)
+            condiciones.append(condicion)
+            params.extend(valores)
+        if estado in ('ok', 'error'):
+            condiciones.append("success = ?")
+            params.append(1 if estado == 'ok' else 0)
+
+        where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+        total = self._total(where, params)
+
+        pagina = list(condiciones)
+        pagina_params = list(params)
+        offset = (page - 1) * page_size
+        if cursor:
+            procesado_en, separador, filename = cursor.partition('|')
+            if not separador:
+                raise ValueError(f"Cursor inválido: {cursor}")
+            pagina.append("(procesado_en, filename) < (?, ?)")
+            pagina_params.extend([procesado_en, filename])
+            offset = 0
+        where_pagina = f"WHERE {' AND '.join(pagina)}" if pagina else ""
+
+        with self._conectar() as conn:
+            filas = conn.execute(
+                f"""
+                SELECT filename, timestamp, procesado_en, success, proveedor, cuit, error_message, preview
+                FROM resultados {where_pagina}
+                ORDER BY procesado_en DESC, filename DESC
+                LIMIT ? OFFSET ?
+                """,
+                pagina_params + [page_size + 1, offset]
+            ).fetchall()
+
+        hay_mas = len(filas) > page_size
+        filas = filas[:page_size]
+        items = [{
+            'filename': fila['filename'],
+            'timestamp': fila['timestamp'],
+            'success': bool(fila['success']),
+            'proveedor': fila['proveedor'],
+            'cuit': fila['cuit'],
+            'preview': json.loads(fila['preview']) if fila['preview'] else {},
+            'has_errors': fila['error_message'] is not None,
+            'error_message': fila['error_message']
+        } for fila in filas]
+        siguiente = f"{filas[-1]['procesado_en']}|{filas[-1]['filename']}" if hay_mas else None
+
+        return {'items': items, 'total': total, 'page': page, 'page_size': page_size, 'siguiente': siguiente}
+
+    def _total(self, where: str, params: List) -> int:
+        """COUNT(*) de un filtro, en caché hasta la próxima escritura del índice"""
+        clave = (where, tuple(params))
+        total = self._totales.get(clave)
+        if total is None:
+            with self._conectar() as conn:
+                total = conn.execute(f"SELECT COUNT(*) FROM resultados {where}", params).fetchone()[0]
+            if len(self._totales) >= TOTALES_MAX:
+                self._totales.clear()
+            self._totales[clave] = total
+        return total
+
+    def consumo_gemini(self, agrupar: List[str], desde: Optional[str] = None, hasta: Optional[str] = None,
+                       proveedor: Optional[str] = None) -> Dict:
+        """
+        Consumo de Gemini agregado por las claves de agrupar ('dia', 'proveedor', 'modelo', 'proposito').
+        desde/hasta: YYYY-MM-DD (fecha de procesamiento). proveedor: nombre parcial o CUIT.
+        Los grupos con más tokens primero (por día, el más reciente primero).
+        """
+        claves = [c for c in GRUPOS_CONSUMO if c in agrupar]
+
+        condiciones, params = [], []
+        if desde:
+            condiciones.append("procesado_en >= ?")
+            params.append(desde)
+        if hasta:
+            condiciones.append("procesado_en < date(?, '+1 day')")
+            params.append(hasta)
+        if proveedor:
+            condicion, valores = _filtro_proveedor(proveedor)
+            condiciones.append(condicion)
+            params.extend(valores)
+        where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+
+        seleccion = [f"{GRUPOS_CONSUMO[c]} AS {c}" for c in claves]
+        if 'proveedor' in claves:
+            seleccion.append("MAX(proveedor) AS nombre_proveedor")
+        group_by = f"GROUP BY {', '.join(GRUPOS_CONSUMO[c] for c in claves)}" if claves else ""
+        orden = ("dia DESC, " if 'dia' in claves else "") + "tokens_total DESC"
+
+        with self._conectar() as conn:
+            filas = conn.execute(
+                f"""
+                SELECT {', '.join(seleccion + [AGREGADOS_CONSUMO])}
+                FROM consumo_gemini {where}
+                {group_by}
+                ORDER BY {orden}
+                """,
+                params
+            ).fetchall()
+
+        grupos = []
+        for fila in filas:
+            grupo = dict(fila)
+            if not grupo['llamadas']:
+                continue  # Sin agrupar y sin llamadas, el agregado es una fila de NULLs
+            facturas = grupo['facturas'] or 1
+            grupo['segundos'] = round(grupo['segundos'] or 0, 3)
+            grupo['tokens_por_factura'] = round((grupo['tokens_total'] or 0) / facturas, 1)
+            grupo['bytes_por_factura'] = round((grupo['bytes_imagenes'] or 0) / facturas)
+            grupo['segundos_por_llamada'] = round(grupo['segundos'] / grupo['llamadas'], 3)
+            grupos.append(grupo)
+
+        return {'agrupar': claves, 'grupos': grupos}
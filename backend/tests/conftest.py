@@ -0,0 +1,48 @@
+"""
+Configuración común de los tests
+Corren contra la réplica SQLite del ERP (datos sintéticos) y Gemini en modo replay: sin SQL Server ni red
+"""
+
+import os
+import sys
+import tempfile
+
+# Antes de importar db_config: los tests nunca usan SQL Server ni llaman a Gemini
+_TEMPORAL = tempfile.mkdtemp(prefix='facturas_tests_')
+os.environ['DB_BACKEND'] = 'sqlite'
+os.environ['DB_SQLITE_PATH'] = os.path.join(_TEMPORAL, 'erp.sqlite3')
+os.environ['GEMINI_BACKEND'] = 'replay'
+os.environ['GEMINI_GRABACIONES_DIR'] = os.path.join(_TEMPORAL, 'grabaciones')
+os.environ['DATA_DIR'] = os.path.join(_TEMPORAL, 'data')
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import sqlite3
+import pytest
+import db_config
+import erp_sintetico
+
+
+@pytest.fixture(scope='session')
+def erp():
+    """Ruta de una réplica chica del ERP con datos sintéticos (la misma para toda la sesión)"""
+    erp_sintetico.generar(db_config.DB_SQLITE_PATH, proveedores=200, ocs=300, facturas=500,
+                          items_max=3, semilla=7, reemplazar=True)
+    return db_config.DB_SQLITE_PATH
+
+
+@pytest.fixture
+def integrador(erp):
+    from database_integrator import DatabaseIntegrator
+    integrador = DatabaseIntegrator()
+    yield integrador
+    integrador.close()
+
+
+@pytest.fixture
+def proveedor_activo(erp):
+    """(COD, CUIT) de un proveedor activo de la réplica"""
+    with sqlite3.connect(erp) as conn:
+        return conn.execute(
+            "SELECT COD, CUIT FROM ISMST_PERSONAS WHERE ESTADO = 'ACTIVO' AND TIPO_PERSONA = 'P' ORDER BY COD LIMIT 1"
+        ).fetchone()
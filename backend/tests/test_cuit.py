@@ -0,0 +1,90 @@
+import sqlite3
+from cuit import normalizar_cuit, es_cuit_valido, candidatos_un_digito, corregir_cuit
+
+
+CUIT = '30543400714'  # Verificador correcto
+
+
+def _un_digito_mal(cuit: str) -> str:
+    """La misma CUIT con el último dígito cambiado (siempre inválida)"""
+    return cuit[:10] + str((int(cuit[10]) + 1) % 10)
+
+
+def test_normalizar_quita_separadores():
+    assert normalizar_cuit('30-54340071-4') == CUIT
+    assert normalizar_cuit(' 30 54340071 4 ') == CUIT
+    assert normalizar_cuit(None) == ''
+
+
+def test_validar_verificador_y_prefijo():
+    assert es_cuit_valido(CUIT)
+    assert es_cuit_valido('30-54340071-4')
+    assert not es_cuit_valido(_un_digito_mal(CUIT))
+    assert not es_cuit_valido('99543400714')  # Prefijo inexistente
+    assert not es_cuit_valido('3054340071')  # 10 dígitos
+    assert not es_cuit_valido('30A43400714')
+
+
+def test_candidatos_un_digito():
+    mal = _un_digito_mal(CUIT)
+    candidatos = candidatos_un_digito(mal)
+    assert CUIT in candidatos
+    assert all(es_cuit_valido(c) for c in candidatos)
+    assert mal not in candidatos
+    assert candidatos_un_digito('123') == []
+
+
+def test_candidatos_incluyen_digitos_invertidos():
+    invertida = CUIT[:3] + CUIT[4] + CUIT[3] + CUIT[5:]
+    assert CUIT in candidatos_un_digito(invertida)
+
+
+def test_corregir_contra_conocidos():
+    mal = _un_digito_mal(CUIT)
+    assert corregir_cuit(mal, {CUIT}) == CUIT
+    assert corregir_cuit(CUIT, set()) == CUIT  # Válida aunque no sea conocida
+    assert corregir_cuit(mal, set()) is None
+    assert corregir_cuit('abc', {CUIT}) is None
+
+
+def test_corregir_ambiguo_no_adivina():
+    mal = _un_digito_mal(CUIT)
+    otros = [c for c in candidatos_un_digito(mal) if c != CUIT]
+    assert otros
+    assert corregir_cuit(mal, {CUIT, otros[0]}) is None
+
+
+def test_corregir_acepta_conocida_con_verificador_invalido():
+    historica = _un_digito_mal(CUIT)
+    assert corregir_cuit(historica, {historica}) == historica
+
+
+def test_buscar_proveedor_por_cuit_desde_el_mapa(integrador, proveedor_activo):
+    cod, cuit = proveedor_activo
+    assert integrador.buscar_proveedor_por_cuit(f"{cuit[:2]}-{cuit[2:10]}-{cuit[10]}") == cod
+    assert corregir_cuit(_un_digito_mal(cuit), integrador.cuits_proveedores()) == cuit
+
+
+def test_buscar_proveedor_fuera_del_mapa_consulta_la_bd(integrador, erp):
+    integrador.cuits_proveedores()  # Mapa cargado antes del alta
+    nuevo = '20' + CUIT[2:]
+    with sqlite3.connect(erp) as conn:
+        conn.execute("INSERT OR REPLACE INTO ISMST_PERSONAS VALUES ('999999', 'ALTA NUEVA', 'ALTA', ?, NULL, 'P', 'ACTIVO', 'SI')",
+                     (nuevo,))
+    try:
+        assert integrador.buscar_proveedor_por_cuit(nuevo) == '999999'
+        assert integrador.cuits_proveedores()[nuevo] == '999999'
+    finally:
+        with sqlite3.connect(erp) as conn:
+            conn.execute("DELETE FROM ISMST_PERSONAS WHERE COD = '999999'")
+
+
+def test_prefijo_mal_leido_se_corrige_antes_de_rechazarlo():
+    from model_tiering import problemas_extraccion
+    mal = '38' + CUIT[2:]
+    assert corregir_cuit(mal, {CUIT}) == CUIT
+
+    def extraccion(cuit):
+        return {'cabecera': {'proveedor': {'nombre': 'X', 'cuit': cuit}, 'factura': {'importe_total': 0}}}
+    assert problemas_extraccion(extraccion(mal), {CUIT: '000001'}) == []
+    assert problemas_extraccion(extraccion(mal), {}) == ["CUIT con prefijo inválido: 38"]
@@ -0,0 +1,44 @@
+from app import FacturasIASystem
+
+
+def _extraccion(cuit='30-54340071-4', punto='3', numero='1234'):
+    return {'cabecera': {'proveedor': {'cuit': cuit}, 'factura': {'punto_emision': punto, 'numero_comprobante': numero}}}
+
+
+def _trabajo(detener=False):
+    similar = ('result_20251001_120000_0001.json.gz', 6, ('30543400714', '0003', '00001234'))
+    return {'result': {'errors': []}, 'similar': similar, 'detener_si_similar': detener, 'fin': False}
+
+
+def _sistema():
+    return FacturasIASystem.__new__(FacturasIASystem)  # Sin conectar a la BD ni a Gemini
+
+
+def test_misma_plantilla_otro_comprobante_no_es_duplicado():
+    trabajo = _trabajo(detener=True)
+    _sistema()._confirmar_duplicado(trabajo, _extraccion(numero='1235'))
+    assert 'posible_duplicado' not in trabajo['result']
+    assert not trabajo['fin']
+
+
+def test_otro_proveedor_no_es_duplicado():
+    trabajo = _trabajo()
+    _sistema()._confirmar_duplicado(trabajo, _extraccion(cuit='20123456786'))
+    assert 'posible_duplicado' not in trabajo['result']
+
+
+def test_mismo_comprobante_se_marca_y_con_detener_no_sigue():
+    trabajo = _trabajo()
+    _sistema()._confirmar_duplicado(trabajo, _extraccion())
+    assert trabajo['result']['posible_duplicado']['distancia'] == 6
+    assert not trabajo['fin']
+
+    trabajo = _trabajo(detener=True)
+    _sistema()._confirmar_duplicado(trabajo, _extraccion(punto='0003', numero='00001234'))
+    assert trabajo['fin'] and trabajo['result']['errors']
+
+
+def test_sin_numero_extraido_no_se_marca():
+    trabajo = _trabajo()
+    _sistema()._confirmar_duplicado(trabajo, _extraccion(numero=None))
+    assert 'posible_duplicado' not in trabajo['result']
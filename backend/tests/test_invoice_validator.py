@@ -0,0 +1,75 @@
+from invoice_validator import validar_aritmetica, prompt_correccion, aplicar_correccion
+
+
+def _factura(tipo='FACTURA A', items=None, impuestos=None, **importes):
+    factura = {'tipo_comprobante': tipo, 'importe_total': 0, 'importe_neto_gravado': 0, 'importe_iva': 0,
+               'importe_no_gravado': 0, 'importe_exento': 0}
+    factura.update(importes)
+    return {'cabecera': {'factura': factura, 'impuestos': impuestos or []}, 'items': items or []}
+
+
+def _item(linea, neto, iva, total):
+    return {'linea': linea, 'importe_neto': neto, 'importe_iva': iva, 'total_linea': total}
+
+
+def test_factura_a_que_cierra():
+    data = _factura(items=[_item(1, 100, 21, 121), _item(2, 50, 10.5, 60.5)],
+                    importe_total=181.5, importe_neto_gravado=150, importe_iva=31.5)
+    assert validar_aritmetica(data) == []
+
+
+def test_linea_que_no_cierra():
+    data = _factura(items=[_item(1, 100, 21, 125)], importe_total=121, importe_neto_gravado=100, importe_iva=21)
+    fallas = validar_aritmetica(data)
+    assert [f['tipo'] for f in fallas] == ['linea']
+    assert fallas[0]['linea'] == 1
+
+
+def test_suma_neto_contra_cabecera():
+    data = _factura(items=[_item(1, 100, 21, 121)], importe_total=242, importe_neto_gravado=200, importe_iva=42)
+    assert [f['tipo'] for f in validar_aritmetica(data)] == ['suma_neto', 'suma_iva']
+
+
+def test_totales_de_cabecera_con_percepciones():
+    data = _factura(importe_total=130, importe_neto_gravado=100, importe_iva=21,
+                    impuestos=[{'tipo': 'PERCEP_IIBB', 'monto': 9}])
+    assert validar_aritmetica(data) == []
+    data['cabecera']['impuestos'] = []
+    assert [f['tipo'] for f in validar_aritmetica(data)] == ['totales']
+
+
+def test_factura_b_con_iva_incluido_en_las_lineas():
+    # Las líneas de B/C muestran el precio final: no se comparan contra el neto de cabecera
+    data = _factura('FACTURA B', items=[_item(1, 121, 0, 121), _item(2, 242, 0, 242)],
+                    importe_total=366, importe_neto_gravado=300, importe_iva=63,
+                    impuestos=[{'tipo': 'PERCEP_IIBB', 'monto': 3}])
+    assert validar_aritmetica(data) == []
+
+
+def test_factura_c_que_no_cierra_contra_el_total():
+    data = _factura('FACTURA C', items=[_item(1, 121, 0, 121)], importe_total=150, importe_neto_gravado=150)
+    fallas = validar_aritmetica(data)
+    assert [f['tipo'] for f in fallas] == ['suma_total']
+    assert 'importe_total' in fallas[0]['campos']
+
+
+def test_nota_de_credito_b():
+    data = _factura('NOTA DE CREDITO B', items=[_item(1, 121, 0, 121)],
+                    importe_total=121, importe_neto_gravado=100, importe_iva=21)
+    assert validar_aritmetica(data) == []
+
+
+def test_correccion_solo_pide_y_aplica_lo_inconsistente():
+    data = _factura(items=[_item(1, 100, 21, 125), _item(2, 10, 2.1, 12.1)],
+                    importe_total=133.1, importe_neto_gravado=110, importe_iva=23.1)
+    fallas = validar_aritmetica(data)
+    prompt = prompt_correccion(fallas)
+    assert 'líneas 1' in prompt and 'líneas 1, 2' not in prompt
+
+    correccion = {'items': [{'linea': 1, 'total_linea': 121}, {'linea': 2, 'total_linea': 99}],
+                  'factura': {'importe_total': 1}}
+    corregida = aplicar_correccion(data, correccion, fallas)
+    assert corregida['items'][0]['total_linea'] == 121
+    assert corregida['items'][1]['total_linea'] == 12.1  # Línea no pedida
+    assert corregida['cabecera']['factura']['importe_total'] == 133.1  # Campo no pedido
+    assert validar_aritmetica(corregida) == []
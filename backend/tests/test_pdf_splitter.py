@@ -0,0 +1,93 @@
+import json
+import base64
+import fitz  # PyMuPDF
+import pytest
+from pdf_splitter import detectar_facturas, dividir_pdf
+
+
+def _qr(tipo: int, punto: int, numero: int) -> str:
+    datos = json.dumps({'ver': 1, 'cuit': 30543400714, 'ptoVta': punto, 'tipoCmp': tipo, 'nroCmp': numero})
+    return "https://www.afip.gob.ar/fe/qr/?p=" + base64.urlsafe_b64encode(datos.encode()).decode().rstrip('=')
+
+
+@pytest.fixture
+def pdf(tmp_path):
+    """Arma un PDF con una página por texto ({'texto', 'qr'} para agregar el link del QR de AFIP)"""
+    def armar(paginas):
+        doc = fitz.open()
+        for pagina in paginas:
+            if isinstance(pagina, str):
+                pagina = {'texto': pagina}
+            page = doc.new_page()
+            page.insert_text((72, 72), pagina['texto'], fontsize=10)
+            if pagina.get('qr'):
+                page.insert_link({'kind': fitz.LINK_URI, 'from': fitz.Rect(72, 600, 172, 700), 'uri': pagina['qr']})
+        ruta = str(tmp_path / f"lote_{len(list(tmp_path.iterdir()))}.pdf")
+        doc.save(ruta)
+        doc.close()
+        return ruta
+    return armar
+
+
+def test_sin_senales_es_una_sola_factura(pdf):
+    assert detectar_facturas(pdf(["Remito", "Detalle", "Observaciones"])) == [[0, 1, 2]]
+
+
+def test_pagina_1_de_n_abre_factura(pdf):
+    ruta = pdf(["Página 1 de 2", "Página 2 de 2", "Página 1 de 1"])
+    assert detectar_facturas(ruta) == [[0, 1], [2]]
+
+
+def test_otro_numero_de_comprobante_abre_factura(pdf):
+    ruta = pdf([
+        "Punto de Venta: 00003  Comp. Nro: 00001234",
+        "Punto de Venta: 00003  Comp. Nro: 00001234",
+        "Punto de Venta: 00003  Comp. Nro: 00001235",
+    ])
+    assert detectar_facturas(ruta) == [[0, 1], [2]]
+
+
+def test_formato_corto_y_paginas_sin_numero(pdf):
+    ruta = pdf(["N° 0003-00001234", "continuación", "N° 0004-00001234"])
+    assert detectar_facturas(ruta) == [[0, 1], [2]]
+
+
+def test_qr_distingue_el_tipo_de_comprobante(pdf):
+    ruta = pdf([
+        {'texto': "Factura", 'qr': _qr(1, 3, 10)},
+        {'texto': "Nota de crédito", 'qr': _qr(3, 3, 10)},
+    ])
+    assert detectar_facturas(ruta) == [[0], [1]]
+
+
+def test_duplicado_del_mismo_comprobante_no_es_otra_factura(pdf):
+    ruta = pdf([
+        "ORIGINAL  Punto de Venta: 00003  Comp. Nro: 00001234  Página 1 de 1",
+        "DUPLICADO  Punto de Venta: 00003  Comp. Nro: 00001234  Página 1 de 1",
+        "ORIGINAL  Punto de Venta: 00003  Comp. Nro: 00001240  Página 1 de 1",
+    ])
+    # La copia se descarta porque está el ORIGINAL
+    assert detectar_facturas(ruta) == [[0], [2]]
+
+
+def test_duplicado_sin_original_se_conserva(pdf):
+    ruta = pdf(["DUPLICADO  Punto de Venta: 00003  Comp. Nro: 00001234"])
+    assert detectar_facturas(ruta) == [[0]]
+
+
+def test_dividir_genera_un_pdf_por_factura(pdf, tmp_path):
+    ruta = pdf(["Página 1 de 2", "Página 2 de 2", "Página 1 de 1"])
+    carpeta = tmp_path / 'partes'
+    carpeta.mkdir()
+    partes = dividir_pdf(ruta, str(carpeta))
+    assert [p['paginas'] for p in partes] == [[1, 2], [3]]
+    for parte, paginas in zip(partes, ([1, 2], [3])):
+        with fitz.open(str(carpeta / parte['filename'])) as doc:
+            assert len(doc) == len(paginas)
+
+    # Mismo contenido, mismo archivo (bytes deterministas)
+    assert [p['filename'] for p in dividir_pdf(ruta, str(carpeta))] == [p['filename'] for p in partes]
+
+
+def test_dividir_una_sola_factura_no_genera_partes(pdf, tmp_path):
+    assert dividir_pdf(pdf(["Página 1 de 1"]), str(tmp_path)) == []
@@ -0,0 +1,83 @@
+import time
+import random
+import threading
+import contextvars
+from pipeline import Pipeline, Etapa, Terminado
+
+
+def _demora(valor):
+    time.sleep(random.uniform(0, 0.005))
+    return valor
+
+
+def test_resultados_en_el_orden_de_entrada():
+    pipeline = Pipeline([
+        Etapa('render', lambda v: _demora(v * 2), concurrencia=3),
+        Etapa('modelo', lambda v: _demora(v + 1), concurrencia=4),
+        Etapa('bd', _demora, concurrencia=1),
+    ], capacidad=2)
+    assert pipeline.procesar(list(range(50))) == [v * 2 + 1 for v in range(50)]
+
+    metricas = pipeline.metricas()
+    assert metricas['modelo']['items'] == 50
+    assert metricas['total']['items'] == 50
+
+
+def test_terminado_y_errores_saltean_las_etapas_siguientes():
+    llamadas = []
+
+    def primera(v):
+        if v == 1:
+            return Terminado('duplicado')
+        if v == 2:
+            raise ValueError('ilegible')
+        return v
+
+    def segunda(v):
+        llamadas.append(v)
+        return v * 10
+
+    resultados = Pipeline([Etapa('a', primera), Etapa('b', segunda)]).procesar([0, 1, 2, 3])
+    assert resultados[0] == 0 and resultados[3] == 30
+    assert resultados[1] == 'duplicado'
+    assert isinstance(resultados[2], ValueError)
+    assert sorted(llamadas) == [0, 3]
+
+
+def test_al_terminar_corre_en_el_contexto_del_item():
+    actual = contextvars.ContextVar('actual')
+    contextos = []
+    for i in range(5):
+        contexto = contextvars.copy_context()
+        contexto.run(actual.set, f"item-{i}")
+        contextos.append(contexto)
+
+    vistos = {}
+    Pipeline([Etapa('a', lambda v: v, concurrencia=2)]).procesar(
+        list(range(5)), contextos, al_terminar=lambda i, r: vistos.__setitem__(i, actual.get())
+    )
+    assert vistos == {i: f"item-{i}" for i in range(5)}
+
+
+def test_una_etapa_lenta_frena_a_las_anteriores():
+    capacidad = 2
+    liberar = threading.Event()
+    renderizados = []
+
+    def lenta(v):
+        liberar.wait(5)
+        return v
+
+    pipeline = Pipeline([Etapa('render', lambda v: renderizados.append(v) or v), Etapa('bd', lenta)],
+                        capacidad=capacidad)
+    resultados = []
+    thread = threading.Thread(target=lambda: resultados.extend(pipeline.procesar(list(range(30)))))
+    thread.start()
+    try:
+        time.sleep(0.3)
+        # Uno en la etapa lenta, `capacidad` en su cola y uno esperando para encolarse
+        assert len(renderizados) <= capacidad + 2
+    finally:
+        liberar.set()
+        thread.join(10)
+    assert resultados == list(range(30))
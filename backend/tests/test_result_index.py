@@ -0,0 +1,110 @@
+import pytest
+from result_index import ResultIndex
+
+
+def _resultado(proveedor='PROVEEDOR', cuit='30-54340071-4', success=True):
+    return {
+        'success': success,
+        'extraction': {'cabecera': {
+            'proveedor': {'nombre': proveedor, 'cuit': cuit},
+            'factura': {'tipo_comprobante': 'FACTURA A', 'punto_emision': '0003', 'numero_comprobante': '00001234',
+                        'importe_total': 121.0},
+        }},
+        'errors': [] if success else ['Sin respuesta válida del modelo'],
+    }
+
+
+@pytest.fixture
+def indice(tmp_path):
+    indice = ResultIndex(str(tmp_path / 'resultados.sqlite3'))
+    # Varios resultados por segundo: el orden se desempata por nombre de archivo
+    for i in range(37):
+        filename = f"result_202510{1 + i // 10:02d}_120000_{i:04d}.json.gz"
+        indice.registrar(filename, _resultado(success=i % 5 != 0))
+    return indice
+
+
+def _orden_esperado(indice):
+    return [item['filename'] for item in indice.listar(page_size=200)['items']]
+
+
+def test_orden_mas_reciente_primero(indice):
+    filenames = _orden_esperado(indice)
+    assert len(filenames) == 37
+    assert filenames[0] == "result_20251004_120000_0036.json.gz"
+    assert filenames == sorted(filenames, reverse=True)
+
+
+def test_paginado_por_cursor_recorre_todo_sin_repetir(indice):
+    vistos, cursor = [], None
+    while True:
+        pagina = indice.listar(page_size=10, cursor=cursor)
+        assert pagina['total'] == 37
+        vistos += [item['filename'] for item in pagina['items']]
+        cursor = pagina['siguiente']
+        if cursor is None:
+            break
+    assert vistos == _orden_esperado(indice)
+
+
+def test_cursor_y_offset_dan_la_misma_pagina(indice):
+    primera = indice.listar(page=1, page_size=10)
+    segunda = indice.listar(page=2, page_size=10)
+    assert indice.listar(page_size=10, cursor=primera['siguiente'])['items'] == segunda['items']
+    assert indice.listar(page=4, page_size=10)['siguiente'] is None
+
+
+def test_cursor_invalido(indice):
+    with pytest.raises(ValueError):
+        indice.listar(cursor='sin-separador')
+
+
+def test_filtros_con_paginado(indice):
+    errores = indice.listar(estado='error', page_size=3)
+    assert errores['total'] == 8
+    assert all(not item['success'] for item in errores['items'])
+    resto = indice.listar(estado='error', page_size=10, cursor=errores['siguiente'])
+    assert len(resto['items']) == 5 and resto['siguiente'] is None
+
+
+def test_filtro_por_cuit_en_cualquier_formato(indice):
+    indice.registrar("result_20251101_090000_otro.json.gz", _resultado('OTRO S.A.', '20 12345678 6'))
+    assert indice.listar(proveedor='20-12345678-6')['total'] == 1
+    assert indice.listar(proveedor='20123456786')['items'][0]['cuit'] == '20123456786'
+    assert indice.listar(proveedor='otro')['total'] == 1
+
+
+def test_total_se_actualiza_al_registrar_y_eliminar(indice):
+    assert indice.listar()['total'] == 37
+    indice.registrar("result_20251101_090000_nuevo.json.gz", _resultado())
+    assert indice.listar()['total'] == 38
+    indice.eliminar(["result_20251101_090000_nuevo.json.gz"])
+    assert indice.listar()['total'] == 37
+
+
+def test_sincronizar_no_pisa_el_hash_de_un_resultado_ya_guardado(indice):
+    filename = "result_20251101_090000_conhash.json.gz"
+    indice.registrar(filename, _resultado(), sha256='a' * 64)
+    indice.sincronizar({filename: 'ruta'}, lambda ruta: _resultado('OTRO'))
+    assert indice.buscar_exitoso_por_hash('a' * 64) == filename
+    assert indice.listar(proveedor='OTRO')['total'] == 0
+
+    # Una actualización sin sha256 conserva el guardado
+    indice.registrar(filename, _resultado('ACTUALIZADO'))
+    assert indice.buscar_exitoso_por_hash('a' * 64) == filename
+    assert indice.listar(proveedor='ACTUALIZADO')['total'] == 1
+
+
+def test_sincronizar_recupera_el_hash_del_registro(indice):
+    filename = "result_20251101_090000_nuevo.json.gz"
+    indice.sincronizar({filename: 'ruta'}, lambda ruta: {**_resultado(), 'sha256': 'b' * 64})
+    assert indice.buscar_exitoso_por_hash('b' * 64) == filename
+
+
+def test_buscar_similar_devuelve_el_comprobante(indice):
+    huella = 'd55dd55d2aa2945d0aa2f55d0822f55d0022d55d2aa2f55db55de45d2a22f55d'
+    indice.registrar("result_20251101_090000_huella.json.gz", {**_resultado(), 'huella': huella})
+    cercana = huella[:-1] + 'c'  # Un bit distinto
+    assert indice.buscar_similar(cercana, 10) == (
+        "result_20251101_090000_huella.json.gz", 1, ('30543400714', '0003', '00001234'))
+    assert indice.buscar_similar('0' * 64, 10) is None
@@ -0,0 +1,329 @@
+"""
+Trazas del procesamiento (spans anidados con trace ID por request)
+Cada span mide una parte del trabajo (etapa, llamada a Gemini, sentencia SQL) y se exporta
+al terminar, en segundo plano, a archivos JSONL diarios (rotados por tamaño) o a un colector OTLP/HTTP (JSON)
+"""
+
+import os
+import json
+import time
+import queue
+import atexit
+import logging
+import secrets
+import threading
+import contextvars
+import urllib.request
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+import db_config
+from logging_config import log_warning
+
+logger = logging.getLogger(__name__)
+
+SERVICIO = 'facturas-ia'
+LOTE_MAX = 200  # Spans por escritura / POST
+
+# Span activo en este contexto (los threads del pipeline lo heredan con su copia del contexto)
+_span_actual = contextvars.ContextVar('span_actual', default=None)
+
+
+def _nuevo_id(bytes_: int) -> str:
+    return secrets.token_hex(bytes_)
+
+
+class Span:
+    """Parte del trabajo con inicio, duración, atributos y estado"""
+
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'nombre', 'inicio', 'fin',
+                 'atributos', 'error', '_t0', '_token')
+
+    def __init__(self, nombre: str, trace_id: str, parent_id: Optional[str] = None, **atributos):
+        self.trace_id = trace_id
+        self.span_id = _nuevo_id(8)
+        self.parent_id = parent_id
+        self.nombre = nombre
+        self.inicio = time.time()
+        self.fin = None
+        self.atributos = {k: v for k, v in atributos.items() if v is not None}
+        self.error = None
+        self._t0 = time.perf_counter()
+        self._token = None
+
+    def set(self, **atributos):
+        """Agrega atributos (los None se ignoran)"""
+        self.atributos.update({k: v for k, v in atributos.items() if v is not None})
+
+    def terminar(self, error: Optional[BaseException] = None):
+        """Cierra el span y lo exporta (una sola vez)"""
+        if self.fin is not None:
+            return
+        duracion = time.perf_counter() - self._t0
+        self.fin = self.inicio + duracion
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        _exportar(self)
+
+    @property
+    def duracion(self) -> Optional[float]:
+        return None if self.fin is None else self.fin - self.inicio
+
+    def a_dict(self) -> Dict:
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'nombre': self.nombre,
+            'inicio': datetime.fromtimestamp(self.inicio).isoformat(timespec='microseconds'),
+            'duracion_ms': round(self.duracion * 1000, 3),
+            'estado': 'error' if self.error else 'ok',
+            'error': self.error,
+            'atributos': self.atributos,
+        }
+
+
+def habilitado() -> bool:
+    return db_config.TRACING in ('jsonl', 'otlp')
+
+
+def span_actual() -> Optional[Span]:
+    return _span_actual.get()
+
+
+def trace_id_actual() -> Optional[str]:
+    actual = _span_actual.get()
+    return actual.trace_id if actual else None
+
+
+def abrir(nombre: str, trace_id: Optional[str] = None, parent_id: Optional[str] = None,
+          **atributos) -> Optional[Span]:
+    """
+    Abre un span y lo deja como actual en este contexto hasta cerrar(span): para spans que
+    empiezan y terminan en funciones distintas (request HTTP, factura dentro del pipeline).
+    Sin trace_id es hijo del span actual (o la raíz de una traza nueva); con trace_id
+    (ej. de un traceparent entrante) continúa esa traza. None si las trazas están apagadas.
+    """
+    if not habilitado():
+        return None
+    padre = _span_actual.get()
+    if trace_id is None and padre is not None:
+        trace_id, parent_id = padre.trace_id, padre.span_id
+    nuevo = Span(nombre, trace_id or _nuevo_id(16), parent_id, **atributos)
+    nuevo._token = _span_actual.set(nuevo)
+    return nuevo
+
+
+def cerrar(abierto: Optional[Span], error: Optional[BaseException] = None):
+    """Termina un span de abrir() y restaura el span anterior del contexto"""
+    if abierto is None:
+        return
+    abierto.terminar(error)
+    if abierto._token is not None:
+        try:
+            _span_actual.reset(abierto._token)
+        except ValueError:
+            pass  # Se cierra desde otro contexto: el suyo ya no se usa
+        abierto._token = None
+
+
+@contextmanager
+def span(nombre: str, **atributos):
+    """Span del bloque; el valor es el Span (o None con las trazas apagadas)"""
+    if not habilitado():
+        yield None
+        return
+
+    padre = _span_actual.get()
+    actual = Span(nombre, padre.trace_id if padre else _nuevo_id(16), padre.span_id if padre else None, **atributos)
+    token = _span_actual.set(actual)
+    try:
+        yield actual
+    except BaseException as e:
+        actual.terminar(e)
+        raise
+    finally:
+        _span_actual.reset(token)
+        actual.terminar()
+
+
+def hijo(nombre: str, **atributos) -> Optional[Span]:
+    """
+    Span hijo del actual que no pasa a ser el actual (ej. una sentencia SQL que queda abierta
+    hasta leer sus filas). None si no hay traza en curso: fuera de un request no se traza.
+    """
+    padre = _span_actual.get()
+    if padre is None or not habilitado():
+        return None
+    return Span(nombre, padre.trace_id, padre.span_id, **atributos)
+
+
+def anotar(**atributos):
+    """Agrega atributos al span actual (si hay)"""
+    actual = _span_actual.get()
+    if actual is not None:
+        actual.set(**atributos)
+
+
+# ===== Exportación =====
+
+class ExportadorJSONL:
+    """
+    Un span por línea en <carpeta>/spans_YYYYmmdd[_N].jsonl: pasa a la parte siguiente al llegar a
+    archivo_mb, y borra los archivos más viejos que la retención o que excedan max_mb en total
+    """
+
+    def __init__(self, carpeta: str, retencion_dias: int, archivo_mb: float = 50, max_mb: float = 500):
+        self.carpeta = carpeta
+        self.retencion_dias = retencion_dias
+        self.archivo_bytes = archivo_mb * 1024 * 1024
+        self.max_bytes = max_mb * 1024 * 1024
+        self._dia = None
+        self._parte = 1
+        self._ruta = None
+        os.makedirs(carpeta, exist_ok=True)
+
+    def exportar(self, spans: List[Span]):
+        dia = datetime.now().strftime('%Y%m%d')
+        if dia != self._dia or self._llena(self._ruta):
+            if dia != self._dia:
+                self._dia, self._parte = dia, 1
+            self._ruta = self._parte_libre()
+            self._aplicar_retencion()
+        with open(self._ruta, 'a', encoding='utf-8') as f:
+            for s in spans:
+                f.write(json.dumps(s.a_dict(), ensure_ascii=False, default=str) + "\n")
+
+    def _llena(self, ruta: Optional[str]) -> bool:
+        try:
+            return os.path.getsize(ruta) >= self.archivo_bytes
+        except (OSError, TypeError):
+            return False
+
+    def _parte_libre(self) -> str:
+        """Primera parte del día sin llenar, desde la actual (las ya borradas por el tope no se reusan)"""
+        while True:
+            nombre = f"spans_{self._dia}.jsonl" if self._parte == 1 else f"spans_{self._dia}_{self._parte}.jsonl"
+            ruta = os.path.join(self.carpeta, nombre)
+            if not self._llena(ruta):
+                return ruta
+            self._parte += 1
+
+    def _aplicar_retencion(self):
+        limite = (datetime.now() - timedelta(days=self.retencion_dias)).strftime('%Y%m%d')
+        with os.scandir(self.carpeta) as entradas:
+            archivos = [e for e in entradas if e.name.startswith('spans_') and e.name.endswith('.jsonl')]
+        archivos.sort(key=lambda e: e.stat().st_mtime, reverse=True)
+
+        total = 0
+        for entrada in archivos:
+            total += entrada.stat().st_size
+            vencido = self.retencion_dias > 0 and entrada.name[6:14] < limite
+            if entrada.path != self._ruta and (vencido or total > self.max_bytes):
+                try:
+                    os.remove(entrada.path)
+                except OSError:
+                    pass
+
+
+def _valor_otlp(valor) -> Dict:
+    if isinstance(valor, bool):
+        return {'boolValue': valor}
+    if isinstance(valor, int):
+        return {'intValue': str(valor)}
+    if isinstance(valor, float):
+        return {'doubleValue': valor}
+    return {'stringValue': str(valor)}
+
+
+class ExportadorOTLP:
+    """POST de lotes en OTLP/HTTP JSON (ej. http://localhost:4318/v1/traces de un OpenTelemetry Collector)"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self._ultimo_aviso = 0.0
+
+    def exportar(self, spans: List[Span]):
+        cuerpo = {'resourceSpans': [{
+            'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': SERVICIO}}]},
+            'scopeSpans': [{'scope': {'name': SERVICIO}, 'spans': [self._span(s) for s in spans]}]
+        }]}
+        peticion = urllib.request.Request(
+            self.url, data=json.dumps(cuerpo).encode('utf-8'),
+            headers={'Content-Type': 'application/json'}, method='POST'
+        )
+        try:
+            with urllib.request.urlopen(peticion, timeout=5):
+                pass
+        except Exception as e:
+            # El colector caído no debe llenar el log: un aviso por minuto, los spans se descartan
+            if time.monotonic() - self._ultimo_aviso > 60:
+                self._ultimo_aviso = time.monotonic()
+                log_warning(logger, f"No se pudieron exportar {len(spans)} span(s) a {self.url}: {e}")
+
+    @staticmethod
+    def _span(s: Span) -> Dict:
+        otlp = {
+            'traceId': s.trace_id,
+            'spanId': s.span_id,
+            'name': s.nombre,
+            'kind': 1,  # INTERNAL
+            'startTimeUnixNano': str(int(s.inicio * 1e9)),
+            'endTimeUnixNano': str(int(s.fin * 1e9)),
+            'attributes': [{'key': k, 'value': _valor_otlp(v)} for k, v in s.atributos.items()],
+            'status': {'code': 2, 'message': s.error} if s.error else {'code': 1},
+        }
+        if s.parent_id:
+            otlp['parentSpanId'] = s.parent_id
+        return otlp
+
+
+_cola = queue.Queue(maxsize=10000)
+_exportador = None
+_lock = threading.Lock()
+
+
+def _crear_exportador():
+    if db_config.TRACING == 'otlp':
+        return ExportadorOTLP(db_config.TRACING_OTLP_URL)
+    return ExportadorJSONL(db_config.TRACING_DIR, db_config.TRACING_RETENCION_DIAS,
+                           db_config.TRACING_ARCHIVO_MB, db_config.TRACING_MAX_MB)
+
+
+def _exportar(s: Span):
+    """Encola el span; el thread exportador escribe en lotes fuera del camino del request"""
+    global _exportador
+    if _exportador is None:
+        with _lock:
+            if _exportador is None:
+                _exportador = _crear_exportador()
+                threading.Thread(target=_trabajar, name="tracing-export", daemon=True).start()
+                atexit.register(vaciar)
+    try:
+        _cola.put_nowait(s)
+    except queue.Full:
+        pass  # Sin colector que drene, se pierden spans antes que frenar el procesamiento
+
+
+def _trabajar():
+    while True:
+        lote = [_cola.get()]
+        while len(lote) < LOTE_MAX:
+            try:
+                lote.append(_cola.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            _exportador.exportar(lote)
+        except Exception as e:
+            log_warning(logger, f"Error exportando spans: {e}")
+        finally:
+            for _ in lote:
+                _cola.task_done()
+
+
+def vaciar(timeout: float = 5.0):
+    """Espera a que se exporten los spans encolados (al salir, o en pruebas)"""
+    limite = time.monotonic() + timeout
+    while _cola.unfinished_tasks and time.monotonic() < limite:
+        time.sleep(0.01)
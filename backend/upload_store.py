@@ -0,0 +1,53 @@
+"""
+Almacenamiento de archivos subidos direccionado por contenido
+El archivo se copia a disco por bloques mientras se calcula su SHA-256; el nombre final es el hash
+"""
+
+import os
+import re
+import hashlib
+import tempfile
+from typing import BinaryIO, Optional, Tuple
+
+TAMANIO_BLOQUE = 64 * 1024
+
+NOMBRE_HASH = re.compile(r'^([0-9a-f]{64})\.[a-z0-9]+$')
+
+
+def guardar_por_contenido(stream: BinaryIO, carpeta: str, extension: str) -> Tuple[str, str, bool]:
+    """
+    Guarda el contenido como <sha256>.<extension>.
+    Devuelve (nombre, sha256, nuevo); nuevo=False si los mismos bytes ya estaban guardados.
+    """
+    sha = hashlib.sha256()
+    descriptor, temporal = tempfile.mkstemp(dir=carpeta, suffix='.part')
+    try:
+        with os.fdopen(descriptor, 'wb') as destino:
+            while True:
+                bloque = stream.read(TAMANIO_BLOQUE)
+                if not bloque:
+                    break
+                sha.update(bloque)
+                destino.write(bloque)
+
+        digest = sha.hexdigest()
+        nombre = f"{digest}.{extension.lower()}"
+        ruta = os.path.join(carpeta, nombre)
+
+        if os.path.exists(ruta):
+            os.remove(temporal)
+            return nombre, digest, False
+
+        os.replace(temporal, ruta)
+        return nombre, digest, True
+
+    except Exception:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        raise
+
+
+def sha256_de_nombre(nombre: str) -> Optional[str]:
+    """Hash de un archivo guardado por contenido ('<sha256>.pdf'); None para nombres anteriores"""
+    match = NOMBRE_HASH.match(os.path.basename(nombre or ''))
+    return match.group(1) if match else None
@@ -126,23 +126,35 @@ function handleFileSelect(file, type) {
         return;
     }
 
+    // El servidor guarda por contenido: el nombre a usar es el que devuelve el upload
     if (type === 'invoice') {
         state.facturaFile = file;
-        state.facturaFilename = file.name;
+        state.facturaFilename = null;
         elements.invoiceUploadArea.style.display = 'none';
         elements.invoiceFileItem.style.display = 'flex';
         elements.invoiceFileItem.querySelector('.filename').textContent = file.name;
-        elements.btnProcessInvoice.disabled = false;
-        elements.btnExtractOnly.disabled = false;
-        uploadFile(file, 'factura');
+        uploadFile(file, 'factura').then(data => {
+            if (!data || state.facturaFile !== file) return;
+            state.facturaFilename = data.factura;
+            elements.btnProcessInvoice.disabled = false;
+            elements.btnExtractOnly.disabled = false;
+
+            // Los mismos bytes ya se procesaron con éxito: se muestra ese resultado
+            if (data.resultado_previo) {
+                displayResults({ ...data.resultado_previo.resultado, duplicado_de: data.resultado_previo.filename });
+            }
+        });
     } else if (type === 'oc') {
         state.ocFile = file;
-        state.ocFilename = file.name;
+        state.ocFilename = null;
         elements.ocUploadArea.style.display = 'none';
         elements.ocFileItem.style.display = 'flex';
         elements.ocFileItem.querySelector('.filename').textContent = file.name;
-        elements.btnSearchProvider.disabled = false;
-        uploadFile(file, 'factura'); // Usa el mismo endpoint
+        uploadFile(file, 'factura').then(data => { // Usa el mismo endpoint
+            if (!data || state.ocFile !== file) return;
+            state.ocFilename = data.factura;
+            elements.btnSearchProvider.disabled = false;
+        });
     }
 }
 
@@ -185,14 +197,16 @@ async function uploadFile(file, fieldName) {
         if (!response.ok) throw new Error('Error al subir archivo');
         const data = await response.json();
         console.log('Archivo subido:', data);
+        return data;
     } catch (error) {
         console.error('Error:', error);
         alert('Error al subir archivo: ' + error.message);
+        return null;
     }
 }
 
 // ===== Procesamiento de Factura =====
-async function processInvoice() {
+function processInvoice() {
     if (!state.facturaFilename || state.processing) return;
 
     state.processing = true;
@@ -203,29 +217,50 @@ async function processInvoice() {
     elements.logsContainer.innerHTML = '';
     elements.resultsCard.style.display = 'none';
 
-    try {
-        const response = await fetch(`${API_BASE}/process`, {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({
-                factura_filename: state.facturaFilename
-            })
-        });
-
-        if (!response.ok) throw new Error('Error en el procesamiento');
-
-        const result = await response.json();
-        displayResults(result);
-        loadHistory();
+    // El backend emite el progreso por etapas (Server-Sent Events)
+    const url = `${API_BASE}/process_stream?factura_filename=${encodeURIComponent(state.facturaFilename)}`;
+    const source = new EventSource(url);
 
-    } catch (error) {
-        console.error('Error:', error);
-        addLog('error', 'Error en el procesamiento: ' + error.message);
-        alert('Error en el procesamiento: ' + error.message);
-    } finally {
+    const finish = () => {
+        source.close();
         state.processing = false;
         hideLoading();
-    }
+    };
+
+    source.onmessage = (e) => {
+        const evento = JSON.parse(e.data);
+
+        if (evento.etapa === 'fin') {
+            addLog(evento.nivel, `[${evento.resultado.success ? 'OK' : 'ERROR'}] Procesamiento finalizado`);
+            displayResults(evento.resultado);
+            loadHistory();
+            finish();
+            return;
+        }
+
+        if (evento.etapa === 'error') {
+            addLog('error', 'Error en el procesamiento: ' + evento.mensaje);
+            alert('Error en el procesamiento: ' + evento.mensaje);
+            finish();
+            return;
+        }
+
+        const parte = evento.parte ? `[Factura ${evento.parte}] ` : '';
+        addLog(evento.nivel, `(${evento.t.toFixed(1)}s) ${parte}${evento.mensaje}`);
+        elements.loadingText.textContent = parte + evento.mensaje;
+
+        // Resultado parcial: la cabecera extraída aparece antes de terminar la integración a BD
+        if (evento.etapa === 'extraccion' && evento.cabecera && !evento.parte) {
+            hideLoading();
+            displayPartialExtraction(evento.cabecera);
+        }
+    };
+
+    source.onerror = () => {
+        if (!state.processing) return;
+        addLog('error', 'Se perdió la conexión con el servidor');
+        finish();
+    };
 }
 
 async function extractOnly() {
@@ -304,8 +339,31 @@ async function searchProvider() {
 function displayResults(result) {
     elements.resultsCard.style.display = 'block';
 
+    // PDF con varias facturas: un resumen por cada una
+    if (result.resultados) {
+        let html = `<div class="alert alert-${result.success ? 'success' : 'warning'}"><i class="fas fa-layer-group"></i> El PDF contenía ${result.partes} facturas</div>`;
+        result.resultados.forEach(parte => {
+            html += `<h3>Factura ${parte.documento.parte} (págs. ${parte.documento.paginas.join(', ')})</h3>`;
+            html += resultHtml(parte);
+        });
+        elements.resultDetails.innerHTML = html;
+        return;
+    }
+
+    elements.resultDetails.innerHTML = resultHtml(result);
+}
+
+function resultHtml(result) {
     let html = '<div class="result-summary">';
 
+    if (result.duplicado_de) {
+        html += `<div class="alert alert-warning"><i class="fas fa-copy"></i> Este archivo ya había sido procesado (${result.duplicado_de}): se muestra el resultado anterior</div>`;
+    }
+
+    if (result.posible_duplicado) {
+        html += `<div class="alert alert-warning"><i class="fas fa-clone"></i> Posible re-escaneo de una factura ya procesada (${result.posible_duplicado.resultado})</div>`;
+    }
+
     if (result.success) {
         html += '<div class="alert alert-success"><i class="fas fa-check-circle"></i> Factura procesada exitosamente</div>';
     } else {
@@ -336,6 +394,19 @@ function displayResults(result) {
     }
 
     html += '</div>';
+    return html;
+}
+
+function displayPartialExtraction(cabecera) {
+    elements.resultsCard.style.display = 'block';
+    const factura = cabecera.factura || {};
+    const proveedor = cabecera.proveedor || {};
+
+    let html = '<div class="alert alert-warning"><i class="fas fa-spinner fa-spin"></i> Guardando en base de datos...</div>';
+    html += '<h4><i class="fas fa-file-invoice"></i> Cabecera Extraída:</h4>';
+    html += `<p><strong>${proveedor.nombre || 'N/A'}</strong> (CUIT ${proveedor.cuit || 'N/A'})</p>`;
+    html += `<p>${factura.tipo_comprobante || ''} ${factura.punto_emision || ''}-${factura.numero_comprobante || ''} | `;
+    html += `Fecha: ${factura.fecha_emision || 'N/A'} | Total: $${Number(factura.importe_total || 0).toFixed(2)}</p>`;
     elements.resultDetails.innerHTML = html;
 }
 
@@ -451,7 +522,8 @@ async function loadHistory() {
     }
 }
 
-function displayHistory(history) {
+function displayHistory(page) {
+    const history = page && page.items;
     if (!history || history.length === 0) {
         elements.historyList.innerHTML = '<p class="empty-state">No hay facturas procesadas aún</p>';
         return;
@@ -478,6 +550,10 @@ function displayHistory(history) {
         `;
     });
 
+    if (page.total > history.length) {
+        html += `<p class="empty-state">Mostrando ${history.length} de ${page.total} resultados</p>`;
+    }
+
     elements.historyList.innerHTML = html;
 }
 